@@ -0,0 +1,191 @@
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import typer
+from wasabi import Printer, table
+
+from parseepo import iter_patents
+from parseepo.metrics import peak_rss_mb
+from parseepo.process import get_serializer, process_epo_file
+from parseepo.synthetic import generate_epo_file
+from parseepo.writer import get_encoder
+
+msg = Printer()
+app = typer.Typer()
+METRICS = ["patents/s", "MB/s", "peak_rss_mb"]
+MB = 1024 * 1024
+
+
+def read(file, tmp, **kwargs):
+    return sum(1 for _ in iter_patents(file, **kwargs))
+
+
+def serialize(file, tmp, **kwargs):
+    serializer = get_serializer(**kwargs)
+    return sum(1 for data in iter_patents(file) if serializer(data))
+
+
+def encode(file, tmp):
+    serializer, encoder = get_serializer(), get_encoder("json")
+    return sum(1 for data in iter_patents(file) if encoder(serializer(data)))
+
+
+def end_to_end(file, tmp):
+    return process_epo_file(
+        file, os.path.join(tmp, "out.jsonl"), progress=queue.Queue()
+    )
+
+
+# Each stage streams the file through the pipeline up to (and including) the stage
+STAGES = {
+    "read": (read, {}),
+    "read-mmap": (read, {"reader": "mmap"}),
+    "serialize": (serialize, {}),
+    "serialize-pandas": (serialize, {"engine": "pandas"}),
+    "html-fast": (serialize, {"handle_html": True, "html_engine": "fast"}),
+    "html-html2text": (serialize, {"handle_html": True}),
+    "encode": (encode, {}),
+    "end-to-end": (end_to_end, {}),
+}
+
+
+def run_stage(stage: str, file: str):
+    """
+    Run stage on file and return its metrics. Meant to be run in a fresh process so that
+    the peak RSS is the one of the stage.
+    :param stage: str, one of STAGES
+    :param file: str
+    :return: dict
+    """
+    func, kwargs = STAGES[stage]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        nb_patents = func(file, tmp, **kwargs)
+        elapsed = time.perf_counter() - start
+    return {
+        "patents/s": nb_patents / elapsed,
+        "MB/s": os.path.getsize(file) / MB / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Return the table rows of results vs baseline and the list of regressions (throughput
+    drop or peak RSS increase larger than tolerance)
+    :param results: dict, {stage: {metric: value}}
+    :param baseline: dict, {stage: {metric: value}}
+    :param tolerance: float, e.g. 0.1 for 10%
+    :return: Tuple[list, list]
+    """
+    rows, regressions = [], []
+    for stage, metrics in results.items():
+        row_ = [stage]
+        for metric in METRICS:
+            value, ref = metrics[metric], baseline.get(stage, {}).get(metric)
+            if ref:
+                delta = value / ref - 1
+                row_ += [f"{value:.1f} ({delta:+.0%})"]
+                lower_is_better = metric == "peak_rss_mb"
+                if (delta if lower_is_better else -delta) > tolerance:
+                    regressions += [f"{stage} {metric}"]
+            else:
+                row_ += [f"{value:.1f}"]
+        rows += [row_]
+    return rows, regressions
+
+
+@app.command()
+def generate(
+    dest: str,
+    nb_patents: int = typer.Option(10000, help="Number of patents"),
+    descr_length: int = typer.Option(10000, help="Median DESCR length (characters)"),
+    b_rate: float = typer.Option(
+        0.4, help="Share of granted patents (CLAIM in 3 langs)"
+    ),
+    amend_rate: float = typer.Option(0.05, help="Share of patents with AMEND"),
+    languages: str = typer.Option(
+        "en:0.7,de:0.2,fr:0.1", help="Procedure languages and weights"
+    ),
+    seed: int = typer.Option(0, help="Random seed"),
+):
+    """
+    Generate a synthetic EPO full-text file DEST (.txt or .txt.gz)
+    """
+    languages = {
+        lang: float(weight)
+        for lang, weight in (item.split(":") for item in languages.split(","))
+    }
+    nb_lines = generate_epo_file(
+        dest,
+        nb_patents,
+        seed=seed,
+        languages=languages,
+        descr_length=descr_length,
+        b_rate=b_rate,
+        amend_rate=amend_rate,
+    )
+    msg.good(f"{nb_patents} patents ({nb_lines} lines) written to {dest}")
+
+
+@app.command()
+def run(
+    file: str = typer.Option(None, help="EPO tsv file (default: synthetic file)"),
+    nb_patents: int = typer.Option(10000, help="Size of the synthetic file"),
+    stages: str = typer.Option(",".join(STAGES), help="Comma separated stages"),
+    save: str = typer.Option(None, help="Save the results as a baseline (json)"),
+    baseline: str = typer.Option(None, help="Compare the results to a baseline (json)"),
+    tolerance: float = typer.Option(0.1, help="Regression tolerance"),
+    repeat: int = typer.Option(1, help="Run each stage REPEAT times and keep the best"),
+):
+    """
+    Benchmark the serialization pipeline stage by stage (patents/s, MB/s, peak RSS).
+    Each stage runs in a fresh process (best of REPEAT runs). Exits with code 1 if a
+    regression vs BASELINE is found.
+    """
+    stages = stages.split(",")
+    assert all(
+        stage in STAGES for stage in stages
+    ), f"stages should be in {list(STAGES)}"
+    with tempfile.TemporaryDirectory() as tmp:
+        if file is None:
+            file = os.path.join(tmp, "EP0600000.txt")
+            generate_epo_file(file, nb_patents)
+        size = os.path.getsize(file) / MB
+        msg.info(f"Benchmarking {file} ({size:.1f} MB)")
+        results = {}
+        context = multiprocessing.get_context("spawn")
+        for stage in stages:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs += [pool.submit(run_stage, stage, file).result()]
+            results[stage] = max(runs, key=lambda metrics: metrics["patents/s"])
+    ref = {}
+    if baseline:
+        with open(baseline, "r") as fin:
+            ref = json.load(fin)["stages"]
+    rows, regressions = compare(results, ref, tolerance)
+    print(table(rows, header=["stage"] + METRICS, divider=True))
+    if save:
+        meta = {
+            "size_mb": size,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        }
+        with open(save, "w") as fout:
+            json.dump({"meta": meta, "stages": results}, fout, indent=1)
+        msg.good(f"Baseline saved to {save}")
+    if regressions:
+        msg.fail(f"Regressions (> {tolerance:.0%}): {', '.join(regressions)}")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
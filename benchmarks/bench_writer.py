@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+
+import typer
+from smart_open import open
+from wasabi import Printer, table
+
+from parseepo import iter_serialized
+from parseepo.writer import ENCODERS, BufferedWriter, get_encoder
+
+msg = Printer()
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "io", "sampleEP0600000.txt")
+
+
+def bench(patents: list, encoder: str, batch_size: int, dest: str, repeat: int):
+    """
+    Return the number of patents encoded and written per second
+    :param patents: List[dict], serialized patents
+    :param encoder: str
+    :param batch_size: int, 1 is equivalent to one write per patent
+    :param dest: str, output file (.gz to go through smart_open gzip stream)
+    :param repeat: int, number of times patents are written
+    :return: float
+    """
+    encode = get_encoder(encoder)
+    start = time.perf_counter()
+    with open(dest, "wb") as fout, BufferedWriter(fout, batch_size) as writer:
+        for _ in range(repeat):
+            for patent in patents:
+                writer.write(encode(patent))
+    return repeat * len(patents) / (time.perf_counter() - start)
+
+
+def main(
+    file: str = typer.Argument(SAMPLE, help="EPO tsv file"),
+    repeat: int = typer.Option(2000, help="Number of times the file is written"),
+    ext: str = typer.Option(".jsonl.gz", help="Output extension"),
+):
+    """
+    Benchmark json encoders and write batching on FILE
+    """
+    patents = list(iter_serialized(file))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for encoder in ENCODERS:
+            try:
+                get_encoder(encoder)
+            except ImportError as e:
+                msg.warn(e)
+                continue
+            for batch_size in [1, 100]:
+                dest = os.path.join(tmp, f"out{ext}")
+                speed = bench(patents, encoder, batch_size, dest, repeat)
+                rows += [(encoder, batch_size, f"{speed:.0f}")]
+    msg.info(f"{len(patents)} patents x {repeat} written to *{ext}")
+    print(table(rows, header=("encoder", "batch_size", "patents/s"), divider=True))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,4 @@
+from parseepo.cli import index_app as app
+
+if __name__ == "__main__":
+    app()
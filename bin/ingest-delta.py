@@ -0,0 +1,6 @@
+import typer
+
+from parseepo.cli import ingest
+
+if __name__ == "__main__":
+    typer.run(ingest)
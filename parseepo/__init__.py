@@ -1 +1,11 @@
 __version__ = "0.1.0"
+
+
+def __getattr__(name):
+    # iter_patents and iter_serialized are imported on first access, so that importing a
+    # parseepo module (e.g. the cli) does not import the reader and its dependencies
+    if name in ("iter_patents", "iter_serialized"):
+        from parseepo import reader
+
+        return getattr(reader, name)
+    raise AttributeError(f"module 'parseepo' has no attribute '{name}'")
@@ -0,0 +1,3 @@
+from parseepo.cli import app
+
+app(prog_name="parseepo")
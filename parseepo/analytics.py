@@ -0,0 +1,289 @@
+import csv
+import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import pandas as pd
+
+from parseepo.diagnostics import WARNINGS
+from parseepo.exception import RowException
+from parseepo.reader import COMPRESSED_EXT, open_bytes
+from parseepo.utils import prepare_name
+
+ATTRS = ["TITLE", "ABSTR", "DESCR", "CLAIM", "AMEND", "PDFEP"]
+BITS = {attr: 1 << i for i, attr in enumerate(ATTRS)}
+COLUMNS = [prepare_name(attr, True) for attr in ATTRS]
+
+
+def is_serialized(path: str):
+    """
+    Return True if path is a serialized (jsonl) file, False if it is an EPO tsv file
+    :param path: str, e.g. 'data/EP0600000.jsonl.gz'
+    :return: bool
+    """
+    for ext in COMPRESSED_EXT:
+        if path.endswith(ext):
+            path = path[: -len(ext)]
+    return path.endswith(".jsonl")
+
+
+@lru_cache(maxsize=1)
+def get_families(path: str):
+    """
+    Return the family id of each publication number (loaded once per process)
+    :param path: str, csv file with a header and 'publication_number', 'family_id' columns,
+    e.g. exported from patents-public-data.patents.publications
+    :return: dict, {publication_number: family_id}
+    """
+    with open(path, "r") as fin:
+        return {
+            row_["publication_number"]: row_["family_id"]
+            for row_ in csv.DictReader(fin)
+        }
+
+
+def iter_presence_tsv(path: str, on_error=None):
+    """
+    Lazily iterate over the attributes (with text) of each patent of an EPO tsv file. Only
+    the first six fields of the lines are split and the text is not decoded.
+    :param path: str
+    :param on_error: Callable[[Exception, int, int, str], None], if not None, malformed
+    lines (less than 7 fields) are passed to on_error and skipped instead of raising
+    RowException (see parseepo.reader.iter_patents)
+    :return: Iterator[Tuple[str, str, dict]], (publication_number, publication_date,
+    {attr: languages})
+    """
+    key, date, presence = None, None, {}
+    offset = 0
+    with open_bytes(path) as fin:
+        for number, line in enumerate(fin, 1):
+            offset += len(line)
+            pos = -1
+            for _ in range(6):
+                pos = line.find(b"\t", pos + 1)
+                if pos < 0:
+                    break
+            if pos < 0:
+                row_ = line.decode("utf-8", errors="replace")
+                e = RowException(f"Less than 7 fields in row {row_[:100]!r}")
+                if on_error is None:
+                    raise e
+                on_error(e, number, offset, row_)
+                continue
+            ep, num, kind, date_, lang, attr = line[:pos].decode("utf-8").split("\t")
+            key_ = f"{ep}-{num}-{kind}"
+            if key_ != key:
+                if key is not None:
+                    yield key, date, presence
+                key, date, presence = key_, date_, {}
+            if line[pos + 1 :].strip():
+                presence.setdefault(attr, set()).add(lang)
+    if key is not None:
+        yield key, date, presence
+
+
+def iter_presence_jsonl(path: str):
+    """
+    Lazily iterate over the attributes (with text) of each serialized patent, names prepared
+    for BQ compatibility or not
+    :param path: str
+    :return: Iterator[Tuple[str, str, dict]], (publication_number, publication_date,
+    {attr: languages})
+    """
+    with open_bytes(path) as fin:
+        for line in fin:
+            patent = json.loads(line)
+            presence = {}
+            for attr in ATTRS:
+                value = patent.get(attr) or patent.get(prepare_name(attr, True))
+                if not value:
+                    continue
+                texts, languages = value.get("text"), value.get("language")
+                texts = texts if isinstance(texts, list) else [texts]
+                languages = languages if isinstance(languages, list) else [languages]
+                if any(texts):
+                    presence[attr] = {
+                        lang for lang, text in zip(languages, texts) if text
+                    }
+            yield patent["publication_number"], patent["publication_date"], presence
+
+
+class Coverage:
+    """
+    One-pass aggregates of the EPO full-text data, equivalent to the EDA queries of
+    eda/queries.py. The memory is bounded by the number of families (a few integers per
+    family), not by the text.
+
+    A family is assigned to the year of its first appearance in the data and has an
+    attribute if at least min_publications of its publications have it. The default, 2,
+    matches eda.queries.query_nb_full_text_epo (`SUM(CAST(has_<attr> AS INT64)) > 1`), a
+    family with a single publication never has any attribute. Use 1 to count the families
+    with at least one publication with the attribute. Families are the ids of the families
+    csv if any (see get_families), else the EP publication number without kind code (i.e.
+    the A and B publications of the same application).
+    """
+
+    def __init__(self, families: str = None, min_publications: int = 2):
+        """
+        :param families: str, csv of the family id of each publication number
+        :param min_publications: int, 1 or 2, min number of publications of a family with
+        an attribute for the family to have it
+        """
+        assert min_publications in [1, 2], "min_publications should be 1 or 2"
+        self.families_ = families
+        self.min_publications = min_publications
+        self.nb_pubnum = Counter()  # {year: nb}
+        self.languages = Counter()  # {(year, attr, language): nb}
+        self.nb_malformed = 0  # tsv lines skipped
+        # {family: [year, mask, mask2, en_year, en_mask, en_mask2]}, mask(2): attributes
+        # of at least one (two) publication(s)
+        self.families = {}
+
+    def get_family(self, publication_number: str):
+        family = None
+        if self.families_:
+            family = get_families(self.families_).get(publication_number)
+        return family if family else publication_number.rsplit("-", 1)[0]
+
+    def add(self, publication_number: str, publication_date: str, presence: dict):
+        """
+        :param publication_number: str, e.g. 'EP-0600083-A1'
+        :param publication_date: str, e.g. '1994-06-08'
+        :param presence: dict, {attr: languages} of the attributes with text
+        """
+        year = int(publication_date[:4])
+        self.nb_pubnum[year] += 1
+        mask = 0
+        for attr, languages in presence.items():
+            mask |= BITS.get(attr, 0)
+            for lang in languages:
+                self.languages[(year, attr, lang)] += 1
+        english = "en" in presence.get("DESCR", ())
+        en_mask = mask if english else 0
+        self._update(
+            self.get_family(publication_number),
+            [year, mask, 0, year if english else None, en_mask, 0],
+        )
+
+    def _update(self, family, state: list):
+        current = self.families.get(family)
+        if current is None:
+            self.families[family] = state
+            return
+        year, mask, mask2, en_year, en_mask, en_mask2 = state
+        current[0] = min(current[0], year)
+        current[2] |= mask2 | (current[1] & mask)
+        current[1] |= mask
+        if en_year is not None:
+            current[3] = en_year if current[3] is None else min(current[3], en_year)
+        current[5] |= en_mask2 | (current[4] & en_mask)
+        current[4] |= en_mask
+
+    def merge(self, other: "Coverage"):
+        """
+        Merge the aggregates of other (e.g. another file) in place
+        :param other: Coverage
+        :return: Coverage
+        """
+        self.nb_pubnum.update(other.nb_pubnum)
+        self.languages.update(other.languages)
+        self.nb_malformed += other.nb_malformed
+        for family, state in other.families.items():
+            self._update(family, list(state))
+        return self
+
+    def nb_pubnum_df(self):
+        """
+        Return the number of publications by year, see eda.queries.query_nb_pubnum_epo
+        :return: pd.DataFrame, columns ['year', 'nb_pubnum']
+        """
+        return pd.DataFrame(
+            sorted(self.nb_pubnum.items()), columns=["year", "nb_pubnum"]
+        )
+
+    def nb_family_df(self):
+        """
+        Return the number of families by year of first appearance, see
+        eda.queries.query_nb_famid_epo
+        :return: pd.DataFrame, columns ['year', 'nb_family']
+        """
+        nb_family = Counter(state[0] for state in self.families.values())
+        return pd.DataFrame(sorted(nb_family.items()), columns=["year", "nb_family"])
+
+    def nb_full_text_df(self, english: bool = False):
+        """
+        Return the number of families with each attribute by year of first appearance, see
+        eda.queries.query_nb_full_text_epo
+        :param english: bool, if True, only the patents with an english description count
+        :return: pd.DataFrame, columns ['year', 'nb_has_title', ..., 'nb_has_url']
+        """
+        year_, mask_ = (3, 4) if english else (0, 1)
+        mask_ += self.min_publications - 1
+        counts = {}
+        for state in self.families.values():
+            if state[year_] is None:
+                continue
+            row_ = counts.setdefault(state[year_], [0] * len(ATTRS))
+            for i, attr in enumerate(ATTRS):
+                row_[i] += bool(state[mask_] & BITS[attr])
+        return pd.DataFrame(
+            [[year] + row_ for year, row_ in sorted(counts.items())],
+            columns=["year"] + [f"nb_has_{column}" for column in COLUMNS],
+        )
+
+    def languages_df(self):
+        """
+        Return the number of publications with each attribute by year and language
+        :return: pd.DataFrame, columns ['year', 'attr', 'language', 'nb_pubnum']
+        """
+        return pd.DataFrame(
+            [[*key, nb] for key, nb in sorted(self.languages.items())],
+            columns=["year", "attr", "language", "nb_pubnum"],
+        )
+
+
+def aggregate_file(path: str, families: str = None, min_publications: int = 2):
+    """
+    Return the coverage aggregates of a serialized (jsonl) or EPO tsv file. Malformed tsv
+    lines are skipped with a (rate limited) warning and counted (see
+    Coverage.nb_malformed).
+    :param path: str, any path supported by smart_open
+    :param families: str, see Coverage
+    :param min_publications: int, see Coverage
+    :return: Coverage
+    """
+    coverage = Coverage(families, min_publications)
+
+    def on_error(e: Exception, line: int, offset: int, row: str):
+        coverage.nb_malformed += 1
+        WARNINGS.warn("malformed_row", f"{path}, line {line}: {e}")
+
+    if is_serialized(path):
+        patents = iter_presence_jsonl(path)
+    else:
+        patents = iter_presence_tsv(path, on_error)
+    for publication_number, publication_date, presence in patents:
+        coverage.add(publication_number, publication_date, presence)
+    return coverage
+
+
+def aggregate_files(
+    files: list, families: str = None, max_workers: int = 4, min_publications: int = 2
+):
+    """
+    Return the coverage aggregates of files, computed in a pool of processes and merged
+    :param files: List[str], serialized (jsonl) and/or EPO tsv files
+    :param families: str, see Coverage
+    :param max_workers: int
+    :param min_publications: int, see Coverage
+    :return: Coverage
+    """
+    coverage = Coverage(families, min_publications)
+    nb_files = len(files)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for coverage_ in pool.map(
+            aggregate_file, files, [families] * nb_files, [min_publications] * nb_files
+        ):
+            coverage.merge(coverage_)
+    return coverage
@@ -0,0 +1,481 @@
+"""
+The parseepo command line. Subcommands import the (heavy) modules they need when they run,
+so that the startup of the cli (and of commands which do not need pandas, jsonschema,
+html2text, ...) stays fast.
+"""
+
+import os
+from glob import glob
+
+import typer
+from wasabi import Printer, table
+
+from parseepo.lease import LEASE_TTL
+
+app = typer.Typer(help="EPO full-text for humans")
+index_app = typer.Typer(help="Build and query publication number indexes")
+app.add_typer(index_app, name="index")
+msg = Printer()
+
+
+def check_choice(value: str, choices, option: str):
+    """
+    Fail with a usage error if value is not one of choices
+    :param value: str
+    :param choices: Iterable[str]
+    :param option: str, e.g. '--executor'
+    """
+    if value not in choices:
+        raise typer.BadParameter(
+            f"should be one of {list(choices)}", param_hint=f"'{option}'"
+        )
+
+
+@app.command()
+def serialize(
+    path: str,
+    max_workers: int = typer.Option(4, help="Maximum number of workers allowed"),
+    executor: str = typer.Option(
+        "thread", help="Executor, 'thread' or 'process' (multi-core)"
+    ),
+    split: int = typer.Option(
+        1,
+        help="Split each local uncompressed file in SPLIT chunks (at publication "
+        "boundaries) serialized in parallel",
+    ),
+    stitch: bool = typer.Option(
+        True,
+        help="Concatenate the chunks of a split file (else, keep ordered part files)",
+    ),
+    shard_patents: int = typer.Option(
+        None, help="Roll each output to a new shard every SHARD_PATENTS patents"
+    ),
+    shard_bytes: int = typer.Option(
+        None, help="Roll each jsonl output to a new shard every SHARD_BYTES bytes"
+    ),
+    manifest: str = typer.Option(
+        None,
+        help="Run manifest (json). Completed files are skipped and interrupted files are "
+        "resumed from their last checkpoint",
+    ),
+    checkpoint_every: int = typer.Option(
+        1000, help="Checkpoint every CHECKPOINT_EVERY patents (with --manifest)"
+    ),
+    metrics: str = typer.Option(
+        None, help="Save a json report of the run (per stage timers, throughput, ...)"
+    ),
+    metrics_every: float = typer.Option(
+        None, help="Also save the report of each file every METRICS_EVERY seconds"
+    ),
+    profile: bool = typer.Option(
+        False, help="Profile each file (cProfile), stats saved in <output-file>.prof"
+    ),
+    validation: str = typer.Option(
+        None,
+        help="Validate the json schema of patents as they are serialized and save "
+        "the validation report (json)",
+    ),
+    stats: str = typer.Option(
+        None,
+        help="Save the stats of each file (<output-file>.stats.json) and their summary "
+        "(json)",
+    ),
+    attrs: str = typer.Option(
+        None, help="Comma separated EPO attributes to serialize (default all)"
+    ),
+    languages: str = typer.Option(
+        None, help="Comma separated languages of the rows to serialize (default all)"
+    ),
+    date_from: str = typer.Option(
+        None, help="Serialize patents published from DATE_FROM (YYYY-MM-DD, included)"
+    ),
+    date_to: str = typer.Option(
+        None, help="Serialize patents published up to DATE_TO (YYYY-MM-DD, included)"
+    ),
+    max_patent_size: int = typer.Option(
+        None,
+        help="Drop patents larger than MAX_PATENT_SIZE characters, handled as set by "
+        "--error-policy",
+    ),
+    stream_size: int = typer.Option(
+        None,
+        help="Write the json of patents with STREAM_SIZE characters of text or more "
+        "incrementally (jsonl)",
+    ),
+    sort: bool = typer.Option(
+        False,
+        help="Check that the rows of each patent are contiguous and, if not, sort the "
+        "file on disk before serializing it (files are not split)",
+    ),
+    sort_dir: str = typer.Option(
+        None, help="Directory of the temporary files of --sort (default: system tmp)"
+    ),
+    error_policy: str = typer.Option(
+        "fail",
+        help="Malformed rows and oversized patents: 'fail' (the file fails), 'skip' "
+        "(dropped) or 'quarantine' (dropped and saved to <output-file>.quarantine.jsonl)",
+    ),
+    lease_dir: str = typer.Option(
+        None,
+        help="Shared directory of the file leases, to distribute PATH between several "
+        "runs (e.g. nodes mounting the same NFS share)",
+    ),
+    lease_ttl: float = typer.Option(
+        LEASE_TTL, help="Seconds after which the lease of a dead run is reclaimed"
+    ),
+    reader: str = typer.Option(
+        "lines",
+        help="Reader, 'lines' (any file) or 'mmap' (memory mapped, local uncompressed "
+        "files, faster)",
+    ),
+    verbose: bool = typer.Option(False, help="Display info on-going process"),
+    prepare_names: bool = typer.Option(
+        False, help="Prepare names in line with BigQuery " "patents data standards"
+    ),
+    handle_html: bool = typer.Option(False, help="Handle html"),
+    html_engine: str = typer.Option(
+        "html2text",
+        help="Html engine, 'html2text' (reference) or 'fast' (tag stripper)",
+    ),
+    html_attrs: str = typer.Option(
+        None, help="Comma separated EPO attributes whose html is handled (default all)"
+    ),
+    html_workers: int = typer.Option(
+        1, help="Number of processes serializing the patents of each file"
+    ),
+    engine: str = typer.Option(
+        "python", help="Serializer engine, 'python' (fast) or 'pandas' (reference)"
+    ),
+    output_format: str = typer.Option(
+        "jsonl", "--format", help="Output format, 'jsonl' or 'parquet'"
+    ),
+    encoder: str = typer.Option(
+        "json", help="Json encoder, 'json' (stdlib), 'orjson' or 'ujson' (if installed)"
+    ),
+    batch_size: int = typer.Option(100, help="Max number of patents per write"),
+    buffer_size: int = typer.Option(
+        None, help="Max number of bytes per write (default: 4MB)"
+    ),
+    codec: str = typer.Option(
+        None,
+        help="Jsonl compression, 'gzip', 'zstd' or 'none' (default: same as the input)",
+    ),
+    level: int = typer.Option(
+        None, help="Jsonl compression level (default: 6 for gzip, 3 for zstd)"
+    ),
+    compress_threads: int = typer.Option(
+        1, help="Number of threads compressing each jsonl output"
+    ),
+    compression: str = typer.Option(
+        "snappy", help="Parquet compression (snappy, gzip, zstd, brotli, none)"
+    ),
+    row_group_size: int = typer.Option(10000, help="Parquet row group size (patents)"),
+):
+    """
+    Process epo full-text files in PATH using a pool of processes (or threads)
+
+    Each file is serialized and the output is saved in the same PATH under <epo-file-name>.jsonl(
+    .<suffix>) (or <epo-file-name>.parquet)
+    """
+    from parseepo.diagnostics import ERROR_POLICIES
+    from parseepo.markup import HTML_ENGINES
+    from parseepo.process import EXECUTORS, process_epo_files
+    from parseepo.reader import READERS
+    from parseepo.serialize import ENGINES
+    from parseepo.writer import (
+        BUFFER_SIZE,
+        CODECS,
+        ENCODERS,
+        FORMATS,
+        get_compressor,
+        get_encoder,
+    )
+
+    check_choice(engine, ENGINES, "--engine")
+    check_choice(executor, EXECUTORS, "--executor")
+    check_choice(output_format, FORMATS, "--format")
+    check_choice(error_policy, ERROR_POLICIES, "--error-policy")
+    check_choice(reader, READERS, "--reader")
+    check_choice(html_engine, HTML_ENGINES, "--html-engine")
+    check_choice(encoder, ENCODERS, "--encoder")
+    if codec:
+        check_choice(codec, CODECS, "--codec")
+    try:  # fail early if the encoder or the compressor is not installed
+        get_encoder(encoder)
+        if codec and codec != "none":
+            get_compressor(codec)
+    except ImportError as e:
+        msg.fail(str(e), exits=1)
+    files = glob(path)
+    results, errors = process_epo_files(
+        files,
+        max_workers=max_workers,
+        executor=executor,
+        split=split,
+        stitch_parts=stitch,
+        shard_patents=shard_patents,
+        shard_bytes=shard_bytes,
+        manifest=manifest,
+        checkpoint_every=checkpoint_every,
+        metrics=metrics,
+        metrics_every=metrics_every,
+        profile=profile,
+        validation=validation,
+        stats=stats,
+        attrs=attrs.split(",") if attrs else None,
+        languages=languages.split(",") if languages else None,
+        date_from=date_from,
+        date_to=date_to,
+        max_patent_size=max_patent_size,
+        stream_size=stream_size,
+        sort=sort,
+        sort_dir=sort_dir,
+        error_policy=error_policy,
+        lease_dir=lease_dir,
+        lease_ttl=lease_ttl,
+        reader=reader,
+        verbose=verbose,
+        prepare_names=prepare_names,
+        handle_html=handle_html,
+        html_engine=html_engine,
+        html_attrs=html_attrs.split(",") if html_attrs else None,
+        html_workers=html_workers,
+        engine=engine,
+        encoder=encoder,
+        batch_size=batch_size,
+        buffer_size=buffer_size or BUFFER_SIZE,
+        output_format=output_format,
+        codec=codec,
+        level=level,
+        compress_threads=compress_threads,
+        compression=compression,
+        row_group_size=row_group_size,
+    )
+    msg.info(f"{sum(results.values())} patents serialized from {len(results)} file(s).")
+    if errors:
+        msg.fail(f"{len(errors)} file(s) failed: {', '.join(sorted(errors))}")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def validate(
+    path: str,
+    prepare_names: bool = typer.Option(
+        False, help="Prepare names in line with BigQuery " "patents data standards"
+    ),
+    max_workers: int = typer.Option(4, help="Maximum number of workers allowed"),
+    max_examples: int = typer.Option(10, help="Number of errors reported in full"),
+    report: str = typer.Option(None, help="Save the validation report (json)"),
+):
+    """
+    Validate the json schema of the serialized patents in PATH (in parallel)
+    """
+    from parseepo.manifest import write_json
+    from parseepo.validate import validate_files
+
+    files = glob(path)
+    summary, reports = validate_files(files, prepare_names, max_examples, max_workers)
+    if report:
+        write_json({"total": summary, "files": reports}, report)
+    msg.info(f"{summary['nb_patents']} patents validated in {len(files)} file(s).")
+    if not summary["nb_errors"]:
+        msg.good("No schema error.")
+        return
+    print(table(sorted(summary["errors"].items()), header=("error", "count")))
+    for example in summary["examples"]:
+        msg.warn(
+            example["message"],
+            text=f"FILE: {example['file']}\nLINE: {example['line']}\n"
+            f"PUBLICATION NUMBER: {example['publication_number']}",
+        )
+    msg.fail(f"{summary['nb_errors']} schema error(s).")
+    raise typer.Exit(code=1)
+
+
+@app.command()
+def schema(
+    dest: str,
+    prepare_names: bool = typer.Option(
+        False, help="Prepare names in line with BigQuery " "patents data standards"
+    ),
+    attrs: str = typer.Option(
+        None,
+        help="Comma separated EPO attributes serialized (see serialize --attrs)",
+    ),
+):
+    """
+    Save the BigQuery json schema of the serialized data to DEST
+    """
+    from parseepo.schema import write_bq_schema
+
+    write_bq_schema(dest, prepare_names, attrs.split(",") if attrs else None)
+    if os.path.isfile(dest):
+        msg.good(f"Schema successfully generated and saved to {dest}.")
+
+
+def create_sample_list(file, sort: bool = False):
+    """
+    Return the .txt sample
+    e.g.    EP  0700059 A1  1996-03-06  de  TITLE   Elektroma ...
+            EP  0700059 A1  1996-03-06  en  TITLE   Electroma...
+    in a list format
+    e.g.    [[['EP','0700059 A1','1996-03-06','de','TITLE',' Elektroma...'],
+            ['EP','0700059 A1','1996-03-06','en','TITLE',' Electroma...'],
+            ...
+    with the following schema [Publication Number[Row[...]]]
+    :param file: str, file path (e.g. 'data/sampleEP0600000.txt'), any path supported by
+    smart_open
+    :param sort: bool, if True, rows are sorted by publication number if they are not
+    grouped (see parseepo.reader.sort_epo_file)
+    :return: list
+    """
+    from parseepo.reader import iter_patents
+
+    return list(iter_patents(file, validate_rows=False, sort=sort))  # rows as is
+
+
+@app.command()
+def sample(
+    file: str,
+    dest: str,
+    sort: bool = typer.Option(
+        False, help="Sort the rows by publication number if they are not grouped"
+    ),
+):
+    """
+    Create and save the patents of FILE as a (pickled) list to DEST
+    """
+    import pickle
+
+    from smart_open import open
+
+    list_ = create_sample_list(file, sort)
+    pickle.dump(list_, open(dest, "wb"))
+
+
+@index_app.command()
+def build(
+    path: str,
+    dest: str,
+    kind: str = typer.Option(
+        None,
+        help="'tsv' (EPO files) or 'jsonl' (serialized files), inferred by default",
+    ),
+    max_workers: int = typer.Option(4, help="Maximum number of workers allowed"),
+):
+    """
+    Build the publication number index of the files in PATH and save it to DEST
+    """
+    from parseepo.index import build_index
+
+    files = sorted(glob(path))
+    nb_records = build_index(files, dest, kind=kind, max_workers=max_workers)
+    msg.good(f"{nb_records} publications from {len(files)} file(s) indexed in {dest}.")
+
+
+@index_app.command()
+def lookup(index: str, publication_number: str):
+    """
+    Print the raw rows (tsv index) or the serialized record (jsonl index) of
+    PUBLICATION_NUMBER (e.g. EP-0600083-A1)
+    """
+    import json
+
+    from parseepo.index import Index
+
+    with Index(index) as index_:
+        out = index_.lookup(publication_number)
+    if not out:
+        msg.fail(f"{publication_number} not found in {index}.")
+        raise typer.Exit(code=1)
+    for record in out:
+        if index_.kind == "jsonl":
+            typer.echo(json.dumps(record, ensure_ascii=False))
+        else:
+            typer.echo("".join("\t".join(row_) for row_ in record), nl=False)
+
+
+@app.command()
+def stats(
+    path: str,
+    dest: str = typer.Option(".", help="Folder where the csv tables are saved"),
+    families: str = typer.Option(
+        None,
+        help="Csv of the family_id of each publication_number (default: EP number "
+        "without kind code)",
+    ),
+    max_workers: int = typer.Option(4, help="Maximum number of workers allowed"),
+    min_publications: int = typer.Option(
+        2,
+        help="Min number of publications of a family with an attribute for the family "
+        "to have it, 2 as in eda/queries.py (SUM(...) > 1) or 1",
+    ),
+):
+    """
+    Compute the coverage tables of the EDA (eda/queries.py) from the serialized (jsonl) or
+    EPO tsv files in PATH, locally and in one pass
+
+    Tables are saved in DEST as nb_pubnum.csv, nb_family.csv, nb_full_text.csv,
+    nb_full_text_en.csv and languages.csv
+    """
+    from parseepo.analytics import aggregate_files
+
+    files = glob(path)
+    coverage = aggregate_files(files, families, max_workers, min_publications)
+    if coverage.nb_malformed:
+        msg.warn(f"{coverage.nb_malformed} malformed line(s) skipped")
+    tables = {
+        "nb_pubnum": coverage.nb_pubnum_df(),
+        "nb_family": coverage.nb_family_df(),
+        "nb_full_text": coverage.nb_full_text_df(),
+        "nb_full_text_en": coverage.nb_full_text_df(english=True),
+        "languages": coverage.languages_df(),
+    }
+    os.makedirs(dest, exist_ok=True)
+    for name, df in tables.items():
+        df.to_csv(os.path.join(dest, f"{name}.csv"), index=False)
+    msg.good(
+        f"{len(coverage.families)} families ({sum(coverage.nb_pubnum.values())} "
+        f"patents) from {len(files)} file(s), tables saved to {dest}"
+    )
+
+
+@app.command()
+def ingest(
+    path: str,
+    index: str = typer.Option(..., help="Jsonl index of the serialized corpus"),
+    partition: str = typer.Option(..., help="New partition (jsonl) of the inserts"),
+    changes: str = typer.Option(..., help="Change set (jsonl) of the batch"),
+    max_workers: int = typer.Option(4, help="Maximum number of workers allowed"),
+    prepare_names: bool = typer.Option(
+        False, help="Prepare names in line with BigQuery " "patents data standards"
+    ),
+    handle_html: bool = typer.Option(False, help="Handle html"),
+    encoder: str = typer.Option(
+        "json", help="Json encoder, 'json', 'orjson' or 'ujson'"
+    ),
+):
+    """
+    Serialize the batch of EPO full-text files in PATH (e.g. a weekly update, files are
+    taken in alphabetical order) and upsert it in the serialized corpus indexed by INDEX
+
+    Updated patents are replaced in their partition, new patents are inserted in PARTITION
+    and the changed patents are saved in CHANGES (see <changes>.summary.json)
+    """
+    from parseepo.delta import get_summary, ingest_delta
+
+    files = sorted(glob(path))
+    summary = ingest_delta(
+        files,
+        index,
+        partition,
+        changes,
+        max_workers=max_workers,
+        prepare_names=prepare_names,
+        handle_html=handle_html,
+        encoder=encoder,
+    )
+    msg.good(
+        f"{summary['nb_inserted']} patent(s) inserted, {summary['nb_updated']} updated in "
+        f"{len(summary['partitions'])} partition(s). See {get_summary(changes)}."
+    )
@@ -0,0 +1,136 @@
+import os
+import shutil
+
+from smart_open import open
+
+from parseepo.index import PUBLICATION_NUMBER, Index, iter_entries, update_index
+from parseepo.manifest import write_json
+from parseepo.process import get_dest, process_epo_files
+from parseepo.reader import BLOCK_SIZE, open_bytes
+
+
+def get_summary(changes: str):
+    """
+    Return the path of the summary of the change set changes
+    :param changes: str, e.g. 'data/changes-2020-10-14.jsonl'
+    :return: str, e.g. 'data/changes-2020-10-14.jsonl.summary.json'
+    """
+    return f"{changes}.summary.json"
+
+
+def get_latest(files: list):
+    """
+    Return the location of the last record of each publication number in files (in order)
+    :param files: List[str], serialized jsonl files
+    :return: dict, {publication_number (bytes): (file, offset)}
+    """
+    latest = {}
+    for file in files:
+        for key, offset, _ in iter_entries(file, "jsonl"):
+            latest[key] = (file, offset)
+    return latest
+
+
+def copy_bytes(fin, fout, nb_bytes: int):
+    """
+    Copy nb_bytes from fin to fout
+    """
+    while nb_bytes > 0:
+        b = fin.read(min(nb_bytes, BLOCK_SIZE))
+        assert b, "unexpected end of file"
+        fout.write(b)
+        nb_bytes -= len(b)
+
+
+def rewrite_partition(file: str, edits: list):
+    """
+    Rewrite the serialized file with edits, in place (the file is rewritten to a temporary
+    file first). Records which are not edited are copied as is, in order.
+    :param file: str, local jsonl file (compressed or not)
+    :param edits: List[Tuple[int, int, bytes]], [(offset, length, record), ...], the record
+    at (offset, length) is replaced by record (deleted if None)
+    """
+    dirname, basename = os.path.split(file)
+    tmp = os.path.join(dirname, f".tmp.{basename}")
+    with open_bytes(file) as fin, open(tmp, "wb") as fout:
+        pos = 0
+        for offset, length, record in sorted(edits, key=lambda edit: edit[0]):
+            copy_bytes(fin, fout, offset - pos)
+            fin.read(length)
+            if record is not None:
+                fout.write(record)
+            pos = offset + length
+        shutil.copyfileobj(fin, fout)
+    os.replace(tmp, file)
+
+
+def ingest_delta(
+    files: list,
+    index: str,
+    partition: str,
+    changes: str,
+    max_workers: int = 4,
+    **kwargs,
+):
+    """
+    Serialize a batch of EPO tsv files (e.g. a weekly update) and upsert it in the corpus of
+    serialized files indexed by index (see parseepo.index.build_index, jsonl index):
+
+    - a publication number published several times in the batch is taken from the last
+    file (files order) and, in a file, from its last record (last write wins)
+    - publication numbers already in the corpus are updated in place, in their partition
+    (all the records of the publication number are replaced by the new one)
+    - new publication numbers are inserted in a new partition
+    - the changed records are saved to the change set changes, with a summary of the
+    inserted/updated patents and of the touched partitions (see get_summary)
+    - the index is updated (only the touched partitions are re-indexed)
+
+    :param files: List[str], EPO tsv files, in publication order
+    :param index: str, jsonl index of the corpus
+    :param partition: str, path of the new partition (jsonl, should not exist)
+    :param changes: str, path of the change set (jsonl)
+    :param max_workers: int
+    :param kwargs: passed to parseepo.process.process_epo_files (e.g. prepare_names), the
+    batch is serialized next to files
+    :return: dict, summary of the change set
+    """
+    assert not os.path.exists(partition), f"{partition} already exists"
+    _, errors = process_epo_files(files, max_workers=max_workers, **kwargs)
+    assert not errors, f"{len(errors)} file(s) of the batch failed"
+    deltas = [get_dest(src, "jsonl", kwargs.get("codec")) for src in files]
+    latest = get_latest(deltas)
+
+    nb_inserted, updates = 0, {}
+    with Index(index) as index_:
+        assert index_.kind == "jsonl", f"{index} is not a jsonl index"
+        with open(changes, "wb") as fchanges, open(partition, "wb") as fpartition:
+            for delta in deltas:
+                offset = 0
+                with open_bytes(delta) as fin:
+                    for line in fin:
+                        pos = line.rfind(b'"publication_number"')
+                        key = PUBLICATION_NUMBER.match(line, pos).group(1)
+                        if latest[key] == (delta, offset):
+                            fchanges.write(line)
+                            locations = index_.locate(key.decode("utf-8"))
+                            for i, (file, offset_, length) in enumerate(locations):
+                                edit = (offset_, length, line if i == 0 else None)
+                                updates.setdefault(file, []).append(edit)
+                            if not locations:
+                                fpartition.write(line)
+                                nb_inserted += 1
+                        offset += len(line)
+    for file, edits in updates.items():
+        rewrite_partition(file, edits)
+    partitions = sorted(updates) + ([partition] if nb_inserted else [])
+    if not nb_inserted:
+        os.remove(partition)
+    update_index(index, partitions, max_workers)
+    summary = {
+        "files": files,
+        "nb_inserted": nb_inserted,
+        "nb_updated": len(latest) - nb_inserted,
+        "partitions": partitions,
+    }
+    write_json(summary, get_summary(changes))
+    return summary
@@ -0,0 +1,167 @@
+import io
+import json
+import os
+import threading
+from collections import Counter
+
+from smart_open import open
+from wasabi import Printer
+
+msg = Printer()
+ERROR_POLICIES = ["fail", "skip", "quarantine"]
+WARN_LIMIT = 10
+
+
+def get_quarantine(dest: str):
+    """
+    Return the path of the quarantine file of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl'
+    :return: str, e.g. 'data/EP0600000.jsonl.quarantine.jsonl'
+    """
+    return f"{dest}.quarantine.jsonl"
+
+
+class RateLimitedWarnings:
+    """
+    Console warnings rate limited by kind: the first limit warnings of each kind are
+    displayed, the next ones are only counted.
+    """
+
+    def __init__(self, limit: int = WARN_LIMIT):
+        """
+        :param limit: int, max number of warnings displayed per kind
+        """
+        self.limit = limit
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def warn(self, kind: str, message: str):
+        """
+        :param kind: str, e.g. 'multi_value'
+        :param message: str
+        """
+        with self._lock:
+            self.counts[kind] += 1
+            count = self.counts[kind]
+        if count <= self.limit:
+            msg.warn(message)
+        if count == self.limit:
+            msg.warn(
+                f"{kind}: {self.limit} warnings displayed, the next ones are muted."
+            )
+
+
+WARNINGS = RateLimitedWarnings()  # per process
+
+
+class ErrorHandler:
+    """
+    Handle the malformed rows (and oversized patents) of a file according to the error
+    policy: 'fail' raises, 'skip' drops the row and 'quarantine' drops the row and saves it,
+    with its location and the error, to the quarantine file (jsonl, created at the first
+    error). Errors are counted by type.
+    """
+
+    def __init__(
+        self,
+        src: str,
+        policy: str = "fail",
+        quarantine: str = None,
+        offset: int = None,
+        counters: list = None,
+    ):
+        """
+        :param src: str
+        :param policy: str, one of ERROR_POLICIES
+        :param quarantine: str, path of the quarantine file (quarantine policy only)
+        :param offset: int, if not None, the quarantine file is truncated to offset bytes
+        and appended (e.g. resumed file, see checkpoint)
+        :param counters: List[Counter], also count the errors by type in counters (e.g.
+        the errors of parseepo.stats.Stats and parseepo.metrics.Metrics)
+        """
+        assert policy in ERROR_POLICIES, f"policy should be one of {ERROR_POLICIES}"
+        assert policy != "quarantine" or quarantine, "quarantine file required"
+        self.src, self.policy, self.quarantine = src, policy, quarantine
+        self.offset = offset
+        self.size = offset if offset else 0  # bytes in the quarantine file
+        self.errors = Counter()
+        self.counters = counters if counters else []
+        self._fout = None
+        self._records = []  # (row offset, error, quarantine size before the record)
+        if quarantine and os.path.isfile(quarantine):
+            if offset is None:
+                os.remove(quarantine)  # from a previous run
+            else:
+                with io.open(quarantine, "r+b") as fout:
+                    fout.truncate(offset)  # records written again when resumed
+
+    def __call__(self, e: Exception, line: int, offset: int, row: str):
+        """
+        :param e: Exception
+        :param line: int, line number (from the start offset of the job)
+        :param offset: int, (decompressed) byte offset following the row
+        :param row: str, the publication number for oversized patents
+        """
+        if self.policy == "fail":
+            raise e
+        for counter in [self.errors, *self.counters]:
+            counter[type(e).__name__] += 1
+        self._records.append((offset, type(e).__name__, self.size))
+        if self.policy == "quarantine":
+            if self._fout is None:
+                mode = "a" if self.offset else "w"
+                self._fout = open(self.quarantine, mode, encoding="utf-8")
+            record = {
+                "file": self.src,
+                "line": line,
+                "offset": offset,
+                "error": f"{type(e).__name__}: {e}",
+                "row": row,
+            }
+            record = json.dumps(record, ensure_ascii=False) + "\n"
+            self._fout.write(record)
+            self.size += len(record.encode("utf-8"))
+
+    def checkpoint(self, offset: int):
+        """
+        Flush the quarantine file and return its size and the errors counted up to offset.
+        The rows read ahead (e.g. the first row of the patent following offset) are dropped
+        again when the file is resumed from offset, their errors are returned apart.
+        :param offset: int, (decompressed) byte offset of the checkpoint
+        :return: Tuple[int, Counter], size of the quarantine file up to offset and errors
+        by type after offset
+        """
+        if self._fout is not None:
+            self._fout.flush()
+        size, ahead = self.size, Counter()
+        for offset_, error, size_ in reversed(self._records):
+            if offset_ <= offset:
+                break
+            size = size_
+            ahead[error] += 1
+        self._records = [record for record in self._records if record[0] > offset]
+        return size, ahead
+
+    @property
+    def nb_errors(self):
+        return sum(self.errors.values())
+
+    def close(self):
+        """
+        Close the quarantine file and summarize the errors
+        """
+        if self._fout is not None:
+            self._fout.close()
+        if self.nb_errors:
+            where = f", see {self.quarantine}" if self.policy == "quarantine" else ""
+            errors = ", ".join(f"{error}: {nb}" for error, nb in self.errors.items())
+            msg.warn(
+                f"{self.src}: {self.nb_errors} row(s) or patent(s) dropped ({errors})"
+                f"{where}"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -4,3 +4,7 @@ class SingleAttrException(Exception):
 
 class RowException(Exception):
     pass
+
+
+class PatentSizeException(Exception):
+    pass
@@ -0,0 +1,240 @@
+import heapq
+import io
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from parseepo.reader import decode_line, open_bytes, publication_key
+
+MAGIC = b"EPOIDX1\n"
+RECORD = struct.Struct("<24sHQQ")  # publication number, file id, offset, length
+KINDS = ["tsv", "jsonl"]
+PUBLICATION_NUMBER = re.compile(rb'"publication_number": ?"([^"]+)"')
+
+
+def get_kind(file: str):
+    """
+    Return the kind of file, 'jsonl' for serialized files, 'tsv' for EPO full-text files
+    :param file: str
+    :return: str
+    """
+    return "jsonl" if ".jsonl" in os.path.basename(file) else "tsv"
+
+
+def iter_entries(file: str, kind: str):
+    """
+    Lazily iterate over the (publication_number, offset, length) entries of file. Offsets
+    are (decompressed) byte offsets.
+    :param file: str, EPO tsv file or serialized jsonl file
+    :param kind: str, 'tsv' or 'jsonl'
+    :return: Iterator[Tuple[bytes, int, int]]
+    """
+    offset = 0
+    with open_bytes(file) as fin:
+        if kind == "jsonl":
+            for line in fin:
+                pos = line.rfind(b'"publication_number"')
+                if pos >= 0:
+                    key = PUBLICATION_NUMBER.match(line, pos).group(1)
+                    yield key, offset, len(line)
+                offset += len(line)
+        else:
+            key, start = None, 0
+            for line in fin:
+                key_next = b"-".join(publication_key(line))
+                if key_next != key and key is not None:
+                    yield key, start, offset - start
+                    start = offset
+                key = key_next
+                offset += len(line)
+            if key is not None:
+                yield key, start, offset - start
+
+
+def index_file(file: str, file_id: int, kind: str, dest: str):
+    """
+    Write the sorted index records of file to dest
+    :param file: str
+    :param file_id: int, position of file in the index header
+    :param kind: str, 'tsv' or 'jsonl'
+    :param dest: str, local path of the run
+    :return: int, number of records
+    """
+    entries = sorted(iter_entries(file, kind))
+    with io.open(dest, "wb") as fout:
+        for key, offset, length in entries:
+            fout.write(RECORD.pack(key, file_id, offset, length))
+    return len(entries)
+
+
+def iter_records(run: str):
+    with io.open(run, "rb") as fin:
+        for record in iter(lambda: fin.read(RECORD.size), b""):
+            yield record
+
+
+def build_index(files: list, dest: str, kind: str = None, max_workers: int = 4):
+    """
+    Build the publication number index of files and save it to dest. Files are indexed in
+    parallel, each file is sorted independently and the sorted runs are merged so that memory
+    is bounded by the size of the largest file index.
+    :param files: List[str], EPO tsv files or serialized jsonl files (not both)
+    :param dest: str, local path of the index
+    :param kind: str, 'tsv' or 'jsonl', inferred from the first file if None
+    :param max_workers: int
+    :return: int, number of records
+    """
+    kind = kind if kind else get_kind(files[0])
+    assert kind in KINDS, f"kind should be one of {KINDS}"
+    files = [os.path.abspath(f) if os.path.isfile(f) else f for f in files]
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [os.path.join(tmp, f"{i}.run") for i in range(len(files))]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            nb_records = sum(
+                pool.map(
+                    index_file, files, range(len(files)), [kind] * len(files), runs
+                )
+            )
+        write_index(
+            dest, kind, files, heapq.merge(*[iter_records(run) for run in runs])
+        )
+    return nb_records
+
+
+def write_index(dest: str, kind: str, files: list, records):
+    """
+    Write the index dest (atomically, the index is written to a temporary file first)
+    :param dest: str
+    :param kind: str, 'tsv' or 'jsonl'
+    :param files: List[str], files of the index (file ids are positions in files)
+    :param records: Iterator[bytes], sorted RECORD packed records
+    """
+    header = json.dumps({"kind": kind, "files": files}).encode("utf-8")
+    with io.open(f"{dest}.tmp", "wb") as fout:
+        fout.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for record in records:
+            fout.write(record)
+    os.replace(f"{dest}.tmp", dest)
+
+
+def update_index(path: str, files: list, max_workers: int = 4):
+    """
+    Update the index path after files were modified or added. Only files are (re-)indexed,
+    the records of the other files are kept as is.
+    :param path: str, index built by build_index
+    :param files: List[str], modified files (already in the index) or new files
+    :param max_workers: int
+    :return: int, number of records
+    """
+    with Index(path) as index:
+        kind, index_files = index.kind, list(index.files)
+        files = [os.path.abspath(f) if os.path.isfile(f) else f for f in files]
+        index_files += [f for f in files if f not in index_files]
+        file_ids = [index_files.index(f) for f in files]
+        with tempfile.TemporaryDirectory() as tmp:
+            runs = [os.path.join(tmp, f"{i}.run") for i in file_ids]
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(index_file, files, file_ids, [kind] * len(files), runs))
+            modified = set(file_ids)
+            kept = (
+                record
+                for record in index.iter_records()
+                if RECORD.unpack(record)[1] not in modified
+            )
+            write_index(
+                path,
+                kind,
+                index_files,
+                heapq.merge(kept, *[iter_records(run) for run in runs]),
+            )
+    with Index(path) as index:
+        return len(index)
+
+
+class Index:
+    """
+    Publication number index built by build_index. Lookups are binary searches on the memory
+    mapped index.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: str, local path of the index
+        """
+        self._fin = io.open(path, "rb")
+        self._mm = mmap.mmap(self._fin.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._mm[: len(MAGIC)] == MAGIC, f"{path} is not a parseEPO index"
+        (size,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        self._start = len(MAGIC) + 4 + size
+        header = json.loads(self._mm[len(MAGIC) + 4 : self._start])
+        self.kind, self.files = header["kind"], header["files"]
+        self._nb_records = (len(self._mm) - self._start) // RECORD.size
+
+    def __len__(self):
+        return self._nb_records
+
+    def iter_records(self):
+        """
+        Iterate over the (sorted) packed records of the index
+        :return: Iterator[bytes]
+        """
+        for i in range(self._nb_records):
+            start = self._start + i * RECORD.size
+            yield self._mm[start : start + RECORD.size]
+
+    def _key(self, i):
+        return RECORD.unpack_from(self._mm, self._start + i * RECORD.size)[0]
+
+    def locate(self, publication_number: str):
+        """
+        Return the locations of publication_number
+        :param publication_number: str, e.g. 'EP-0600083-A1'
+        :return: List[Tuple[str, int, int]], [(file, offset, length), ...]
+        """
+        key = publication_number.encode("utf-8").ljust(24, b"\0")[:24]
+        lo, hi = 0, self._nb_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        out = []
+        while lo < self._nb_records and self._key(lo) == key:
+            _, file_id, offset, length = RECORD.unpack_from(
+                self._mm, self._start + lo * RECORD.size
+            )
+            out += [(self.files[file_id], offset, length)]
+            lo += 1
+        return out
+
+    def lookup(self, publication_number: str):
+        """
+        Return the raw rows (tsv index) or the serialized records (jsonl index) of
+        publication_number. Compressed files are decompressed up to the offset.
+        :param publication_number: str, e.g. 'EP-0600083-A1'
+        :return: List[List[List[str]]] (tsv) or List[dict] (jsonl)
+        """
+        out = []
+        for file, offset, length in self.locate(publication_number):
+            with open_bytes(file, offset) as fin:
+                raw = fin.read(length)
+            if self.kind == "jsonl":
+                out += [json.loads(raw)]
+            else:
+                out += [[decode_line(line).split("\t") for line in io.BytesIO(raw)]]
+        return out
+
+    def close(self):
+        self._mm.close()
+        self._fin.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
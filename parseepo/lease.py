@@ -0,0 +1,247 @@
+import io
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from wasabi import Printer
+
+from parseepo.manifest import read_json, write_json
+
+msg = Printer()
+LEASE_TTL = 600  # s
+POLL_EVERY = 10  # s, max wait between two claims of the tasks leased by other workers
+RECLAIM_GRACE = 1  # s, wait before a missing lease is lost (it may be being reclaimed)
+
+
+def get_owner():
+    """
+    Return a worker id unique across nodes and runs
+    :return: str, e.g. 'node-1-4242-9f1c2e3a'
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def get_task(src: str):
+    """
+    Return the task name of the source file src. Tasks are named after the file name so that
+    nodes mounting the shared storage at different paths agree on them.
+    :param src: str, e.g. '/mnt/bucket/EP0600000.txt.gz'
+    :return: str, e.g. 'EP0600000.txt.gz'
+    """
+    return os.path.basename(src)
+
+
+class Leases:
+    """
+    Leases on the tasks of a run shared by several workers (e.g. nodes mounting the same
+    NFS share) through a shared directory, without coordinator:
+
+    - a task is claimed by creating its lease file (<task>.lease) exclusively (O_EXCL)
+    - the leases held are renewed (mtime touched) every ttl / 3 by a heartbeat thread
+    - a lease which was not renewed for ttl seconds (e.g. dead worker) is expired and can be
+    reclaimed by another worker
+    - a completed task gets a completion marker (<task>.done) and its lease is released
+    - a lease reclaimed by another worker is lost, the task should not be completed (see
+    is_held)
+
+    Expiry compares the mtime of the lease with the clock of the worker, ttl should be
+    large compared to the clock skew between nodes (and to the latency of the storage).
+
+    The shared directory should support atomic exclusive creation, rename and hard links
+    (e.g. local or NFS file system). A bucket mounted with gcsfuse does not (renames are
+    copy and delete, no hard links), two workers could then hold the same lease.
+    """
+
+    def __init__(self, lease_dir: str, ttl: float = LEASE_TTL, owner: str = None):
+        """
+        :param lease_dir: str, shared directory (created if it does not exist)
+        :param ttl: float, lease time to live (s)
+        :param owner: str, worker id (default: see get_owner)
+        """
+        os.makedirs(lease_dir, exist_ok=True)
+        self.lease_dir, self.ttl = lease_dir, ttl
+        self.owner = owner if owner else get_owner()
+        self.held = set()
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def get_lease(self, task: str):
+        return os.path.join(self.lease_dir, f"{task}.lease")
+
+    def get_done(self, task: str):
+        return os.path.join(self.lease_dir, f"{task}.done")
+
+    def is_done(self, task: str):
+        """
+        :param task: str
+        :return: bool
+        """
+        return os.path.isfile(self.get_done(task))
+
+    def _read(self, lease: str):
+        try:
+            with io.open(lease, "r") as fin:
+                return fin.read(), os.fstat(fin.fileno()).st_mtime
+        except FileNotFoundError:
+            return None, None
+
+    def _reclaim(self, lease: str, content: str):
+        """
+        Remove the expired lease whose content was content. The lease is renamed first so
+        that a single worker removes it, and put back if it was renewed (touched or
+        re-created) in between. It is put back with a hard link, which fails instead of
+        overwriting the lease if another worker claimed the task since.
+        """
+        stale = f"{lease}.{self.owner}.stale"
+        try:
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return
+        content_, mtime = self._read(stale)
+        if content_ != content or time.time() - mtime <= self.ttl:
+            try:
+                os.link(stale, lease)
+            except FileExistsError:  # claimed by another worker since
+                pass
+            os.remove(stale)
+            return
+        os.remove(stale)
+        msg.warn(f"{os.path.basename(lease)}: expired lease reclaimed ({content}).")
+
+    def acquire(self, task: str):
+        """
+        Claim task, reclaiming its lease if it expired
+        :param task: str
+        :return: bool, True if the lease is held by this worker
+        """
+        if self.is_done(task):
+            return False
+        lease = self.get_lease(task)
+        for _ in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                content, mtime = self._read(lease)
+                if mtime is not None and time.time() - mtime <= self.ttl:
+                    return False
+                if content is not None:
+                    self._reclaim(lease, content)
+                continue
+            with io.open(fd, "w") as fout:
+                json.dump({"owner": self.owner, "task": task}, fout)
+            if self.is_done(task):  # completed in between
+                os.remove(lease)
+                return False
+            with self._lock:
+                self.held.add(task)
+                self.lost.discard(task)
+            return True
+        return False
+
+    def _touch(self, task: str):
+        """
+        Renew the lease of task
+        :param task: str
+        :return: bool, False if the lease is not owned by this worker anymore
+        """
+        lease = self.get_lease(task)
+        for retry in [False, True]:
+            if retry:  # the lease may be being reclaimed (and put back), see _reclaim
+                time.sleep(RECLAIM_GRACE)
+            content, _ = self._read(lease)
+            if content is None:
+                continue
+            try:
+                if json.loads(content)["owner"] != self.owner:
+                    return False
+                os.utime(lease)
+                return True
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                return False
+        return False
+
+    def _lose(self, tasks: list):
+        with self._lock:
+            self.held.difference_update(tasks)
+            self.lost.update(tasks)
+        for task in tasks:
+            msg.warn(f"{task}: lease lost, the task is left to the worker holding it.")
+
+    def renew(self):
+        """
+        Renew the leases held. Leases lost (reclaimed by another worker) are dropped and
+        their tasks marked as lost.
+        :return: List[str], tasks whose lease was lost
+        """
+        with self._lock:
+            held = list(self.held)
+        lost = [task for task in held if not self._touch(task)]
+        self._lose(lost)
+        return lost
+
+    def is_held(self, task: str):
+        """
+        Return True if the lease of task is (still) held by this worker, e.g. before
+        completing the task. A task whose lease was lost should not be completed (its
+        outputs are left to the worker holding the lease).
+        :param task: str
+        :return: bool
+        """
+        with self._lock:
+            if task not in self.held:
+                return False
+        if self._touch(task):
+            return True
+        self._lose([task])
+        return False
+
+    def release(self, task: str):
+        """
+        Release the lease of task (e.g. the task failed)
+        :param task: str
+        """
+        with self._lock:
+            self.held.discard(task)
+        content, _ = self._read(self.get_lease(task))
+        if content and json.loads(content)["owner"] == self.owner:
+            os.remove(self.get_lease(task))
+
+    def done(self, task: str, **info):
+        """
+        Publish the completion marker of task and release its lease
+        :param task: str
+        :param info: saved in the marker, e.g. dest, nb_patents
+        """
+        assert task not in self.lost, f"{task}: lease lost, can't be done"
+        write_json({"owner": self.owner, **info}, self.get_done(task))
+        self.release(task)
+
+    def get_marker(self, task: str):
+        """
+        Return the content of the completion marker of task, None if it is not done
+        :param task: str
+        :return: dict
+        """
+        return read_json(self.get_done(task))
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            self.renew()
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._heartbeat.join()
+        for task in list(self.held):
+            self.release(task)
@@ -0,0 +1,149 @@
+import hashlib
+import io
+import json
+import os
+
+SAMPLE_SIZE = 1024 * 1024
+
+
+def fingerprint(file: str, sample_size: int = SAMPLE_SIZE):
+    """
+    Return the fingerprint of a local file: size, mtime and the sha1 of its first and last
+    sample_size bytes (hashing multi-GB files in full would take as long as reading them).
+    Remote files have an empty fingerprint.
+    :param file: str
+    :param sample_size: int
+    :return: dict, e.g. {'size': 48020, 'mtime': 1581465600.0, 'hash': '6f1e...'}
+    """
+    if not os.path.isfile(file):
+        return {}
+    stat = os.stat(file)
+    sha1 = hashlib.sha1()
+    with io.open(file, "rb") as fin:
+        sha1.update(fin.read(sample_size))
+        if stat.st_size > sample_size:
+            fin.seek(max(stat.st_size - sample_size, sample_size))
+            sha1.update(fin.read())
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "hash": sha1.hexdigest()}
+
+
+def read_json(path: str, default=None):
+    """
+    Return the content of the json file path, default if it does not exist
+    :param path: str
+    :param default: any
+    :return: any
+    """
+    if not os.path.isfile(path):
+        return default
+    with io.open(path, "r") as fin:
+        return json.load(fin)
+
+
+def write_json(obj, path: str):
+    """
+    Write obj to the json file path atomically (write to a temporary file then rename it)
+    :param obj: any
+    :param path: str
+    """
+    tmp = f"{path}.tmp"
+    with io.open(tmp, "w") as fout:
+        json.dump(obj, fout, indent=1)
+    os.replace(tmp, path)
+
+
+def get_checkpoint(dest: str):
+    """
+    Return the path of the checkpoint of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl'
+    :return: str, e.g. 'data/EP0600000.jsonl.ckpt'
+    """
+    return f"{dest}.ckpt"
+
+
+def load_checkpoint(checkpoint: str, src_fingerprint: dict):
+    """
+    Return the checkpoint state, None if there is no checkpoint or if it was saved for a
+    different version of the source file
+    :param checkpoint: str
+    :param src_fingerprint: dict, see fingerprint
+    :return: dict, {'fingerprint': dict, 'offset': int, 'nb_patents': int, 'dest_size': int,
+    'stats': dict, 'quarantine_size': int}
+    """
+    state = read_json(checkpoint)
+    if state and state["fingerprint"] == src_fingerprint:
+        return state
+    return None
+
+
+def save_checkpoint(
+    checkpoint: str,
+    src_fingerprint: dict,
+    offset: int,
+    nb_patents: int,
+    dest_size: int,
+    stats: dict = None,
+    quarantine_size: int = 0,
+):
+    """
+    Save the checkpoint state
+    :param checkpoint: str
+    :param src_fingerprint: dict, see fingerprint
+    :param offset: int, byte offset of the last publication boundary flushed in src
+    :param nb_patents: int, number of patents written
+    :param dest_size: int, number of bytes written in dest
+    :param stats: dict, if not None, stats of the patents written (see
+    parseepo.stats.Stats.report), saved with the checkpoint so that they match its offset
+    :param quarantine_size: int, number of bytes of the quarantine file up to offset (see
+    parseepo.diagnostics.ErrorHandler.checkpoint)
+    """
+    write_json(
+        {
+            "fingerprint": src_fingerprint,
+            "offset": offset,
+            "nb_patents": nb_patents,
+            "dest_size": dest_size,
+            "stats": stats,
+            "quarantine_size": quarantine_size,
+        },
+        checkpoint,
+    )
+
+
+class Manifest:
+    """
+    Run manifest recording the files completely serialized, with the fingerprint of their
+    source. A file is done as long as its source has not changed.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: str, local json file (created if it does not exist)
+        """
+        self.path = path
+        self.files = read_json(path, {"files": {}})["files"]
+
+    def is_done(self, src: str):
+        """
+        :param src: str
+        :return: bool
+        """
+        entry = self.files.get(src)
+        return bool(entry) and entry["fingerprint"] == fingerprint(src)
+
+    def done(self, src: str, dest: str, nb_patents: int):
+        """
+        Record that src was serialized to dest and save the manifest
+        :param src: str
+        :param dest: str
+        :param nb_patents: int
+        """
+        self.files[src] = {
+            "fingerprint": fingerprint(src),
+            "dest": dest,
+            "nb_patents": nb_patents,
+        }
+        self.save()
+
+    def save(self):
+        write_json({"files": self.files}, self.path)
@@ -0,0 +1,68 @@
+import re
+import threading
+from html import unescape
+
+local = threading.local()
+HTML_ENGINES = ["html2text", "fast"]
+
+# EPO full-text fragments are XML-like: <p>, <heading>, <claim>, <claim-text>, <ul>/<li>,
+# <tables> (CALS <row>/<entry>), <maths> (MathML), <chemistry>, <img>, <b>, <i>, <sub>...
+COMMENTS = re.compile(r"<!--.*?-->", re.DOTALL)  # e.g. <!-- EPO <DP n="3"> -->
+BLOCK_TAGS = re.compile(
+    r"</?(?:p|heading|claim|claim-text|ul|ol|dl|li|dt|dd|tables|table|row|tr|maths"
+    r"|chemistry|figure|h[1-6]|div|pre|doc-page)(?:\s[^>]*)?/?>",
+    re.IGNORECASE,
+)
+LINE_TAGS = re.compile(r"<br\s*/?>", re.IGNORECASE)
+CELL_TAGS = re.compile(r"</(?:entry|td|th)>", re.IGNORECASE)
+TAGS = re.compile(r"<[^>]*>")
+SPACES = re.compile(r"[ \t\r\f\v\u00a0\u2000-\u200a]+")
+NEWLINES = re.compile(r" *\n[ \n]*")
+
+
+def html2text_handle(text: str):
+    """
+    Return the markdown of an html fragment using html2text. HTML2Text instances are
+    stateful and not thread safe, each thread gets its own.
+    :param text: str
+    :return: str
+    """
+    if not hasattr(local, "h"):
+        import html2text
+
+        local.h = html2text.HTML2Text()
+    return local.h.handle(text)
+
+
+def html_to_text(text: str):
+    """
+    Return the text of an EPO full-text html fragment. Tags are stripped with a few regex
+    passes (no DOM): block elements become paragraphs, <br/> line breaks and table cells are
+    separated by a space. Entities are unescaped and whitespace is collapsed. Unlike
+    html2text, lines are not wrapped and no markdown is generated.
+    :param text: str, e.g. '<p id="p0001" num="0001">This invention relates to ...</p>'
+    :return: str, e.g. 'This invention relates to ...'
+    """
+    text = COMMENTS.sub("", text)
+    text = BLOCK_TAGS.sub("\n\n", text)
+    text = LINE_TAGS.sub("\n", text)
+    text = CELL_TAGS.sub(" ", text)
+    text = unescape(TAGS.sub("", text))
+    text = SPACES.sub(" ", text)
+    text = NEWLINES.sub(lambda m: "\n\n" if m.group().count("\n") > 1 else "\n", text)
+    return text.strip() + "\n"
+
+
+def handle_html(attr: str, text: str, engine: str = "html2text", attrs: list = None):
+    """
+    Return the text of the html fragment of attribute attr
+    :param attr: str, EPO attribute, e.g. 'ABSTR'
+    :param text: str
+    :param engine: str, one of HTML_ENGINES
+    :param attrs: List[str], EPO attributes to convert (e.g. ['ABSTR', 'CLAIM']), other
+    attributes are returned as is. None for all attributes.
+    :return: str
+    """
+    if attrs is not None and attr not in attrs:
+        return text
+    return html2text_handle(text) if engine == "html2text" else html_to_text(text)
@@ -0,0 +1,180 @@
+import os
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+
+STAGES = ["read", "serialize", "html", "encode", "write"]
+MB = 1024 * 1024
+
+
+def get_metrics(dest: str):
+    """
+    Return the path of the metrics report of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl'
+    :return: str, e.g. 'data/EP0600000.jsonl.metrics.json'
+    """
+    return f"{dest}.metrics.json"
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size of the current process (MB)
+    :return: float
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / MB if sys.platform == "darwin" else maxrss / 1024  # bytes vs KB
+
+
+class Metrics:
+    """
+    Cheap timers and counters of the serialization of a file. Stages are timed by wrapping
+    the functions/iterators of the pipeline, so that nothing is measured when metrics are
+    disabled.
+
+    - read: reading, decompression, splitting and validation of the rows
+    - serialize: serialization of the rows
+    - html: html handling (in process only, see html_workers)
+    - encode: json encoding (jsonl only)
+    - write: buffering, compression and writing (excluding encode)
+    """
+
+    def __init__(self, src: str = None, dest: str = None):
+        """
+        :param src: str
+        :param dest: str, local dest to report the bytes out
+        """
+        self.src, self.dest = src, dest
+        self.start = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self.nb_patents, self.nb_lines, self.bytes_in = 0, 0, 0
+        self.largest = {"publication_number": None, "bytes": 0}
+        self.errors = Counter()  # {error: nb}, rows or patents dropped
+
+    def timed(self, func, stage: str):
+        """
+        Return func, timed as stage
+        :param func: Callable
+        :param stage: str
+        :return: Callable
+        """
+
+        def timed_func(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+
+        return timed_func
+
+    def timed_iter(self, iterable, stage: str):
+        """
+        Lazily iterate over iterable, the time spent computing each item is timed as stage
+        :param iterable: Iterable
+        :param stage: str
+        :return: Iterator
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+            yield item
+
+    def add_patent(self, publication_number: str, nb_lines: int, nb_bytes: int):
+        """
+        Count a patent serialized
+        :param publication_number: str
+        :param nb_lines: int
+        :param nb_bytes: int, (decompressed) size of the patent in the source file
+        """
+        self.nb_patents += 1
+        self.nb_lines += nb_lines
+        self.bytes_in += nb_bytes
+        if nb_bytes > self.largest["bytes"]:
+            self.largest = {"publication_number": publication_number, "bytes": nb_bytes}
+
+    def _is_file(self):
+        return self.dest is not None and os.path.isfile(self.dest)
+
+    def report(self):
+        """
+        Return the metrics report. Serialize is reported net of read and html and write net
+        of encode, so that stages add up (the rest is the overhead of the loop). Bytes out
+        is the size of dest (compressed) if it is a local file. The peak RSS is the one of
+        the process (shared by the jobs of a thread executor).
+        :return: dict
+        """
+        elapsed = time.perf_counter() - self.start
+        seconds = dict(self.seconds)
+        if "serialize" in seconds:
+            seconds["serialize"] -= seconds.get("read", 0) + seconds.get("html", 0)
+        if "write" in seconds:
+            seconds["write"] -= seconds.get("encode", 0)
+        return {
+            "src": self.src,
+            "dest": self.dest,
+            "elapsed": elapsed,
+            "nb_patents": self.nb_patents,
+            "nb_lines": self.nb_lines,
+            "bytes_in": self.bytes_in,
+            "bytes_out": os.path.getsize(self.dest) if self._is_file() else 0,
+            "patents/s": self.nb_patents / elapsed if elapsed else 0,
+            "MB/s": self.bytes_in / MB / elapsed if elapsed else 0,
+            "largest_patent": self.largest,
+            "errors": dict(self.errors),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {
+                stage: {"seconds": seconds[stage], "share": seconds[stage] / elapsed}
+                for stage in STAGES
+                if stage in seconds
+            },
+        }
+
+
+def merge_reports(reports: list, elapsed: float = None):
+    """
+    Merge the metrics reports of several files (or parts of a file). Throughputs are
+    computed over elapsed (wall clock of the run) if not None, else over the sum of the
+    elapsed times.
+    :param reports: List[dict], see Metrics.report
+    :param elapsed: float
+    :return: dict
+    """
+    elapsed = elapsed if elapsed else sum(report["elapsed"] for report in reports)
+    out = {"elapsed": elapsed}
+    for key in ["nb_patents", "nb_lines", "bytes_in", "bytes_out"]:
+        out[key] = sum(report[key] for report in reports)
+    out["patents/s"] = out["nb_patents"] / elapsed if elapsed else 0
+    out["MB/s"] = out["bytes_in"] / MB / elapsed if elapsed else 0
+    out["largest_patent"] = max(
+        [report["largest_patent"] for report in reports],
+        key=lambda largest: largest["bytes"],
+        default={"publication_number": None, "bytes": 0},
+    )
+    errors = Counter()
+    for report in reports:
+        errors.update(report.get("errors", {}))
+    out["errors"] = dict(errors)
+    out["peak_rss_mb"] = max(
+        [report.get("peak_rss_mb", 0) for report in reports], default=0
+    )
+    seconds = defaultdict(float)
+    for report in reports:
+        for stage, stats in report["stages"].items():
+            seconds[stage] += stats["seconds"]
+    total = sum(report["elapsed"] for report in reports)
+    out["stages"] = {
+        stage: {
+            "seconds": seconds[stage],
+            "share": seconds[stage] / total if total else 0,
+        }
+        for stage in STAGES
+        if stage in seconds
+    }
+    return out
@@ -0,0 +1,104 @@
+from datetime import date
+
+from smart_open import open
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    raise ImportError(
+        'pyarrow is required to write parquet files. Run `pip install "pyarrow>=7"`.'
+    )
+
+from parseepo.schema import bq_schema
+
+COMPRESSIONS = ["snappy", "gzip", "zstd", "brotli", "none"]
+ARROW_TYPES = {"STRING": pa.string(), "DATE": pa.date32()}
+
+
+def arrow_field(field: dict):
+    """
+    Return the arrow field equivalent to a BigQuery json schema field. RECORD fields are
+    structs and REPEATED fields are lists.
+    :param field: dict, see parseepo.schema.field
+    :return: pa.Field
+    """
+    if field["type"] == "RECORD":
+        type_ = pa.struct([arrow_field(f) for f in field["fields"]])
+    else:
+        type_ = ARROW_TYPES[field["type"]]
+    if field["mode"] == "REPEATED":
+        type_ = pa.list_(type_)
+    return pa.field(
+        field["name"], type_, metadata={"description": field["description"]}
+    )
+
+
+def arrow_schema(prepare_names: bool = False, attrs: list = None):
+    """
+    Return the arrow schema of the serialized EPO data, mirroring parseepo.schema.bq_schema
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :param attrs: List[str], attributes in the schema (default: all)
+    :return: pa.Schema
+    """
+    return pa.schema([arrow_field(field) for field in bq_schema(prepare_names, attrs)])
+
+
+class ParquetWriter:
+    """
+    Write serialized patents to a parquet file by row groups of row_group_size patents.
+    Attributes which are not in the schema are dropped.
+    """
+
+    def __init__(
+        self,
+        dest: str,
+        prepare_names: bool = False,
+        compression: str = "snappy",
+        row_group_size: int = 10000,
+        attrs: list = None,
+    ):
+        """
+        :param dest: str, local path or any path supported by smart_open
+        :param prepare_names: bool, True if names were prepared for BQ compatibility
+        :param compression: str, one of COMPRESSIONS
+        :param row_group_size: int, number of patents per row group
+        :param attrs: List[str], attributes in the schema (default: all)
+        """
+        assert (
+            compression in COMPRESSIONS
+        ), f"compression should be one of {COMPRESSIONS}"
+        self.schema = arrow_schema(prepare_names, attrs)
+        self.row_group_size = row_group_size
+        self._fout = open(dest, "wb")
+        self._writer = pq.ParquetWriter(
+            self._fout, self.schema, compression=compression
+        )
+        self._rows = []
+
+    def write(self, patent: dict):
+        """
+        :param patent: dict, returned by serialize_patent
+        """
+        patent = dict(patent)
+        patent["publication_date"] = date.fromisoformat(patent["publication_date"])
+        self._rows += [patent]
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            table = pa.Table.from_pylist(self._rows, schema=self.schema)
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        self._fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
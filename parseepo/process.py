@@ -0,0 +1,1018 @@
+import cProfile
+import io
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import nullcontext
+from functools import partial
+from multiprocessing import Manager
+
+from tqdm import tqdm
+from wasabi import Printer, table
+
+from parseepo.diagnostics import ErrorHandler, get_quarantine
+from parseepo.lease import LEASE_TTL, POLL_EVERY, Leases, get_task
+from parseepo.manifest import (
+    Manifest,
+    fingerprint,
+    get_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+    read_json,
+    write_json,
+)
+from parseepo.markup import handle_html as handle_html_
+from parseepo.metrics import Metrics, get_metrics, merge_reports
+from parseepo.reader import (
+    COMPRESSED_EXT,
+    estimate_size,
+    get_chunks,
+    is_splittable,
+    iter_patents,
+)
+from parseepo.serialize import ENGINES, multi_values
+from parseepo.stats import Stats, get_stats, merge_stats
+from parseepo.validate import (
+    ValidationReport,
+    get_validation,
+    merge_validation_reports,
+    offset_examples,
+)
+from parseepo.writer import CODECS, get_shards, get_writer, is_local
+
+msg = Printer()
+EXECUTORS = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}
+PROGRESS_EVERY = 1000
+REPORT_TOP = 20  # files in the end of run report
+MB = 1024 * 1024
+
+
+def milestone_msg(nb_patents_serialized, mile=10000):
+    if nb_patents_serialized % mile == 0:
+        msg.info(f"🎉 {nb_patents_serialized} patents serialized! You are on 🔥")
+    else:
+        pass
+
+
+def get_serializer(
+    prepare_names: bool = False,
+    handle_html: bool = False,
+    engine: str = "python",
+    html_engine: str = "html2text",
+    html_attrs: list = None,
+    metrics: Metrics = None,
+):
+    """
+    Return the (picklable) function serializing the rows of a patent
+    :param prepare_names: bool
+    :param handle_html: bool
+    :param engine: str, serializer engine (see parseepo.serialize.ENGINES)
+    :param html_engine: str, see parseepo.markup.HTML_ENGINES
+    :param html_attrs: List[str], EPO attributes whose html is handled, None for all
+    :param metrics: Metrics, if not None, html handling is timed (the serializer is then
+    not picklable)
+    :return: Callable[[list], dict]
+    """
+    if handle_html:
+        handle_html = partial(handle_html_, engine=html_engine, attrs=html_attrs)
+        if metrics:
+            handle_html = metrics.timed(handle_html, "html")
+    return partial(
+        ENGINES[engine], prepare_names=prepare_names, handle_html=handle_html
+    )
+
+
+def serialize_patents(patents, serializer, workers: int = 1, window: int = None):
+    """
+    Lazily serialize patents, in order. If workers > 1, patents are serialized by a pool of
+    processes (e.g. to handle html) and at most window patents are in flight.
+    :param patents: Iterator[Tuple[int, list]], (offset, rows), see iter_patents
+    :param serializer: Callable[[list], dict], see get_serializer
+    :param workers: int
+    :param window: int, defaults to 8 * workers
+    :return: Iterator[Tuple[int, list, dict]], (offset, rows, serialized patent)
+    """
+    if workers <= 1:
+        for offset, data in patents:
+            yield offset, data, serializer(data)
+        return
+    window = window if window else 8 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for offset, data in patents:
+            pending.append((offset, data, pool.submit(serializer, data)))
+            if len(pending) >= window:
+                offset_, data_, future = pending.popleft()
+                yield offset_, data_, future.result()
+        while pending:
+            offset_, data_, future = pending.popleft()
+            yield offset_, data_, future.result()
+
+
+def get_dest(src: str, output_format: str = "jsonl", codec: str = None):
+    """
+    Return the destination of the serialized src file
+    :param src: str, e.g. 'data/EP0600000.txt.gz'
+    :param output_format: str, 'jsonl' or 'parquet' (compressed internally)
+    :param codec: str, jsonl only, compression of the destination (see
+    parseepo.writer.CODECS). If None, the destination is compressed as src.
+    :return: str, e.g. 'data/EP0600000.jsonl.gz', 'data/EP0600000.parquet'
+    """
+    if output_format == "parquet" or codec:
+        for ext in COMPRESSED_EXT:
+            src = src[: -len(ext)] if src.endswith(ext) else src
+    dest = src.replace("txt", output_format)
+    return dest + CODECS[codec] if output_format == "jsonl" and codec else dest
+
+
+def get_part(dest: str, part: int):
+    """
+    Return the path of the part-th part file of dest. The part index is inserted before the
+    extensions so that the compression is inferred as for dest.
+    :param dest: str, e.g. 'data/EP0600000.jsonl.gz'
+    :param part: int, e.g. 1
+    :return: str, e.g. 'data/EP0600000.part00001.jsonl.gz'
+    """
+    dirname, basename = os.path.split(dest)
+    name, _, ext = basename.partition(".")
+    return os.path.join(dirname, f"{name}.part{part:05d}.{ext}")
+
+
+def stitch(parts: list, dest: str):
+    """
+    Concatenate the (local) part files in dest (in order) and remove them. Compressed parts
+    are concatenated as is (a concatenation of gzip members is a valid gzip file).
+    :param parts: List[str]
+    :param dest: str
+    """
+    with io.open(dest, "wb") as fout:
+        for part in parts:
+            with io.open(part, "rb") as fin:
+                shutil.copyfileobj(fin, fout)
+    for part in parts:
+        os.remove(part)
+
+
+def get_tmp(dest: str, owner: str):
+    """
+    Return the temporary path of dest written by owner (e.g. the run holding the lease of
+    the file, see publish). The owner is inserted before the extensions so that the format
+    and compression are inferred as for dest.
+    :param dest: str, e.g. 'data/EP0600000.jsonl.gz'
+    :param owner: str, e.g. 'node-1-4242-9f1c2e3a'
+    :return: str, e.g. 'data/EP0600000.tmp-node-1-4242-9f1c2e3a.jsonl.gz'
+    """
+    dirname, basename = os.path.split(dest)
+    name, _, ext = basename.partition(".")
+    return os.path.join(dirname, f"{name}.tmp-{owner.replace('.', '-')}.{ext}")
+
+
+def get_final(tmp: str):
+    """
+    Return the final path of the temporary path tmp (see get_tmp)
+    :param tmp: str, e.g. 'data/EP0600000.tmp-node-1-4242-9f1c2e3a.part00001.jsonl'
+    :return: str, e.g. 'data/EP0600000.part00001.jsonl'
+    """
+    dirname, basename = os.path.split(tmp)
+    name, _, ext = basename.split(".", 2)
+    return os.path.join(dirname, f"{name}.{ext}")
+
+
+def get_tmp_files(dest: str, owner: str = None):
+    """
+    Return the temporary outputs of dest (dest, parts, shards and sidecars, see get_tmp)
+    written by owner, by any owner if None
+    :param dest: str
+    :param owner: str
+    :return: List[str]
+    """
+    dirname, basename = os.path.split(dest)
+    name = basename.partition(".")[0]
+    # e.g. 'EP0600000.tmp-node-1-4242-9f1c2e3a.', 'EP0600000.tmp-'
+    prefix = get_tmp(name, owner) if owner else f"{name}.tmp-"
+    return [
+        os.path.join(dirname, file)
+        for file in sorted(os.listdir(dirname if dirname else "."))
+        if file.startswith(prefix)
+    ]
+
+
+def remove_files(files: list):
+    """
+    Remove files, if they still exist
+    :param files: List[str]
+    """
+    for file in files:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+
+def publish(dest: str, owner: str):
+    """
+    Move the temporary outputs of dest written by owner to their final paths (the paths of
+    the shard manifests are updated). Each output is replaced at once (os.replace), so that
+    the final paths never hold a partial output. The reports of the jobs (metrics,
+    validation) are left, they are collected at the end of the run.
+    :param dest: str
+    :param owner: str
+    :return: dict, {temporary path: final path}
+    """
+    renamed = {
+        tmp: get_final(tmp)
+        for tmp in get_tmp_files(dest, owner)
+        if not tmp.endswith((get_metrics(""), get_validation("")))
+    }
+    for tmp, path in renamed.items():
+        if tmp.endswith(get_shards("")):
+            shards = read_json(tmp)
+            shards["dest"] = get_final(shards["dest"])
+            for shard in shards["shards"]:
+                shard["path"] = get_final(shard["path"])
+            write_json(shards, path)
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    return renamed
+
+
+def merge_shards(parts: list, dest: str):
+    """
+    Merge the shard manifests of the part files of dest (in order) in the shard manifest of
+    dest and remove them
+    :param parts: List[str]
+    :param dest: str
+    """
+    shards = []
+    for part in parts:
+        shards += read_json(get_shards(part))["shards"]
+        os.remove(get_shards(part))
+    write_json(
+        {
+            "dest": dest,
+            "nb_patents": sum(shard["nb_patents"] for shard in shards),
+            "shards": shards,
+        },
+        get_shards(dest),
+    )
+
+
+def process_epo_file(
+    src: str,
+    dest: str,
+    verbose: bool = False,
+    prepare_names: bool = False,
+    handle_html: bool = False,
+    engine: str = "python",
+    html_engine: str = "html2text",
+    html_attrs: list = None,
+    html_workers: int = 1,
+    progress=None,
+    start: int = None,
+    end: int = None,
+    output_format: str = "jsonl",
+    checkpoint: str = None,
+    checkpoint_every: int = 1000,
+    metrics: str = None,
+    metrics_every: float = None,
+    profile: str = None,
+    validation: str = None,
+    stats: str = None,
+    attrs: list = None,
+    languages: list = None,
+    date_from: str = None,
+    date_to: str = None,
+    max_patent_size: int = None,
+    sort: bool = False,
+    sort_dir: str = None,
+    error_policy: str = "fail",
+    quarantine: str = None,
+    reader: str = "lines",
+    **writer_kwargs,
+):
+    """
+    Serialize the EPO full-text file src to dest (newline delimited json or parquet)
+    :param src: str, path to the EPO tsv file
+    :param dest: str, path to the output jsonl file
+    :param verbose: bool
+    :param prepare_names: bool, True if you want to prepare names for BQ compatibility
+    :param handle_html: bool, True if you want to handle html
+    :param engine: str, serializer engine (see parseepo.serialize.ENGINES)
+    :param html_engine: str, 'html2text' (reference) or 'fast' (see parseepo.markup)
+    :param html_attrs: List[str], EPO attributes whose html is handled (e.g. ['ABSTR',
+    'CLAIM']), None for all
+    :param html_workers: int, if > 1, patents are serialized by a pool of html_workers
+    processes (order is preserved)
+    :param progress: Queue, the number of (decompressed) bytes of src processed is put in
+    the queue every (about) PROGRESS_EVERY lines. If None, a tqdm counter is displayed
+    instead.
+    :param start: int, if not None, only the byte range [start, end) of src is serialized
+    (see parseepo.reader.get_chunks)
+    :param end: int
+    :param output_format: str, 'jsonl' or 'parquet'
+    :param checkpoint: str, if not None, path of the checkpoint saved every checkpoint_every
+    patents (jsonl only, local and not sharded dest). If the checkpoint exists and matches src, the
+    serialization is resumed at the last publication boundary flushed. The checkpoint is
+    removed once the file is completed.
+    :param checkpoint_every: int
+    :param metrics: str, if not None, path of the json metrics report (per stage timers,
+    throughput, largest patent, see parseepo.metrics.Metrics), saved at the end
+    :param metrics_every: float, if not None, the metrics report is also saved every
+    metrics_every seconds
+    :param profile: str, if not None, the serialization is profiled (cProfile) and the
+    stats are dumped to profile (see pstats)
+    :param validation: str, if not None, serialized patents are validated against the json
+    schema (see parseepo.validate.ValidationReport) without a second pass and the report is
+    saved to validation. Lines are the lines of dest.
+    :param stats: str, if not None, path of the json stats sidecar (patents, rows and
+    languages per attribute, publication dates, ..., see parseepo.stats.Stats), saved at the
+    end. The stats are also saved in each checkpoint, so that a resumed file is fully covered
+    :param attrs: List[str], if not None, only these attributes are serialized (and in
+    the parquet schema)
+    :param languages: List[str], if not None, only the rows in these languages are serialized
+    :param date_from: str, if not None, only the patents published from date_from
+    (included) are serialized, e.g. '1994-06-08'
+    :param date_to: str, if not None, only the patents published up to date_to (included)
+    are serialized
+    :param max_patent_size: int, if not None, patents larger than max_patent_size
+    characters are handled according to error_policy, like malformed rows (see
+    parseepo.reader.iter_patents). See also the stream_size
+    writer kwarg (parseepo.writer.JsonlWriter) to write large patents incrementally.
+    :param sort: bool, if True, src is checked and, if the rows of a patent are not
+    contiguous, sorted by publication number on disk before being serialized (see
+    parseepo.reader.sort_epo_file). Offsets (start, end, checkpoints) are offsets in the
+    sorted file.
+    :param sort_dir: str, directory of the temporary files of the sort
+    :param error_policy: str, 'fail' (malformed rows and oversized patents raise), 'skip'
+    (they are dropped) or 'quarantine' (they are dropped and saved to quarantine), see
+    parseepo.diagnostics.ErrorHandler. Dropped rows and patents are summarized at the end
+    and counted in the stats and metrics.
+    :param quarantine: str, path of the quarantine file (jsonl), required by the
+    quarantine policy
+    :param reader: str, 'lines' or 'mmap' (local uncompressed src only, faster), see
+    parseepo.reader.iter_patents
+    :param writer_kwargs: passed to parseepo.writer.get_writer (e.g. encoder, compression)
+    :return: int, number of patents serialized
+    """
+    sharded = writer_kwargs.get("shard_patents") or writer_kwargs.get("shard_bytes")
+    resumable = (
+        checkpoint is not None
+        and output_format == "jsonl"
+        and not sharded
+        and is_local(dest)
+    )
+    state = None
+    reported = start if start else 0  # offset of the last progress update
+    if resumable:
+        src_fingerprint = fingerprint(src)
+        state = load_checkpoint(checkpoint, src_fingerprint)
+        writer_kwargs.update(
+            {"resumable": True, "offset": state["dest_size"] if state else 0}
+        )
+    if state:
+        start = state["offset"]
+        msg.info(f"{src}: resumed after {state['nb_patents']} patents")
+
+    metrics_ = Metrics(src, dest) if metrics else None
+    validation_ = ValidationReport(prepare_names) if validation else None
+    stats_ = Stats(src) if stats else None
+    multi_value = Counter()
+    if stats_ and state and state.get("stats"):
+        stats_ = Stats.from_report(state["stats"])
+    errors_ = ErrorHandler(
+        src,
+        error_policy,
+        quarantine,
+        offset=state.get("quarantine_size", 0) if state else None,
+        counters=[report_.errors for report_ in [stats_, metrics_] if report_],
+    )
+    patents = iter_patents(
+        src,
+        start,
+        end,
+        with_offsets=True,
+        attrs=attrs,
+        languages=languages,
+        date_from=date_from,
+        date_to=date_to,
+        max_patent_size=max_patent_size,
+        sort=sort,
+        sort_dir=sort_dir,
+        on_error=errors_,
+        reader=reader,
+    )
+    patents = tqdm(patents, unit="patents") if progress is None else patents
+    serializer = get_serializer(
+        prepare_names,
+        handle_html,
+        engine,
+        html_engine,
+        html_attrs,
+        metrics_ if html_workers <= 1 else None,
+    )
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    with get_writer(
+        dest, output_format, prepare_names=prepare_names, attrs=attrs, **writer_kwargs
+    ) as writer:
+        nb_patents_serialized = state["nb_patents"] if state else 0
+        nb_lines = 0
+        if metrics_:
+            patents = metrics_.timed_iter(patents, "read")
+            serialized = metrics_.timed_iter(
+                serialize_patents(patents, serializer, html_workers), "serialize"
+            )
+            if hasattr(writer, "encode"):
+                writer.encode = metrics_.timed(writer.encode, "encode")
+            write = metrics_.timed(writer.write, "write")
+            last_offset, last_report = start if start else 0, time.perf_counter()
+        else:
+            serialized = serialize_patents(patents, serializer, html_workers)
+            write = writer.write
+        offset = reported
+        for offset, data_, patent in serialized:
+            write(patent)
+
+            nb_patents_serialized += 1
+            if validation_:
+                validation_.validate(patent, dest, nb_patents_serialized)
+            if stats_:
+                stats_.add_patent(data_)
+            multi_value.update(multi_values(data_))
+            if verbose:
+                milestone_msg(nb_patents_serialized)
+            if resumable and nb_patents_serialized % checkpoint_every == 0:
+                quarantine_size, ahead = errors_.checkpoint(offset)
+                report = stats_.report() if stats_ else None
+                if report:  # rows read ahead are dropped again when resumed
+                    errors = Counter(report["errors"]) - ahead
+                    report["errors"] = dict(sorted(errors.items()))
+                save_checkpoint(
+                    checkpoint,
+                    src_fingerprint,
+                    offset,
+                    nb_patents_serialized,
+                    writer.tell(),
+                    report,
+                    quarantine_size,
+                )
+            nb_lines += len(data_)
+            if progress is not None and nb_lines >= PROGRESS_EVERY:
+                progress.put(offset - reported)
+                nb_lines, reported = 0, offset
+            if metrics_:
+                metrics_.add_patent(
+                    "-".join(data_[0][:3]), len(data_), offset - last_offset
+                )
+                last_offset = offset
+                if metrics_every and time.perf_counter() - last_report > metrics_every:
+                    write_json(metrics_.report(), metrics)
+                    last_report = time.perf_counter()
+        if progress is not None:
+            progress.put(offset - reported)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(profile)
+    errors_.close()
+    if multi_value:
+        attrs = ", ".join(f"{attr}: {nb}" for attr, nb in sorted(multi_value.items()))
+        msg.warn(
+            f"{src}: {sum(multi_value.values())} patent(s) with several values for a flat "
+            f"attribute, only the first one was kept ({attrs})"
+        )
+    if metrics_:
+        write_json(metrics_.report(), metrics)
+    if validation_:  # nb_lines: lines of dest, to relocate the examples of parts
+        write_json(
+            {**validation_.report(), "nb_lines": nb_patents_serialized}, validation
+        )
+    if stats_:
+        write_json(stats_.report(), stats)
+    if resumable and os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+    return nb_patents_serialized
+
+
+def run_job(*args, **kwargs):
+    """
+    Run process_epo_file and time it (wall clock, comparable between processes)
+    :return: Tuple[int, float, float], (nb_patents_serialized, start, end)
+    """
+    start = time.time()
+    nb_patents = process_epo_file(*args, **kwargs)
+    return nb_patents, start, time.time()
+
+
+def track_progress(progress, total=None):
+    """
+    Aggregate the number of bytes put in the progress queue by the workers in a single tqdm
+    bar (with an ETA if total is known). Stops when None is received.
+    :param progress: Queue
+    :param total: int, expected number of bytes (if known)
+    """
+    with tqdm(total=total, unit="B", unit_scale=True, unit_divisor=1024) as pbar:
+        for nb_bytes in iter(progress.get, None):
+            pbar.update(nb_bytes)
+
+
+def get_jobs(
+    files: list, split: int = 1, output_format: str = "jsonl", codec: str = None
+):
+    """
+    Return the jobs (src, dest, start, end) serializing files. Local uncompressed files are
+    split in (at most) split byte ranges snapped to publication boundaries, each range is
+    serialized to its own part file.
+    :param files: List[str]
+    :param split: int, number of chunks per file
+    :param output_format: str, 'jsonl' or 'parquet'
+    :param codec: str, see get_dest
+    :return: List[Tuple[str, str, int, int]]
+    """
+    jobs = []
+    for src in files:
+        dest = get_dest(src, output_format, codec)
+        if split > 1 and is_splittable(src):
+            chunks = get_chunks(src, split)
+            jobs += [
+                (src, get_part(dest, i), start, end)
+                for i, (start, end) in enumerate(chunks)
+            ]
+        else:
+            jobs += [(src, dest, None, None)]
+    return jobs
+
+
+def get_job_size(job: tuple, sizes: dict):
+    """
+    Return the (estimated) number of bytes of job
+    :param job: Tuple[str, str, int, int], see get_jobs
+    :param sizes: dict, {src: size}, see parseepo.reader.estimate_size
+    :return: int
+    """
+    src, _, start, end = job
+    return end - start if start is not None else sizes[src] or 0
+
+
+def report_files(timings: dict, results: dict, sizes: dict, top: int = REPORT_TOP):
+    """
+    Print the wall time and throughput of the files serialized, slowest first, and return
+    them
+    :param timings: dict, {src: [start, end]} (s, from the first job of src started to its
+    last job completed)
+    :param results: dict, {src: nb_patents_serialized}
+    :param sizes: dict, {src: size}, (estimated) uncompressed bytes
+    :param top: int, number of files printed
+    :return: dict, {src: {'wall_time': float, 'MB/s': float, 'patents/s': float}}
+    """
+    report = {}
+    for src, (start, end) in timings.items():
+        if src not in results:
+            continue
+        wall_time = max(end - start, 1e-6)
+        report[src] = {
+            "wall_time": wall_time,
+            "MB/s": (sizes[src] or 0) / MB / wall_time,
+            "patents/s": results[src] / wall_time,
+        }
+    rows = sorted(report.items(), key=lambda x: -x[1]["wall_time"])[:top]
+    if rows:
+        msg.info(f"Slowest {len(rows)} of {len(report)} file(s)")
+        print(
+            table(
+                [
+                    [
+                        src,
+                        f"{(sizes[src] or 0) / MB:.1f}",
+                        results[src],
+                        f"{file['wall_time']:.1f}",
+                        f"{file['MB/s']:.1f}",
+                        f"{file['patents/s']:.0f}",
+                    ]
+                    for src, file in rows
+                ],
+                header=("file", "MB", "patents", "wall (s)", "MB/s", "patents/s"),
+            )
+        )
+    return report
+
+
+def collect_reports(jobs: list, get_report):
+    """
+    Return the reports saved by jobs next to their output, grouped by source file (in the
+    order of the parts), and remove them
+    :param jobs: List[Tuple[str, str, int, int]], see get_jobs
+    :param get_report: Callable[[str], str], e.g. parseepo.metrics.get_metrics
+    :return: dict, {src: [report, ...]}
+    """
+    reports = {}
+    for src, dest, _, _ in sorted(jobs, key=lambda job: (job[0], job[2] or 0)):
+        report = read_json(get_report(dest))
+        if report:
+            reports.setdefault(src, []).append(report)
+            os.remove(get_report(dest))
+    return reports
+
+
+def save_run_validation(
+    validation: str, jobs: list, stitched: dict = None, renamed: dict = None
+):
+    """
+    Merge the validation reports of jobs in the run validation report and remove them. The
+    examples of the parts of a stitched file are relocated to the lines of the file.
+    :param validation: str
+    :param jobs: List[Tuple[str, str, int, int]], see get_jobs
+    :param stitched: dict, {src: dest} of the files whose parts were stitched
+    :param renamed: dict, {path: final path} of the outputs moved since (see publish)
+    :return: dict, summary of the run
+    """
+    reports = collect_reports(jobs, get_validation)
+    for src, dest in (stitched or {}).items():
+        nb_lines = 0
+        for i, report in enumerate(reports.get(src, [])):
+            reports[src][i] = offset_examples(report, dest, nb_lines)
+            nb_lines += report["nb_lines"]
+    for reports_ in reports.values() if renamed else []:
+        for report in reports_:
+            for example in report["examples"]:
+                example["file"] = renamed.get(example["file"], example["file"])
+    files = {
+        src: merge_validation_reports(reports_) for src, reports_ in reports.items()
+    }
+    total = merge_validation_reports(list(files.values()))
+    write_json({"total": total, "files": files}, validation)
+    return total
+
+
+def merge_part_quarantines(parts: list, dest: str):
+    """
+    Concatenate the quarantine files of the parts of dest (if any) in the quarantine file of
+    dest and remove them
+    :param parts: List[str], part files, in order
+    :param dest: str
+    """
+    quarantines = [get_quarantine(part) for part in parts]
+    quarantines = [
+        quarantine for quarantine in quarantines if os.path.isfile(quarantine)
+    ]
+    if quarantines:
+        stitch(quarantines, get_quarantine(dest))
+
+
+def merge_part_stats(src: str, parts: list, dest: str):
+    """
+    Merge the stats sidecars of the parts of src in the stats sidecar of dest and remove them
+    :param src: str
+    :param parts: List[str], part files of src, in order
+    :param dest: str
+    """
+    reports = [read_json(get_stats(part)) for part in parts]
+    write_json(
+        merge_stats([report for report in reports if report], src), get_stats(dest)
+    )
+    for part in parts:
+        if os.path.isfile(get_stats(part)):
+            os.remove(get_stats(part))
+
+
+def save_run_stats(stats: str, files: list, output_format: str, codec: str = None):
+    """
+    Merge the stats sidecars of files in the corpus summary stats. Files serialized in a
+    previous run (e.g. skipped by the manifest) are included if their sidecar exists.
+    :param stats: str
+    :param files: List[str], EPO tsv files
+    :param output_format: str
+    :param codec: str
+    :return: dict, summary of the corpus
+    """
+    files_ = {}
+    for src in files:
+        report = read_json(get_stats(get_dest(src, output_format, codec)))
+        if report:
+            files_[src] = report
+    total = merge_stats(list(files_.values()))
+    write_json({"total": total, "files": files_}, stats)
+    return total
+
+
+def save_run_metrics(
+    metrics: str, jobs: list, errors: dict, elapsed: float, files_report: dict = None
+):
+    """
+    Merge the metrics reports of jobs in the run report metrics and remove them
+    :param metrics: str
+    :param jobs: List[Tuple[str, str, int, int]], see get_jobs
+    :param errors: dict, {src: exception}
+    :param elapsed: float, wall clock of the run
+    :param files_report: dict, wall time of each file, see report_files
+    """
+    reports = collect_reports(jobs, get_metrics)
+    files = {src: merge_reports(reports_) for src, reports_ in reports.items()}
+    for src, file in (files_report or {}).items():
+        files.setdefault(src, {})["wall_time"] = file["wall_time"]
+    for src, e in errors.items():
+        files.setdefault(src, {})["error"] = f"{type(e).__name__}: {e}"
+    total = merge_reports(
+        [report for reports_ in reports.values() for report in reports_], elapsed
+    )
+    write_json({"total": total, "files": files}, metrics)
+
+
+def process_epo_files(
+    files: list,
+    max_workers: int = 4,
+    executor: str = "thread",
+    split: int = 1,
+    stitch_parts: bool = True,
+    output_format: str = "jsonl",
+    codec: str = None,
+    manifest: str = None,
+    metrics: str = None,
+    profile: bool = False,
+    validation: str = None,
+    stats: str = None,
+    shard_patents: int = None,
+    shard_bytes: int = None,
+    sort: bool = False,
+    error_policy: str = "fail",
+    lease_dir: str = None,
+    lease_ttl: float = LEASE_TTL,
+    **kwargs,
+):
+    """
+    Serialize the EPO full-text files in parallel. Progress of all workers is aggregated in a
+    single progress bar and results/exceptions are collected as files are completed.
+    :param files: List[str], EPO tsv files
+    :param max_workers: int
+    :param executor: str, 'thread' or 'process' (scales over cores, arguments such as
+    handle_html should be picklable)
+    :param split: int, split each (local, uncompressed) file in split chunks serialized in
+    parallel
+    :param stitch_parts: bool, if True, the (ordered) part files of a split file are
+    concatenated in a single output. Else, they are kept as is. Parquet part files are
+    always kept as is (they form a dataset).
+    :param output_format: str, 'jsonl' or 'parquet'
+    :param codec: str, jsonl only, 'gzip', 'zstd' or 'none', compression of the outputs. If
+    None, outputs are compressed as their source. See also the level and compress_threads
+    kwargs (parseepo.writer.JsonlWriter).
+    :param manifest: str, if not None, path of the run manifest. Files recorded as done (and
+    unchanged since) are skipped, and files are checkpointed so that an interrupted run can
+    be resumed (see process_epo_file).
+    :param metrics: str, if not None, path of the json metrics report of the run (total and
+    per file, see parseepo.metrics). Each job saves its own report next to its output
+    (<output>.metrics.json, see metrics_every) until they are merged at the end of the run.
+    :param profile: bool, if True, each job is profiled and its stats are dumped next to its
+    output (<output>.prof)
+    :param validation: str, if not None, patents are validated as they are serialized and
+    the validation report of the run (total and per file) is saved to validation (see
+    process_epo_file)
+    :param stats: str, if not None, each file has a stats sidecar (<output>.stats.json, see
+    parseepo.stats.Stats) and the stats of all files (including files skipped by the
+    manifest) are merged in the corpus summary stats
+    :param shard_patents: int, if not None, each output is sharded in shards of at most
+    shard_patents patents (see parseepo.writer.ShardedWriter). The shards of a (split) file
+    are listed in its shard manifest (<output>.shards.json), in order.
+    :param shard_bytes: int, jsonl only, if not None, each output is sharded in shards of
+    about shard_bytes (uncompressed) bytes
+    :param sort: bool, if True, files whose rows are not grouped by publication number are
+    sorted before being serialized (see process_epo_file). Files are not split.
+    :param error_policy: str, 'fail', 'skip' or 'quarantine' (see process_epo_file). With
+    'quarantine', the malformed rows of each file are saved to <output>.quarantine.jsonl.
+    :param lease_dir: str, if not None, files are distributed between the runs (e.g. on
+    several nodes) sharing lease_dir: a file is serialized by the run which holds its lease
+    (see parseepo.lease.Leases), files are claimed as workers get free and the run returns
+    once all the files are done (by any run). Split files are split by the run which
+    leased them. The jobs of a run write to temporary outputs of their own (see get_tmp),
+    which are moved to the final paths once the file is complete, while its lease is held
+    (see publish). A file whose lease was lost (reclaimed by another run after lease_ttl
+    without renewal) has its jobs cancelled (the running ones are discarded once over)
+    and is not finalized (stitch, manifest, completion marker) nor returned by this run.
+    Files are not resumed by another run.
+    :param lease_ttl: float, time (s) after which the lease of a run which stopped
+    renewing it (e.g. dead node) is reclaimed
+    :param kwargs: passed to process_epo_file
+    :return: Tuple[dict, dict], ({src: nb_patents_serialized}, {src: exception})
+    """
+    assert executor in EXECUTORS, f"executor should be one of {list(EXECUTORS.keys())}"
+    results, errors = {}, {}
+    all_files = files
+    if manifest:
+        manifest = Manifest(manifest)
+        done = [src for src in files if manifest.is_done(src)]
+        if done:
+            msg.info(f"{len(done)} file(s) already serialized, skipped.")
+        files = [src for src in files if src not in done]
+    leases = Leases(lease_dir, lease_ttl) if lease_dir else None
+    jobs = get_jobs(files, 1 if sort else split, output_format, codec)
+    if leases:  # see publish
+        jobs = [(src, get_tmp(dest, leases.owner), *job) for src, dest, *job in jobs]
+    parts = {}
+    for src, dest, start, _ in jobs:
+        if start is not None:
+            parts.setdefault(src, []).append(dest)
+    pending = {src: len(parts.get(src, [None])) for src in files}
+    # largest first, so that a large file scheduled last does not straggle
+    sizes = {src: estimate_size(src) for src in files}
+    jobs.sort(key=lambda job: get_job_size(job, sizes), reverse=True)
+    waiting = sorted(files, key=lambda src: sizes[src] or 0, reverse=True)
+    total = None if None in sizes.values() else sum(sizes.values())
+    timings = {}  # {src: [start, end]}
+    stitched = {}  # {src: dest}
+    renamed = {}  # {temporary path: final path}, see publish
+    manager = Manager() if executor == "process" else None
+    progress = manager.Queue() if manager else queue.Queue()
+    tracker = threading.Thread(
+        target=track_progress, args=(progress, total), daemon=True
+    )
+    tracker.start()
+    start_time = time.perf_counter()
+    try:
+        with EXECUTORS[executor](max_workers=max_workers) as pool, (
+            leases if leases else nullcontext()
+        ):
+            futures = {}
+            queued = []  # jobs of the files leased, not submitted yet
+
+            def submit(job: tuple):
+                src, dest, start, end = job
+                future = pool.submit(
+                    run_job,
+                    src,
+                    dest,
+                    progress=progress,
+                    start=start,
+                    end=end,
+                    output_format=output_format,
+                    checkpoint=get_checkpoint(dest) if manifest else None,
+                    metrics=get_metrics(dest) if metrics else None,
+                    profile=f"{dest}.prof" if profile else None,
+                    validation=get_validation(dest) if validation else None,
+                    stats=get_stats(dest) if stats else None,
+                    shard_patents=shard_patents,
+                    shard_bytes=shard_bytes,
+                    sort=sort,
+                    error_policy=error_policy,
+                    quarantine=(
+                        get_quarantine(dest) if error_policy == "quarantine" else None
+                    ),
+                    **kwargs,
+                )
+                futures[future] = src
+                timings.setdefault(src, [None, None])
+
+            def discard(src: str):
+                """
+                Drop the outputs of src written by this run (its lease was lost)
+                """
+                results.pop(src, None)
+                timings.pop(src, None)
+                stitched.pop(src, None)
+                dest = get_dest(src, output_format, codec)
+                remove_files(get_tmp_files(dest, leases.owner))
+
+            def finalize(src: str):
+                """
+                Finalize src once its jobs are over: merge its parts and, if it is leased,
+                publish its outputs while the lease is held
+                """
+                dest = get_dest(src, output_format, codec)
+                out = get_tmp(dest, leases.owner) if leases else dest
+                if src in errors:
+                    if leases:  # another run may retry it
+                        leases.release(get_task(src))
+                    return
+                if leases and not leases.is_held(get_task(src)):
+                    discard(src)  # reclaimed by another run, which finalizes dest
+                    return
+                if src in parts and error_policy == "quarantine":
+                    merge_part_quarantines(parts[src], out)
+                if src in parts and stats:
+                    merge_part_stats(src, parts[src], out)
+                if src in parts and (shard_patents or shard_bytes):
+                    merge_shards(parts[src], out)
+                elif src in parts and stitch_parts and output_format == "jsonl":
+                    stitch(parts[src], out)
+                    stitched[src] = dest
+                if leases:
+                    # is_held renews the lease, it can't expire while the outputs are moved
+                    if not leases.is_held(get_task(src)):  # lost while merging
+                        discard(src)
+                        return
+                    renamed.update(publish(dest, leases.owner))
+                    ours = get_tmp_files(dest, leases.owner)  # reports, see publish
+                    remove_files(
+                        [tmp for tmp in get_tmp_files(dest) if tmp not in ours]
+                    )  # left by the runs which held the lease before (dead, stalled)
+                if manifest:
+                    manifest.done(src, dest, results[src])
+                if leases:
+                    leases.done(
+                        get_task(src), src=src, dest=dest, nb_patents=results[src]
+                    )
+
+            if not leases:
+                for job in jobs:  # largest first, across files
+                    submit(job)
+                waiting = []
+            while futures or waiting or queued:
+                if leases:  # cancel the jobs of the files whose lease was lost, and
+                    # claim files as workers get free
+                    dropped = [
+                        job[0] for job in queued if get_task(job[0]) in leases.lost
+                    ]
+                    queued = [
+                        job for job in queued if get_task(job[0]) not in leases.lost
+                    ]
+                    for future, src in list(futures.items()):
+                        if get_task(src) in leases.lost and future.cancel():
+                            dropped += [futures.pop(future)]
+                    for src in dropped:  # running jobs are discarded once over
+                        pending[src] -= 1
+                        if pending[src] == 0:
+                            finalize(src)
+                    claimed = []
+                    for src in list(waiting):
+                        if len(futures) + len(queued) + len(claimed) >= max_workers:
+                            break
+                        if leases.is_done(get_task(src)):
+                            waiting.remove(src)
+                            progress.put(sizes[src] or 0)  # done by another run
+                        elif leases.acquire(get_task(src)):
+                            waiting.remove(src)
+                            claimed += [src]
+                    if claimed:  # keep the global order among the files leased
+                        queued = [
+                            job for job in jobs if job in queued or job[0] in claimed
+                        ]
+                    while queued and len(futures) < max_workers:
+                        submit(queued.pop(0))
+                if not futures:  # remaining files leased by other runs
+                    time.sleep(min(POLL_EVERY, lease_ttl / 3))
+                    continue
+                timeout = min(POLL_EVERY, lease_ttl / 3) if leases else None
+                completed, _ = wait(futures, timeout, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    src = futures.pop(future)
+                    try:
+                        nb_patents, start, end = future.result()
+                        results[src] = results.get(src, 0) + nb_patents
+                        start_, end_ = timings[src]
+                        timings[src] = [
+                            min(start, start_ or start),
+                            max(end, end_ or end),
+                        ]
+                    except Exception as e:
+                        errors[src] = e
+                        msg.fail(f"{src}: {type(e).__name__}: {e}")
+                    pending[src] -= 1
+                    if pending[src] == 0:
+                        finalize(src)
+    finally:
+        progress.put(None)
+        tracker.join()
+        if manager:
+            manager.shutdown()
+    if leases:  # reports of the files serialized by this run only
+        jobs = [job for job in jobs if job[0] in timings]
+        files = list(timings)
+    files_report = report_files(
+        {src: timing for src, timing in timings.items() if src not in errors},
+        results,
+        sizes,
+    )
+    if metrics:
+        save_run_metrics(
+            metrics, jobs, errors, time.perf_counter() - start_time, files_report
+        )
+    if validation:
+        total = save_run_validation(validation, jobs, stitched, renamed)
+        if total["nb_errors"]:
+            msg.warn(f"{total['nb_errors']} schema error(s), see {validation}")
+    if stats:
+        save_run_stats(stats, all_files, output_format, codec)
+    if error_policy == "quarantine":
+        quarantines = [
+            get_quarantine(get_dest(src, output_format, codec)) for src in files
+        ]
+        quarantines = [
+            quarantine for quarantine in quarantines if os.path.isfile(quarantine)
+        ]
+        if quarantines:
+            nb_rows = 0
+            for quarantine in quarantines:
+                with io.open(quarantine, "rb") as fin:
+                    nb_rows += sum(1 for _ in fin)
+            msg.warn(f"{nb_rows} row(s) quarantined in {len(quarantines)} file(s).")
+    for src in errors:
+        results.pop(src, None)
+    return results, errors
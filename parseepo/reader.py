@@ -0,0 +1,636 @@
+import bz2
+import heapq
+import io
+import lzma
+import mmap
+import os
+import queue
+import tempfile
+import threading
+import zlib
+from contextlib import ExitStack, nullcontext
+from itertools import groupby
+
+from smart_open import open
+from wasabi import Printer
+
+from parseepo import validate
+from parseepo.exception import PatentSizeException, RowException
+from parseepo.serialize import ENGINES
+from parseepo.writer import get_codec, open_raw
+
+msg = Printer()
+COMPRESSED_EXT = (".gz", ".bz2", ".zst", ".xz")
+BLOCK_SIZE = 1024 * 1024
+READ_AHEAD = 8  # decompressed blocks
+RUN_SIZE = 256 * 1024 * 1024  # external sort
+READERS = ["lines", "mmap"]
+SAMPLE_SIZE = 1024 * 1024  # compressed bytes sampled to estimate the compression ratio
+RELEASE_EVERY = 16 * 1024 * 1024  # mmap reader, bytes read between page releases
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Raw binary reader restricted to the byte range [start, end) of a local file
+    """
+
+    def __init__(self, file: str, start: int = 0, end: int = None):
+        self._f = io.open(file, "rb", buffering=0)
+        self._f.seek(start)
+        self._pos = start
+        self._end = os.path.getsize(file) if end is None else end
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._end - self._pos)
+        if n <= 0:
+            return 0
+        n = self._f.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def iter_gzip_blocks(fin):
+    """
+    Lazily decompress the (possibly multi-member) gzip stream fin
+    :param fin: binary file object
+    :return: Iterator[bytes]
+    """
+    decompressor = zlib.decompressobj(31)
+    for chunk in iter(lambda: fin.read(BLOCK_SIZE), b""):
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data  # next member
+            decompressor = zlib.decompressobj(31)
+
+
+def iter_zstd_blocks(fin):
+    """
+    Lazily decompress the (possibly multi-frame) zstd stream fin
+    :param fin: binary file object
+    :return: Iterator[bytes]
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is not installed. Run `pip install zstandard`.")
+    reader = zstandard.ZstdDecompressor().stream_reader(fin, read_across_frames=True)
+    return iter(lambda: reader.read(BLOCK_SIZE), b"")
+
+
+class DecompressReader(io.RawIOBase):
+    """
+    Raw binary reader over the decompressed bytes of a .gz or .zst file. Blocks are
+    decompressed ahead by a background thread, so that decompression (which releases the
+    GIL) overlaps with parsing.
+    """
+
+    def __init__(self, file: str):
+        self._fin = open_raw(file, "rb")
+        blocks = iter_gzip_blocks if get_codec(file) == "gzip" else iter_zstd_blocks
+        self._queue = queue.Queue(READ_AHEAD)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._decompress, args=(blocks,), daemon=True
+        )
+        self._thread.start()
+        self._block = memoryview(b"")
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                return self._queue.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+
+    def _decompress(self, blocks):
+        try:
+            for block in blocks(self._fin):
+                if block:
+                    self._put(block)
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._block:
+            block = self._queue.get()
+            if block is None:
+                self._queue.put(None)  # stay at EOF
+                return 0
+            if isinstance(block, Exception):
+                raise block
+            self._block = memoryview(block)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._fin.close()
+        super().close()
+
+
+def open_bytes(path: str, start: int = 0, end: int = None):
+    """
+    Return a binary stream over the (decompressed) bytes [start, end) of path. Local
+    uncompressed files are read from start directly, other files are read from the beginning
+    and the first start bytes are skipped. Gzip and zstd files are decompressed ahead in a
+    background thread (see DecompressReader).
+    :param path: str, any path supported by smart_open
+    :param start: int, byte offset (should be the start of a line)
+    :param end: int, byte offset (should be the start of a line), None for the end of file.
+    Local uncompressed files only.
+    :return: binary file object
+    """
+    if is_splittable(path):
+        return io.BufferedReader(RangeReader(path, start, end))
+    assert end is None, f"{path} can't be read by byte range"
+    if get_codec(path):
+        fin = io.BufferedReader(DecompressReader(path), BLOCK_SIZE)
+    else:
+        fin = open(path, "rb")
+    while start > 0:
+        skipped = len(fin.read(min(start, BLOCK_SIZE)))
+        assert skipped, f"{path} is shorter than the offset to skip"
+        start -= skipped
+    return fin
+
+
+def decode_line(line: bytes):
+    """
+    Return the decoded line, with the line ending normalized to '\\n'
+    :param line: bytes
+    :return: str
+    """
+    line = line.decode("utf-8")
+    return line[:-2] + "\n" if line.endswith("\r\n") else line
+
+
+def get_fields_filter(
+    attrs: list = None,
+    languages: list = None,
+    date_from: str = None,
+    date_to: str = None,
+):
+    """
+    Return a filter of the rows of an EPO full-text file on their raw (bytes) publication
+    date, language and attribute fields
+    :param attrs: List[str], attributes to keep, e.g. ['TITLE', 'CLAIM']
+    :param languages: List[str], languages to keep, e.g. ['en', 'fr']
+    :param date_from: str, keep publication dates >= date_from, e.g. '1994-06-08'
+    :param date_to: str, keep publication dates <= date_to
+    :return: Callable[[bytes, bytes, bytes], bool], None if there is no filter
+    """
+    if not any([attrs, languages, date_from, date_to]):
+        return None
+    attrs_ = {attr.encode("utf-8") for attr in attrs} if attrs else None
+    languages_ = {lang.encode("utf-8") for lang in languages} if languages else None
+    date_from_ = date_from.encode("utf-8") if date_from else None
+    date_to_ = date_to.encode("utf-8") if date_to else None
+
+    def fields_filter(date: bytes, lang: bytes, attr: bytes):
+        return not (
+            (attrs_ is not None and attr not in attrs_)
+            or (languages_ is not None and lang not in languages_)
+            or (date_from_ is not None and date < date_from_)
+            or (date_to_ is not None and date > date_to_)
+        )
+
+    return fields_filter
+
+
+def iter_lines(path: str, start: int = 0, end: int = None, line_filter=None):
+    """
+    Lazily iterate over the lines of path, with their number (from start, 1-based) and the
+    (decompressed) byte offset following each line
+    :param path: str, any path supported by smart_open
+    :param start: int, see open_bytes
+    :param end: int, see open_bytes
+    :param line_filter: Callable[[bytes], bool], if not None, lines for which line_filter is
+    False are skipped before being decoded (see iter_rows)
+    :return: Iterator[Tuple[int, int, str]]
+    """
+    offset = start
+    with open_bytes(path, start, end) as fin:
+        for number, line in enumerate(fin, 1):
+            offset += len(line)
+            if line_filter is None or line_filter(line):
+                yield number, offset, decode_line(line)
+
+
+def publication_prefix(line: bytes):
+    """
+    Return the publication number prefix of a raw line (the first three tab-delimited
+    fields, tabs included), without splitting nor decoding the rest of the line
+    :param line: bytes
+    :return: bytes, e.g. b'EP\t0600083\tA1'
+    """
+    pos = -1
+    for _ in range(3):
+        pos = line.find(b"\t", pos + 1)
+        if pos < 0:
+            return line
+    return line[:pos]
+
+
+def is_grouped(path: str):
+    """
+    Return True if the rows of each publication of path are contiguous (streaming pass,
+    the memory is bounded by the number of publications of path)
+    :param path: str, any path supported by smart_open
+    :return: bool
+    """
+    seen, key = set(), None
+    with open_bytes(path) as fin:
+        for line in fin:
+            key_ = publication_prefix(line)
+            if key_ != key:
+                if key_ in seen:
+                    return False
+                seen.add(key_)
+                key = key_
+    return True
+
+
+def write_run(lines: list, tmp_dir: str):
+    """
+    Sort lines by publication number (stable) and write them to a temporary run file
+    :param lines: List[bytes]
+    :param tmp_dir: str
+    :return: str, path of the run
+    """
+    lines.sort(key=publication_prefix)
+    fd, run = tempfile.mkstemp(prefix="run", suffix=".txt", dir=tmp_dir)
+    with io.open(fd, "wb") as fout:
+        fout.writelines(lines)
+    return run
+
+
+def sort_epo_file(src: str, dest: str, run_size: int = RUN_SIZE, tmp_dir: str = None):
+    """
+    Sort the lines of src by publication number to dest (local, uncompressed) with a
+    bounded memory external merge sort: sorted runs of about run_size bytes are spilled to
+    tmp_dir and merged. The sort is stable, rows of a publication keep their order.
+    :param src: str, any path supported by smart_open
+    :param dest: str
+    :param run_size: int, max number of bytes held in memory (unless a single line exceeds
+    it)
+    :param tmp_dir: str, directory of the runs (default: directory of dest)
+    :return: str, dest
+    """
+    tmp_dir = tmp_dir if tmp_dir else os.path.dirname(os.path.abspath(dest))
+    runs, lines, size = [], [], 0
+    try:
+        with open_bytes(src) as fin:
+            for line in fin:
+                line = line if line.endswith(b"\n") else line + b"\n"
+                lines += [line]
+                size += len(line)
+                if size >= run_size:
+                    runs += [write_run(lines, tmp_dir)]
+                    lines, size = [], 0
+        if not runs:
+            lines.sort(key=publication_prefix)
+            with io.open(dest, "wb") as fout:
+                fout.writelines(lines)
+            return dest
+        if lines:
+            runs += [write_run(lines, tmp_dir)]
+        del lines
+        with ExitStack() as stack:
+            fins = [stack.enter_context(io.open(run, "rb")) for run in runs]
+            with io.open(dest, "wb") as fout:
+                fout.writelines(heapq.merge(*fins, key=publication_prefix))
+        return dest
+    finally:
+        for run in runs:
+            os.remove(run)
+
+
+def iter_rows(path: str, start: int = 0, end: int = None, fields_filter=None):
+    """
+    Lazily iterate over the rows of path, read line by line
+    :param path: str, any path supported by smart_open
+    :param start: int, see open_bytes
+    :param end: int, see open_bytes
+    :param fields_filter: Callable[[bytes, bytes, bytes], bool], see get_fields_filter
+    :return: Iterator[Tuple[tuple, int, int, List[str]]], (publication key, line number
+    from start, byte offset following the line, row)
+    """
+
+    def line_filter(line: bytes):  # the text is neither split nor copied
+        pos = -1
+        for _ in range(6):
+            pos = line.find(b"\t", pos + 1)
+            if pos < 0:
+                return True
+        return fields_filter(*line[:pos].split(b"\t")[3:])
+
+    line_filter_ = line_filter if fields_filter is not None else None
+    for number, offset, line in iter_lines(path, start, end, line_filter_):
+        row_ = line.split("\t")
+        yield tuple(row_[:3]), number, offset, row_
+
+
+def iter_rows_mmap(path: str, start: int = 0, end: int = None, fields_filter=None):
+    """
+    Lazily iterate over the rows of path, memory mapped. Lines and fields are delimited by
+    byte searches in the mapping, the publication key is compared as bytes and the text is
+    decoded straight from a memoryview slice (a single copy). Filtered out rows are never
+    decoded. Pages already read are released every RELEASE_EVERY bytes (where supported) so
+    that the resident memory does not grow with the file.
+    :param path: str, local uncompressed file
+    :param start: int, byte offset of the first line
+    :param end: int, byte offset where reading stops (default: end of file)
+    :param fields_filter: Callable[[bytes, bytes, bytes], bool], see get_fields_filter
+    :return: Iterator[Tuple[bytes, int, int, List[str]]], see iter_rows
+    """
+    with io.open(path, "rb") as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return  # empty files cannot be mapped
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                yield from _iter_rows_mmap(mm, view, start, end, fields_filter)
+            finally:
+                view.release()
+
+
+def _iter_rows_mmap(mm, view, start: int, end: int, fields_filter):
+    find, tab = mm.find, b"\t"
+    pos = start
+    end = len(mm) if end is None else min(end, len(mm))
+    number, released = 0, start - start % mmap.PAGESIZE
+    release = hasattr(mmap, "MADV_DONTNEED")
+    while pos < end:
+        number += 1
+        if release and pos - released > RELEASE_EVERY:
+            pos_ = pos - pos % mmap.PAGESIZE
+            mm.madvise(mmap.MADV_DONTNEED, released, pos_ - released)
+            released = pos_
+        eol = find(b"\n", pos, end)
+        next_pos = end if eol < 0 else eol + 1
+        crlf = eol > pos and mm[eol - 1] == 13  # \r
+        text_end = eol - 1 if crlf else next_pos
+        t1 = find(tab, pos, text_end)
+        t2 = find(tab, t1 + 1, text_end) if t1 >= 0 else -1
+        t3 = find(tab, t2 + 1, text_end) if t2 >= 0 else -1
+        t4 = find(tab, t3 + 1, text_end) if t3 >= 0 else -1
+        t5 = find(tab, t4 + 1, text_end) if t4 >= 0 else -1
+        t6 = find(tab, t5 + 1, text_end) if t5 >= 0 else -1
+        if t6 >= 0 and not (
+            fields_filter is None
+            or fields_filter(mm[t3 + 1 : t4], mm[t4 + 1 : t5], mm[t5 + 1 : t6])
+        ):
+            pass  # filtered out, on the first six fields as in iter_rows
+        elif t6 < 0 or find(tab, t6 + 1, text_end) >= 0:
+            # malformed row, split as in iter_rows for the validation to report it
+            row_ = decode_line(mm[pos:next_pos]).split("\t")
+            yield mm[pos : t3 if t3 >= 0 else next_pos], number, next_pos, row_
+        else:
+            row_ = mm[pos:t6].decode("utf-8").split("\t")
+            text = str(view[t6 + 1 : text_end], "utf-8")
+            row_.append(text + "\n" if crlf else text)
+            yield mm[pos:t3], number, next_pos, row_
+        pos = next_pos
+
+
+def is_splittable(file: str):
+    """
+    Return True if file can be read by byte ranges (local and uncompressed)
+    :param file: str
+    :return: bool
+    """
+    return os.path.isfile(file) and not file.endswith(COMPRESSED_EXT)
+
+
+def get_decompressor(path: str):
+    """
+    Return an incremental decompressor of path, inferred from its extension
+    :param path: str, compressed file (see COMPRESSED_EXT)
+    :return: decompressor object (decompress, unused_data)
+    """
+    if path.endswith(".gz"):
+        return zlib.decompressobj(31)
+    if path.endswith(".bz2"):
+        return bz2.BZ2Decompressor()
+    if path.endswith(".xz"):
+        return lzma.LZMADecompressor()
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is not installed. Run `pip install zstandard`.")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def estimate_size(path: str, sample_size: int = SAMPLE_SIZE):
+    """
+    Return the (estimated) uncompressed size of path, e.g. to schedule the largest files
+    first. The size of compressed files is extrapolated from the compression ratio of their
+    first sample_size bytes.
+    :param path: str, local path or any path supported by smart_open
+    :param sample_size: int
+    :return: int, None if the size of path is not available (e.g. http)
+    """
+    try:
+        with open_raw(path, "rb") as fin:
+            size = fin.seek(0, io.SEEK_END)
+            if not path.endswith(COMPRESSED_EXT):
+                return size
+            fin.seek(0)
+            sample = fin.read(sample_size)
+    except (OSError, ValueError):
+        return None
+    decompressor = get_decompressor(path)
+    nb_bytes = len(decompressor.decompress(sample))
+    consumed = len(sample) - len(getattr(decompressor, "unused_data", b""))
+    return int(size * nb_bytes / consumed) if consumed else size
+
+
+def publication_key(line: bytes):
+    """
+    Return the publication number key of a raw line, i.e. the first three tab-delimited
+    fields as used by get_publication_number, without decoding the line.
+    :param line: bytes
+    :return: List[bytes]
+    """
+    return line.split(b"\t", 3)[:3]
+
+
+def next_boundary(fin, offset: int):
+    """
+    Return the offset of the first line starting a new publication after offset
+    :param fin: binary file object
+    :param offset: int
+    :return: int, the size of the file if there is no publication boundary after offset
+    """
+    fin.seek(offset)
+    if offset > 0:
+        fin.readline()  # skip the (possibly partial) line
+    key = publication_key(fin.readline())
+    while True:
+        pos_next = fin.tell()
+        line = fin.readline()
+        if not line:
+            return pos_next
+        if publication_key(line) != key:
+            return pos_next
+
+
+def get_chunks(file: str, nb_chunks: int):
+    """
+    Return byte ranges splitting file in (at most) nb_chunks chunks of similar size. Each
+    range starts at a publication boundary so that all the rows of a patent belong to the
+    same chunk.
+    :param file: str, local uncompressed EPO tsv file
+    :param nb_chunks: int
+    :return: List[Tuple[int, int]], e.g. [(0, 1052), (1052, 2310)]
+    """
+    size = os.path.getsize(file)
+    boundaries = [0]
+    with io.open(file, "rb") as fin:
+        for i in range(1, nb_chunks):
+            offset = max(i * size // nb_chunks, boundaries[-1])
+            boundary = next_boundary(fin, offset)
+            if boundary > boundaries[-1] and boundary < size:
+                boundaries += [boundary]
+    boundaries += [size]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def iter_patents(
+    path: str,
+    start: int = None,
+    end: int = None,
+    validate_rows: bool = True,
+    with_offsets: bool = False,
+    attrs: list = None,
+    languages: list = None,
+    date_from: str = None,
+    date_to: str = None,
+    max_patent_size: int = None,
+    sort: bool = False,
+    sort_dir: str = None,
+    on_error=None,
+    reader: str = "lines",
+):
+    """
+    Lazily iterate over the patents of an EPO full-text file. Rows of a patent are
+    expected to be contiguous, unless sort is True. At most one patent is held in
+    memory. Rows can be filtered by attribute, language and publication date on the raw
+    fields (see get_fields_filter), patents without any row left are skipped. Patents
+    larger than max_patent_size are skipped, their rows are dropped as soon as the limit
+    is reached, and passed to on_error (with a PatentSizeException and their publication
+    number as row) if not None, else skipped with a warning.
+    :param path: str, any path supported by smart_open (local, .gz, gs://, s3://, ...)
+    :param start: int, if not None, path is read from the (decompressed) byte offset
+    start, which should be a publication boundary (see get_chunks)
+    :param end: int, if not None, path is read up to the byte offset end (local
+    uncompressed files only)
+    :param validate_rows: bool, if True, raise RowException on malformed rows (unless
+    on_error is not None)
+    :param with_offsets: bool, if True, yield (offset, data) where offset is the byte
+    offset following the last row of the patent
+    :param attrs: List[str], attributes to keep (default: all)
+    :param languages: List[str], languages to keep (default: all)
+    :param date_from: str, first publication date to keep (included), e.g. '1994-06-08'
+    :param date_to: str, last publication date to keep (included)
+    :param max_patent_size: int, if not None, max size of a patent (characters of its
+    rows)
+    :param sort: bool, if True, path is checked in a first pass and, if the rows of a
+    patent are not contiguous, it is sorted by publication number (see sort_epo_file) in
+    a temporary file which is read instead (start and end are offsets in the sorted
+    file)
+    :param sort_dir: str, directory of the temporary files of the sort (default: system
+    temporary directory)
+    :param on_error: Callable[[Exception, int, int, str], None], if not None, malformed
+    rows are passed to on_error (exception, line number from start, byte offset
+    following the row, row) and dropped instead of raising (see
+    parseepo.diagnostics.ErrorHandler). So are oversized patents (see max_patent_size).
+    :param reader: str, one of READERS, 'lines' reads path line by line (any path),
+    'mmap' memory maps it (see iter_rows_mmap, local uncompressed files only, other
+    files are read by lines)
+    :return: Iterator[List[List[str]]], E.g.
+        [['EP','0700059','A1','1996-03-06','de','TITLE',' Elektroma...'],
+         ['EP','0700059','A1','1996-03-06','en','TITLE',' Electroma...'],
+         ...]
+    """
+    with tempfile.TemporaryDirectory(dir=sort_dir) if sort else nullcontext() as tmp:
+        if sort and not is_grouped(path):
+            msg.warn(f"{path}: rows not grouped by publication number, sorting.")
+            path = sort_epo_file(path, os.path.join(tmp, "sorted.txt"))
+        assert reader in READERS, f"reader should be one of {READERS}"
+        fields_filter = get_fields_filter(attrs, languages, date_from, date_to)
+        mmap_ = reader == "mmap" and is_splittable(path)
+        rows = (iter_rows_mmap if mmap_ else iter_rows)(
+            path, start or 0, end, fields_filter
+        )
+        for _, group in groupby(rows, key=lambda x: x[0]):
+            data, size = [], 0
+            for _, number, offset, row_ in group:
+                if max_patent_size:
+                    size += sum(map(len, row_)) + len(row_) - 1  # len of the line
+                    if size > max_patent_size:
+                        data = None
+                if data is None:
+                    continue
+                if validate_rows:
+                    try:
+                        validate.row(row_)
+                    except RowException as e:
+                        if on_error is None:
+                            raise
+                        on_error(e, number, offset, "\t".join(row_))
+                        continue
+                data += [row_]
+            if data is None:
+                publication_number = "-".join(row_[:3])
+                e = PatentSizeException(
+                    f"{publication_number}: larger than {max_patent_size} characters "
+                    f"({size})"
+                )
+                if on_error is None:
+                    msg.warn(f"{e}, skipped.")
+                else:
+                    on_error(e, number, offset, publication_number)
+                continue
+            if not data:  # only malformed rows
+                continue
+            yield (offset, data) if with_offsets else data
+
+
+def iter_serialized(
+    path: str,
+    prepare_names: bool = False,
+    handle_html: bool = False,
+    engine: str = "python",
+    **kwargs,
+):
+    """
+    Lazily iterate over the serialized patents of an EPO full-text file
+    :param path: str, any path supported by smart_open
+    :param prepare_names: bool, True if you want to prepare names for BQ compatibility
+    :param handle_html: bool, True if you want to handle html
+    :param engine: str, serializer engine (see parseepo.serialize.ENGINES)
+    :param kwargs: passed to iter_patents
+    :return: Iterator[dict]
+    """
+    serialize_patent = ENGINES[engine]
+    for data in iter_patents(path, **kwargs):
+        yield serialize_patent(
+            data, prepare_names=prepare_names, handle_html=handle_html
+        )
@@ -0,0 +1,172 @@
+import json
+
+from parseepo.utils import prepare_name
+
+
+def field(name, type_, mode="NULLABLE", description="", fields=None):
+    """
+    Return a field in the BigQuery json schema format
+    :param name: str
+    :param type_: str, e.g. 'STRING'
+    :param mode: str, 'NULLABLE' or 'REPEATED'
+    :param description: str
+    :param fields: List[dict], nested fields (RECORD only)
+    :return: dict
+    """
+    out = {"name": name, "type": type_, "mode": mode, "description": description}
+    if fields:
+        out.update({"fields": fields})
+    return out
+
+
+def attr_field(attr, description, language, text, repeated, prepare_names):
+    mode = "REPEATED" if repeated else "NULLABLE"
+    return field(
+        prepare_name(attr, prepare_names),
+        "RECORD",
+        description=description,
+        fields=[
+            field("language", "STRING", mode, description=language),
+            field("text", "STRING", mode, description=text),
+        ],
+    )
+
+
+def bq_schema(prepare_names: bool = False, attrs: list = None):
+    """
+    Return the schema of the serialized EPO data in the BigQuery json schema format
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :param attrs: List[str], attributes kept by the serialization (see
+    parseepo.reader.get_fields_filter), None for all
+    :return: List[dict]
+    """
+    schema = [
+        field("publication_number", "STRING", description="DOCDB publication number"),
+        field(
+            "publication_date", "DATE", description="Publication date of the EP patent"
+        ),
+        attr_field(
+            "PDFEP",
+            "Url link to the pdf of the EP patent",
+            "Language of the pdf",
+            "Url",
+            False,
+            prepare_names,
+        ),
+        attr_field(
+            "TITLE",
+            "Title of the patent",
+            "Title language",
+            "Localized title",
+            True,
+            prepare_names,
+        ),
+        attr_field(
+            "ABSTR",
+            "Abstract of the patent",
+            "Abstract language",
+            "Localized abstract",
+            False,
+            prepare_names,
+        ),
+        attr_field(
+            "DESCR",
+            "Description of the patent",
+            "Language of the description",
+            "Localized description",
+            False,
+            prepare_names,
+        ),
+        attr_field(
+            "CLAIM",
+            "Claims of patent",
+            "Claims language",
+            "Localized claims",
+            True,
+            prepare_names,
+        ),
+        attr_field(
+            "AMEND",
+            "Amendments",
+            "Amendments language",
+            "Localized amendments",
+            True,
+            prepare_names,
+        ),
+    ]
+    if attrs is None:
+        return schema
+    names = [prepare_name(attr, prepare_names) for attr in attrs]
+    return schema[:2] + [field_ for field_ in schema[2:] if field_["name"] in names]
+
+
+def write_bq_schema(dest: str, prepare_names: bool = False, attrs: list = None):
+    """
+    Save the BigQuery json schema of the serialized EPO data to dest, as
+    google.cloud.bigquery.Client.schema_to_json does (no BigQuery client needed)
+    :param dest: str, local path, e.g. 'schema.json'
+    :param prepare_names: bool, see bq_schema
+    :param attrs: List[str], see bq_schema
+    """
+    with open(dest, "w") as fout:
+        json.dump(bq_schema(prepare_names, attrs), fout, indent=2, sort_keys=True)
+
+
+def json_schema(prepare_names: bool = False):
+    """
+    Return the json schema of a serialized patent (see parseepo.validate.get_validator)
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :return: dict
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "publication_number": {"type": "string"},
+            "publication_date": {"type": "string"},
+            prepare_name("ABSTR", prepare_names): {
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"},
+                        "language": {"type": "string"},
+                    },
+                }
+            },
+            prepare_name("DESCR", prepare_names): {
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"},
+                        "language": {"type": "string"},
+                    },
+                }
+            },
+            prepare_name("AMEND", prepare_names): {
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "array"},
+                        "language": {"type": "array"},
+                    },
+                }
+            },
+            prepare_name("CLAIM", prepare_names): {
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "array"},
+                        "language": {"type": "array"},
+                    },
+                }
+            },
+            prepare_name("PDFEP", prepare_names): {
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string"},
+                        "language": {"type": "string"},
+                    },
+                }
+            },
+        },
+    }
@@ -1,17 +1,33 @@
-import html2text
-import pandas as pd
+from typing import TYPE_CHECKING
+
 from wasabi import Printer
 
 from parseepo import validate
+from parseepo.diagnostics import WARNINGS
 from parseepo.exception import SingleAttrException
+from parseepo.markup import handle_html as handle_html_
 from parseepo.utils import prepare_name
 
-h = html2text.HTML2Text()
+if TYPE_CHECKING:
+    import pandas as pd
+
 msg = Printer()
 NAMES = ["EP", "Num", "Ext", "publication_date", "language", "attr", "text"]
 NESTED_ATTR = ["TITLE", "CLAIM", "AMEND", "title", "claims", "amendment"]
 
 
+def get_html_handler(handle_html):
+    """
+    Return the function handling the html of a row, None if html should not be handled
+    :param handle_html: bool or Callable[[str, str], str], True for html2text on all
+    attributes, or a function (attr, text) -> text (see parseepo.markup.handle_html)
+    :return: Callable[[str, str], str]
+    """
+    if callable(handle_html):
+        return handle_html
+    return handle_html_ if handle_html else None
+
+
 def format_patent_df(
     data: list, prepare_names: bool = False, handle_html: bool = False
 ):
@@ -23,7 +39,8 @@ def format_patent_df(
             ...
     :param data: List[List]
     :param prepare_names: bool, True if you want to prepare names for BQ compatibility
-    :param handle_html: bool, True if you want to handle html
+    :param handle_html: bool or Callable, True if you want to handle html (see
+    get_html_handler)
     :return: pd.DataFrame
              publication_date  language attr    text   publication_number
     0  1996-03-06  ...     ...     ...     EP-0700059-A1
@@ -34,23 +51,41 @@ def format_patent_df(
     5  1996-03-06  ...     ...     ...     EP-0700059-A1
     6  1996-03-06  ...     ...     ...     EP-0700059-A1
     """
+    import pandas as pd  # reference engine only, slow to import
 
     df_ = pd.DataFrame(data, columns=NAMES)
     df_["publication_number"] = df_["EP"] + "-" + df_["Num"] + "-" + df_["Ext"]
     df_ = df_.drop(["EP", "Num", "Ext"], axis=1)
 
+    html_handler = get_html_handler(handle_html)
+    if html_handler:
+        df_["text"] = [
+            html_handler(attr, text) for attr, text in zip(df_["attr"], df_["text"])
+        ]
     if prepare_names:
         df_["attr"] = df_["attr"].apply(lambda x: prepare_name(x, True))
-    if handle_html:
-        df_["text"] = df_["text"].apply(lambda x: h.handle(x))
     return df_
 
 
+def multi_values(data: list):
+    """
+    Return the flat attributes (not in NESTED_ATTR) with several rows in data, of which only
+    the first value is kept by unnest_attr
+    :param data: List[List[str]], rows of a patent
+    :return: List[str]
+    """
+    attrs = [row_[5] for row_ in data]
+    return sorted(
+        {attr for attr in attrs if attr not in NESTED_ATTR and attrs.count(attr) > 1}
+    )
+
+
 def unnest_attr(patent_dict: dict, publication_number: str):
     """
     Unnest flat attributes returned as nested by the batch aggregation operation in
     serialize_patent.
-    Raises warning if expected flat attributes has multiple values.
+    Raises warning if expected flat attributes has multiple values (rate limited, see
+    parseepo.diagnostics.WARNINGS).
     :param patent_dict: dict, returned by serialize_patent
     :param publication_number: str, e.g. 'EP-0600083-A1'
     :return: dict
@@ -70,9 +105,10 @@ def unnest_attr(patent_dict: dict, publication_number: str):
         try:
             validate.single_attr(val, attr, publication_number)
         except SingleAttrException:
-            msg.warn(
+            WARNINGS.warn(
+                "multi_value",
                 f"{publication_number}: {attr} has more than 1 value. Only the first value "
-                f"was kept. Add {attr} to the list NESTED_ATTR to fix this behavior."
+                f"was kept. Add {attr} to the list NESTED_ATTR to fix this behavior.",
             )
         patent_dict.update(
             {
@@ -84,7 +120,7 @@ def unnest_attr(patent_dict: dict, publication_number: str):
         )
 
 
-def serialize_patent_df(patent_df: pd.DataFrame):
+def serialize_patent_df(patent_df: "pd.DataFrame"):
     """
     Return the serialized patent
     :param patent_df: pd.DataFrame, returned by format_patent_df
@@ -126,9 +162,50 @@ def serialize_patent(
         [['EP','0700059 A1','1996-03-06','de','TITLE',' Elektroma...'],
          ['EP','0700059 A1','1996-03-06','en','TITLE',' Electroma...'],
     :param prepare_names: bool, True if you want to prepare names for BQ compatibility
-    :param handle_html: bool, True if you want to handle html
+    :param handle_html: bool or Callable, True if you want to handle html (see
+    get_html_handler)
     :return: dict
     """
     out = format_patent_df(data, prepare_names, handle_html)
     out = serialize_patent_df(out)
     return out
+
+
+def serialize_patent_python(
+    data: list, prepare_names: bool = False, handle_html: bool = False
+):
+    """
+    Return the serialized patent without building any intermediary DataFrame.
+    Pure python equivalent of serialize_patent, the output is identical (attributes sorted
+    as in the groupby, flat attributes unnested by unnest_attr).
+    :param data: List[List[str]], E.g.
+        [['EP','0700059 A1','1996-03-06','de','TITLE',' Elektroma...'],
+         ['EP','0700059 A1','1996-03-06','en','TITLE',' Electroma...'],
+    :param prepare_names: bool, True if you want to prepare names for BQ compatibility
+    :param handle_html: bool or Callable, True if you want to handle html (see
+    get_html_handler)
+    :return: dict
+    """
+    publication_number = "-".join(data[0][:3])
+    publication_date = data[0][3]
+    html_handler = get_html_handler(handle_html)
+
+    grouped = {}
+    for _, _, _, _, language, attr, text in data:
+        if html_handler:
+            text = html_handler(attr, text)
+        if prepare_names:
+            attr = prepare_name(attr, True)
+        if attr not in grouped:
+            grouped[attr] = {"language": [], "text": []}
+        grouped[attr]["language"].append(language)
+        grouped[attr]["text"].append(text)
+
+    out = {attr: grouped[attr] for attr in sorted(grouped)}
+    unnest_attr(out, publication_number)
+    out.update({"publication_number": publication_number})
+    out.update({"publication_date": publication_date})
+    return out
+
+
+ENGINES = {"pandas": serialize_patent, "python": serialize_patent_python}
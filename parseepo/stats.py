@@ -0,0 +1,119 @@
+from collections import Counter
+
+from parseepo.serialize import multi_values
+
+
+def get_stats(dest: str):
+    """
+    Return the path of the stats sidecar of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl'
+    :return: str, e.g. 'data/EP0600000.jsonl.stats.json'
+    """
+    return f"{dest}.stats.json"
+
+
+class Stats:
+    """
+    Running aggregates of the patents serialized to a file, for sanity checks without a
+    second pass: number of patents and rows, rows and languages per attribute, min/max
+    publication date, publication year histogram and number of patents with several values
+    for a flat attribute (only the first one is kept, see parseepo.serialize.unnest_attr).
+    Malformed rows and oversized patents dropped are counted by error type (see
+    parseepo.diagnostics.ErrorHandler).
+    """
+
+    def __init__(self, src: str = None):
+        """
+        :param src: str
+        """
+        self.src = src
+        self.nb_patents, self.nb_rows = 0, 0
+        self.rows = Counter()  # {attr: nb}
+        self.languages = {}  # {attr: {language: nb}}
+        self.years = Counter()  # {year: nb}
+        self.multi_value = Counter()  # {attr: nb}
+        self.errors = Counter()  # {error: nb}, rows or patents dropped
+        self.date_min, self.date_max = None, None
+
+    def add_patent(self, data: list):
+        """
+        :param data: List[List[str]], rows of the patent (see parseepo.reader.iter_patents)
+        """
+        self.nb_patents += 1
+        self.nb_rows += len(data)
+        date = data[0][3]
+        self.years[date[:4]] += 1
+        self.date_min = date if self.date_min is None else min(self.date_min, date)
+        self.date_max = date if self.date_max is None else max(self.date_max, date)
+        rows = Counter()
+        for row_ in data:
+            language, attr = row_[4], row_[5]
+            rows[attr] += 1
+            languages = self.languages.setdefault(attr, Counter())
+            languages[language] += 1
+        self.rows.update(rows)
+        self.multi_value.update(multi_values(data))
+
+    @classmethod
+    def from_report(cls, report: dict):
+        """
+        Return the Stats of report (e.g. to resume a file)
+        :param report: dict, see report
+        :return: Stats
+        """
+        stats = cls(report["src"])
+        stats.nb_patents, stats.nb_rows = report["nb_patents"], report["nb_rows"]
+        stats.rows = Counter(report["rows"])
+        stats.languages = {
+            attr: Counter(languages) for attr, languages in report["languages"].items()
+        }
+        stats.years = Counter(report["years"])
+        stats.multi_value = Counter(report["multi_value"])
+        stats.errors = Counter(report.get("errors", {}))
+        stats.date_min = report["publication_date"]["min"]
+        stats.date_max = report["publication_date"]["max"]
+        return stats
+
+    def report(self):
+        """
+        Return the stats report
+        :return: dict
+        """
+        return {
+            "src": self.src,
+            "nb_patents": self.nb_patents,
+            "nb_rows": self.nb_rows,
+            "rows": dict(sorted(self.rows.items())),
+            "languages": {
+                attr: dict(sorted(languages.items()))
+                for attr, languages in sorted(self.languages.items())
+            },
+            "publication_date": {"min": self.date_min, "max": self.date_max},
+            "years": dict(sorted(self.years.items())),
+            "multi_value": dict(sorted(self.multi_value.items())),
+            "errors": dict(sorted(self.errors.items())),
+        }
+
+
+def merge_stats(reports: list, src: str = None):
+    """
+    Merge the stats reports of several files (or parts of a file)
+    :param reports: List[dict], see Stats.report
+    :param src: str
+    :return: dict
+    """
+    stats = Stats(src)
+    for report in reports:
+        stats.nb_patents += report["nb_patents"]
+        stats.nb_rows += report["nb_rows"]
+        stats.rows.update(report["rows"])
+        for attr, languages in report["languages"].items():
+            stats.languages.setdefault(attr, Counter()).update(languages)
+        stats.years.update(report["years"])
+        stats.multi_value.update(report["multi_value"])
+        stats.errors.update(report.get("errors", {}))
+        dates = report["publication_date"]
+        if dates["min"] is not None:
+            stats.date_min = min(filter(None, [stats.date_min, dates["min"]]))
+            stats.date_max = max(filter(None, [stats.date_max, dates["max"]]))
+    return stats.report()
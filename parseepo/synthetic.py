@@ -0,0 +1,135 @@
+import random
+
+from smart_open import open
+
+LANGUAGES = {"en": 0.7, "de": 0.2, "fr": 0.1}
+TITLE_LANGUAGES = ["de", "en", "fr"]
+WORDS = (
+    "device method system apparatus said first second member layer surface portion "
+    "means unit signal control data process composition compound plurality wherein "
+    "comprising arranged provided least one which between along substrate housing shaft "
+    "element circuit value according claim invention embodiment figure shown end side "
+    "Vorrichtung Verfahren wobei dispositif procédé selon caractérisé Schicht élément"
+).split()
+AVG_WORD_SIZE = sum(len(word) + 1 for word in WORDS) // len(WORDS)
+
+
+def words(rng: random.Random, nb_chars: int):
+    """
+    Return random words totalling about nb_chars characters (on average)
+    :param rng: random.Random
+    :param nb_chars: int
+    :return: str
+    """
+    return " ".join(rng.choices(WORDS, k=nb_chars // AVG_WORD_SIZE + 1))
+
+
+def paragraphs(rng: random.Random, nb_chars: int, tag: str = "p", prefix: str = "p"):
+    """
+    Return EPO-like html paragraphs totalling about nb_chars characters of text
+    :param rng: random.Random
+    :param nb_chars: int
+    :param tag: str, e.g. 'p'
+    :param prefix: str, id prefix
+    :return: str, e.g. '<p id="p0001" num="0001">...</p><p id="p0002" num="0002">...</p>'
+    """
+    out, size, num = [], 0, 0
+    while size < nb_chars:
+        num += 1
+        text = words(rng, rng.randint(200, 1200))
+        if rng.random() < 0.1:
+            text += f" H<sub>2</sub>O &amp; <b>{rng.choice(WORDS)}</b>"
+        out += [f'<{tag} id="{prefix}{num:04d}" num="{num:04d}">{text}</{tag}>']
+        size += len(text)
+    return "".join(out)
+
+
+def claims(rng: random.Random, nb_claims: int, language: str):
+    """
+    Return EPO-like html claims
+    :param rng: random.Random
+    :param nb_claims: int
+    :param language: str
+    :return: str
+    """
+    return "".join(
+        f'<claim id="c-{language}-01-{num:04d}" num="{num:04d}"><claim-text>'
+        f"{words(rng, rng.randint(100, 600))}</claim-text></claim>"
+        for num in range(1, nb_claims + 1)
+    )
+
+
+def synthetic_patent(
+    rng: random.Random,
+    num: int,
+    publication_date: str = "1994-06-08",
+    languages: dict = None,
+    descr_length: int = 10000,
+    b_rate: float = 0.4,
+    amend_rate: float = 0.05,
+):
+    """
+    Return the rows of a synthetic patent, with the attributes, languages and multiplicity
+    of EPO full-text data: TITLE in de/en/fr, ABSTR/DESCR in the procedure language, CLAIM
+    in the 3 official languages for granted (B1) patents, optional AMEND and PDFEP.
+    :param rng: random.Random
+    :param num: int, publication number (7 digits)
+    :param publication_date: str
+    :param languages: dict, {language: weight} of the procedure language
+    :param descr_length: int, median number of characters of DESCR (log-normal)
+    :param b_rate: float, share of granted patents
+    :param amend_rate: float, share of patents with AMEND
+    :return: List[List[str]]
+    """
+    languages = languages if languages else LANGUAGES
+    language = rng.choices(list(languages), weights=list(languages.values()))[0]
+    kind = "B1" if rng.random() < b_rate else "A1"
+    nb_claims = rng.randint(1, 25)
+    texts = [
+        (lang, "TITLE", words(rng, rng.randint(30, 150))) for lang in TITLE_LANGUAGES
+    ]
+    if kind == "A1":
+        texts += [
+            (language, "ABSTR", paragraphs(rng, rng.randint(300, 1200), prefix="pa"))
+        ]
+    length = int(descr_length * rng.lognormvariate(0, 0.8))
+    texts += [(language, "DESCR", paragraphs(rng, length))]
+    claim_languages = TITLE_LANGUAGES if kind == "B1" else [language]
+    texts += [(lang, "CLAIM", claims(rng, nb_claims, lang)) for lang in claim_languages]
+    if rng.random() < amend_rate:
+        texts += [(language, "AMEND", claims(rng, nb_claims, language))]
+    pdf = (
+        '<a href="https://data.epo.org/publication-server/pdf-document?cc=EP&amp;'
+        f'pn={num:07d}&amp;ki={kind}&amp;pd={publication_date}">{num:07d}.pdf</a>'
+    )
+    texts += [(language, "PDFEP", pdf)]
+    return [
+        ["EP", f"{num:07d}", kind, publication_date, lang, attr, text]
+        for lang, attr, text in texts
+    ]
+
+
+def generate_epo_file(
+    dest: str,
+    nb_patents: int = 1000,
+    first_num: int = 600000,
+    seed: int = 0,
+    **kwargs,
+):
+    """
+    Write a synthetic EPO full-text file (tsv, compressed according to its extension)
+    :param dest: str, e.g. 'synthetic/EP0600000.txt.gz'
+    :param nb_patents: int
+    :param first_num: int, publication number of the first patent (incremented by 1)
+    :param seed: int, the same parameters and seed produce the same file
+    :param kwargs: passed to synthetic_patent (languages, descr_length, b_rate, amend_rate)
+    :return: int, number of lines written
+    """
+    rng = random.Random(seed)
+    nb_lines = 0
+    with open(dest, "w", encoding="utf-8") as fout:
+        for num in range(first_num, first_num + nb_patents):
+            rows = synthetic_patent(rng, num, **kwargs)
+            fout.write("".join("\t".join(row_) + "\n" for row_ in rows))
+            nb_lines += len(rows)
+    return nb_lines
@@ -1,4 +1,11 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from smart_open import open
+
 from parseepo.exception import SingleAttrException, RowException
+from parseepo.schema import json_schema
 
 
 def single_attr(val, attr, publication_number):
@@ -18,3 +25,171 @@ def row(row_):
         raise RowException(
             f"Length of row different from expected length for row {row_}"
         )
+
+
+def get_validation(dest: str):
+    """
+    Return the path of the validation report of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl'
+    :return: str, e.g. 'data/EP0600000.jsonl.validation.json'
+    """
+    return f"{dest}.validation.json"
+
+
+@lru_cache(maxsize=None)
+def get_validator(prepare_names: bool = False):
+    """
+    Return the (cached) validator of the json schema of serialized patents. The schema is
+    checked and compiled once per process, instead of once per patent with
+    jsonschema.validate.
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :return: jsonschema.protocols.Validator
+    """
+    from jsonschema.validators import validator_for
+
+    schema = json_schema(prepare_names)
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+class ValidationReport:
+    """
+    Summary of the schema errors of serialized patents: number of errors per error type
+    (e.g. 'type:publication_date') and the first max_examples errors with their location
+    """
+
+    def __init__(self, prepare_names: bool = False, max_examples: int = 10):
+        """
+        :param prepare_names: bool, True if names were prepared for BQ compatibility
+        :param max_examples: int
+        """
+        self.validator = get_validator(prepare_names)
+        self.max_examples = max_examples
+        self.nb_patents = 0
+        self.errors = {}
+        self.examples = []
+
+    def validate(self, patent, file: str = None, line: int = None):
+        """
+        Validate patent and record its errors, if any
+        :param patent: dict (or bytes/str, json encoded)
+        :param file: str
+        :param line: int
+        :return: bool, True if patent is valid
+        """
+        self.nb_patents += 1
+        try:
+            patent = json.loads(patent) if isinstance(patent, (bytes, str)) else patent
+            errors = [
+                (f"{e.validator}:{'/'.join(map(str, e.path))}", e.message)
+                for e in self.validator.iter_errors(patent)
+            ]
+        except ValueError as e:
+            patent, errors = {}, [("json", str(e))]
+        for error_type, message in errors:
+            self.errors[error_type] = self.errors.get(error_type, 0) + 1
+            if len(self.examples) < self.max_examples:
+                self.examples += [
+                    {
+                        "file": file,
+                        "line": line,
+                        "publication_number": patent.get("publication_number"),
+                        "error": error_type,
+                        "message": message,
+                    }
+                ]
+        return not errors
+
+    def report(self):
+        """
+        :return: dict, {'nb_patents': int, 'nb_errors': int, 'errors': {error_type: int},
+        'examples': [{'file': str, 'line': int, ...}]}
+        """
+        return {
+            "nb_patents": self.nb_patents,
+            "nb_errors": sum(self.errors.values()),
+            "errors": self.errors,
+            "examples": self.examples,
+        }
+
+
+def offset_examples(report: dict, file: str, nb_lines: int):
+    """
+    Return report with the examples relocated in file, nb_lines further (e.g. the report of
+    a part file once the parts are concatenated in file)
+    :param report: dict, see ValidationReport.report
+    :param file: str
+    :param nb_lines: int, number of lines of file before the first line of report
+    :return: dict
+    """
+    examples = [
+        {**example, "file": file, "line": example["line"] + nb_lines}
+        for example in report["examples"]
+    ]
+    return {**report, "examples": examples}
+
+
+def merge_validation_reports(reports: list, max_examples: int = 10):
+    """
+    Merge validation reports (see ValidationReport.report)
+    :param reports: List[dict]
+    :param max_examples: int
+    :return: dict
+    """
+    errors = {}
+    for report in reports:
+        for error_type, count in report["errors"].items():
+            errors[error_type] = errors.get(error_type, 0) + count
+    return {
+        "nb_patents": sum(report["nb_patents"] for report in reports),
+        "nb_errors": sum(errors.values()),
+        "errors": errors,
+        "examples": [example for report in reports for example in report["examples"]][
+            :max_examples
+        ],
+    }
+
+
+def validate_file(file: str, prepare_names: bool = False, max_examples: int = 10):
+    """
+    Validate the serialized patents of file against the json schema
+    :param file: str, jsonl file (any path supported by smart_open)
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :param max_examples: int
+    :return: dict, see ValidationReport.report
+    """
+    report = ValidationReport(prepare_names, max_examples)
+    with open(file, "rb") as fin:
+        for i, line in enumerate(fin, 1):
+            report.validate(line, file, i)
+    return report.report()
+
+
+def validate_files(
+    files: list,
+    prepare_names: bool = False,
+    max_examples: int = 10,
+    max_workers: int = 4,
+):
+    """
+    Validate the serialized patents of files in a pool of processes
+    :param files: List[str], jsonl files
+    :param prepare_names: bool, True if names were prepared for BQ compatibility
+    :param max_examples: int
+    :param max_workers: int
+    :return: Tuple[dict, dict], (summary, {file: report}), see ValidationReport.report
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        reports = dict(
+            zip(
+                files,
+                pool.map(
+                    validate_file,
+                    files,
+                    [prepare_names] * len(files),
+                    [max_examples] * len(files),
+                ),
+            )
+        )
+    return merge_validation_reports(list(reports.values()), max_examples), reports
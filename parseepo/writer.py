@@ -0,0 +1,505 @@
+import io
+import itertools
+import json
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from smart_open import open
+
+from parseepo.manifest import write_json
+
+ENCODERS = ["json", "orjson", "ujson"]
+FORMATS = ["jsonl", "parquet"]
+BUFFER_SIZE = 4 * 1024 * 1024
+CODECS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def get_codec(path: str):
+    """
+    Return the codec of path inferred from its extension, None if it is not compressed with
+    one of CODECS (e.g. uncompressed, .bz2, .xz)
+    :param path: str
+    :return: str
+    """
+    for codec, ext in CODECS.items():
+        if ext and path.endswith(ext):
+            return codec
+    return None
+
+
+def is_local(path: str):
+    """
+    Return True if path is a local path (no scheme, e.g. 'gs://')
+    :param path: str
+    :return: bool
+    """
+    return "://" not in path
+
+
+def open_raw(path: str, mode: str = "rb"):
+    """
+    Return the file object of path without any (de)compression
+    :param path: str, local path or any path supported by smart_open (>=5.0)
+    :param mode: str, 'rb' or 'wb'
+    :return: binary file object
+    """
+    if is_local(path):
+        return io.open(path, mode)
+    return open(path, mode, compression="disable")
+
+
+def get_compressor(codec: str, level: int = None):
+    """
+    Return a function compressing bytes as an independent gzip member or zstd frame. Members
+    (frames) can be concatenated into a standard .gz (.zst) file.
+    :param codec: str, 'gzip' or 'zstd' (requires zstandard)
+    :param level: int, compression level, see LEVELS for defaults
+    :return: Callable[[bytes], bytes]
+    """
+    assert codec in LEVELS, f"codec should be one of {list(LEVELS)}"
+    level = LEVELS[codec] if level is None else level
+    if codec == "gzip":
+
+        def compress(b):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # gzip container
+            return compressor.compress(b) + compressor.flush()
+
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "zstandard is not installed. Run `pip install zstandard`."
+            )
+        local = threading.local()  # zstd compressors are not thread safe
+
+        def compress(b):
+            if not hasattr(local, "compressor"):
+                local.compressor = zstandard.ZstdCompressor(level=level)
+            return local.compressor.compress(b)
+
+    return compress
+
+
+def get_encoder(name: str = "json"):
+    """
+    Return a function encoding a serialized patent as utf-8 json bytes.
+    'json' (stdlib) is always available and is the reference. 'orjson' and 'ujson' are
+    faster but optional (pip install orjson/ujson) and use compact separators.
+    :param name: str, one of ENCODERS
+    :return: Callable[[dict], bytes]
+    """
+    assert name in ENCODERS, f"encoder should be one of {ENCODERS}"
+    if name == "json":
+
+        def encode(obj):
+            return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    elif name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("orjson is not installed. Run `pip install orjson`.")
+        encode = orjson.dumps
+    else:
+        try:
+            import ujson
+        except ImportError:
+            raise ImportError("ujson is not installed. Run `pip install ujson`.")
+
+        def encode(obj):
+            return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    return encode
+
+
+def get_stream_encoder(name: str = "json"):
+    """
+    Return a function encoding a serialized patent incrementally, as utf-8 json chunks (at
+    most one field value per chunk), so that the json of a large patent is never held in
+    memory as a whole. Chunks are encoded by the stdlib encoder with the separators of name.
+    :param name: str, one of ENCODERS
+    :return: Callable[[dict], Iterator[bytes]]
+    """
+    assert name in ENCODERS, f"encoder should be one of {ENCODERS}"
+    separators = (", ", ": ") if name == "json" else (",", ":")
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=separators)
+
+    def iterencode(obj):
+        for chunk in encoder.iterencode(obj):
+            yield chunk.encode("utf-8")
+
+    return iterencode
+
+
+def patent_size(patent: dict):
+    """
+    Return the number of characters of the texts of a serialized patent
+    :param patent: dict, returned by serialize_patent
+    :return: int
+    """
+    size = 0
+    for value in patent.values():
+        text = value.get("text") if isinstance(value, dict) else value
+        if isinstance(text, str):
+            size += len(text)
+        elif isinstance(text, list):
+            size += sum(len(text_) for text_ in text if text_)
+    return size
+
+
+class BufferedWriter:
+    """
+    Buffer newline delimited records and write them to fout by batches of batch_size records
+    or buffer_size bytes, whichever comes first. A record is never split between two writes.
+    """
+
+    def __init__(self, fout, batch_size: int = 100, buffer_size: int = BUFFER_SIZE):
+        """
+        :param fout: binary file object
+        :param batch_size: int, max number of records per write
+        :param buffer_size: int, max number of bytes per write (unless a single record
+        exceeds it)
+        """
+        self.fout = fout
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write(self, record: bytes):
+        """
+        :param record: bytes, a single record (without trailing newline)
+        """
+        self._buffer += [record, b"\n"]
+        self._size += len(record) + 1
+        if len(self._buffer) >= 2 * self.batch_size or self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.fout.write(b"".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
+class MemberWriter:
+    """
+    Compress each write to fout as an independent gzip member (or zstd frame). The
+    concatenation of members is a valid gzip (zstd) file which can be truncated at any
+    member boundary. With threads > 1, members are compressed by a pool of threads (zlib
+    and zstd release the GIL) and written in order.
+    """
+
+    def __init__(self, fout, codec: str = "gzip", level: int = None, threads: int = 1):
+        """
+        :param fout: binary file object
+        :param codec: str, 'gzip' or 'zstd'
+        :param level: int, compression level, see LEVELS for defaults
+        :param threads: int, number of compression threads
+        """
+        self.fout = fout
+        self.compress = get_compressor(codec, level)
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        self._window = 2 * threads
+        self._pending = deque()
+
+    def write(self, b: bytes):
+        if self._pool is None:
+            self.fout.write(self.compress(b))
+            return
+        self._pending.append(self._pool.submit(self.compress, b))
+        while len(self._pending) > self._window:
+            self.fout.write(self._pending.popleft().result())
+
+    def flush(self):
+        """
+        Write the members being compressed
+        """
+        while self._pending:
+            self.fout.write(self._pending.popleft().result())
+
+    def close(self):
+        self.flush()
+        if self._pool:
+            self._pool.shutdown()
+
+
+class JsonlWriter:
+    """
+    Write serialized patents to a newline delimited json file, compressed according to its
+    extension. Gzip (.gz) and zstd (.zst) files are written as a sequence of members (one
+    per write, see MemberWriter), other extensions are handled by smart_open.
+    """
+
+    def __init__(
+        self,
+        dest: str,
+        encoder: str = "json",
+        batch_size: int = 100,
+        buffer_size: int = BUFFER_SIZE,
+        resumable: bool = False,
+        offset: int = 0,
+        level: int = None,
+        compress_threads: int = 1,
+        stream_size: int = None,
+    ):
+        """
+        :param dest: str
+        :param encoder: str, one of ENCODERS
+        :param batch_size: int, max number of patents per write
+        :param buffer_size: int, max number of bytes per write
+        :param resumable: bool, if True, dest (local, uncompressed, .gz or .zst) can be
+        truncated at any write boundary (see tell) and resumed. Remote dest are written
+        from scratch.
+        :param offset: int, resumable only, dest is truncated to offset bytes and appended
+        :param level: int, .gz and .zst only, compression level
+        :param compress_threads: int, .gz and .zst only, number of compression threads
+        :param stream_size: int, if not None, patents with stream_size characters of text
+        or more are encoded and written incrementally (see get_stream_encoder), by writes of
+        about buffer_size bytes
+        """
+        self.encode = get_encoder(encoder)
+        self.iterencode = get_stream_encoder(encoder)
+        self.stream_size = stream_size
+        codec = get_codec(dest)
+        if resumable and is_local(dest):
+            assert codec or not dest.endswith((".bz2", ".xz")), f"{dest} not resumable"
+            self._fout = io.open(dest, "r+b" if offset else "wb")
+            self._fout.truncate(offset)
+            self._fout.seek(offset)
+        else:
+            self._fout = open_raw(dest, "wb") if codec else open(dest, "wb")
+        self._raw = (
+            MemberWriter(self._fout, codec, level, compress_threads)
+            if codec
+            else self._fout
+        )
+        self._buffer = BufferedWriter(self._raw, batch_size, buffer_size)
+        self.nb_bytes = 0  # uncompressed
+
+    def tell(self):
+        """
+        Flush the buffered patents and return the number of bytes written in dest (resumable
+        only)
+        :return: int
+        """
+        self._buffer.flush()
+        self._raw.flush()
+        self._fout.flush()
+        return self._fout.tell()
+
+    def write(self, patent: dict):
+        """
+        :param patent: dict, returned by serialize_patent
+        """
+        if self.stream_size and patent_size(patent) >= self.stream_size:
+            self._write_stream(patent)
+            return
+        record = self.encode(patent)
+        self._buffer.write(record)
+        self.nb_bytes += len(record) + 1
+
+    def _write_stream(self, patent: dict):
+        self._buffer.flush()
+        chunks, size = [], 0
+        for chunk in itertools.chain(self.iterencode(patent), [b"\n"]):
+            chunks += [chunk]
+            size += len(chunk)
+            if size >= self._buffer.buffer_size:
+                self._raw.write(b"".join(chunks))
+                self.nb_bytes += size
+                chunks, size = [], 0
+        self._raw.write(b"".join(chunks))
+        self.nb_bytes += size
+
+    def close(self):
+        self._buffer.flush()
+        if self._raw is not self._fout:
+            self._raw.close()
+        self._fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_shard(dest: str, shard: int):
+    """
+    Return the path of the shard-th shard of dest. The shard index is inserted before the
+    format extension so that the format and compression are inferred as for dest (and
+    shards of part files sort in order).
+    :param dest: str, e.g. 'data/EP0600000.jsonl.gz', 'data/EP0600000.part00002.jsonl'
+    :param shard: int, e.g. 1
+    :return: str, e.g. 'data/EP0600000.shard00001.jsonl.gz',
+    'data/EP0600000.part00002.shard00001.jsonl'
+    """
+    dirname, basename = os.path.split(dest)
+    exts = basename.split(".")
+    i = next((i for i, ext in enumerate(exts) if ext in FORMATS), 1)
+    name, ext = ".".join(exts[:i]), ".".join(exts[i:])
+    return os.path.join(dirname, f"{name}.shard{shard:05d}.{ext}")
+
+
+def get_shards(dest: str):
+    """
+    Return the path of the shard manifest of dest
+    :param dest: str, e.g. 'data/EP0600000.jsonl.gz'
+    :return: str, e.g. 'data/EP0600000.jsonl.gz.shards.json'
+    """
+    return f"{dest}.shards.json"
+
+
+class ShardedWriter:
+    """
+    Write serialized patents to a sequence of shards of dest (see get_shard), rolling to a
+    new shard after shard_patents patents or shard_bytes (uncompressed) bytes. A patent is
+    never split between two shards. The list of shards, with their number of patents and
+    sizes, is saved in the shard manifest of dest (see get_shards).
+    """
+
+    def __init__(
+        self, dest: str, get_writer, shard_patents: int = None, shard_bytes: int = None
+    ):
+        """
+        :param dest: str
+        :param get_writer: Callable[[str], writer], returns the writer of a shard
+        :param shard_patents: int, max number of patents per shard
+        :param shard_bytes: int, max number of bytes per shard (jsonl only)
+        """
+        self.dest = dest
+        self.get_writer = get_writer
+        self.shard_patents = shard_patents
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self._writer = None
+
+    def write(self, patent: dict):
+        """
+        :param patent: dict, returned by serialize_patent
+        """
+        if self._writer is None:
+            path = get_shard(self.dest, len(self.shards))
+            self._writer = self.get_writer(path)
+            self.shards += [{"path": path, "nb_patents": 0, "nb_bytes": 0}]
+        self._writer.write(patent)
+        shard = self.shards[-1]
+        shard["nb_patents"] += 1
+        shard["nb_bytes"] = getattr(self._writer, "nb_bytes", 0)
+        if (self.shard_patents and shard["nb_patents"] >= self.shard_patents) or (
+            self.shard_bytes and shard["nb_bytes"] >= self.shard_bytes
+        ):
+            self._close_shard()
+
+    def _close_shard(self):
+        self._writer.close()
+        self._writer = None
+        shard = self.shards[-1]
+        if os.path.isfile(shard["path"]):
+            shard["size"] = os.path.getsize(shard["path"])
+
+    def close(self):
+        if self._writer is not None:
+            self._close_shard()
+        write_json(
+            {
+                "dest": self.dest,
+                "nb_patents": sum(shard["nb_patents"] for shard in self.shards),
+                "shards": self.shards,
+            },
+            get_shards(self.dest),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_writer(
+    dest: str,
+    output_format: str = "jsonl",
+    encoder: str = "json",
+    batch_size: int = 100,
+    buffer_size: int = BUFFER_SIZE,
+    prepare_names: bool = False,
+    compression: str = "snappy",
+    row_group_size: int = 10000,
+    resumable: bool = False,
+    offset: int = 0,
+    level: int = None,
+    compress_threads: int = 1,
+    shard_patents: int = None,
+    shard_bytes: int = None,
+    attrs: list = None,
+    stream_size: int = None,
+):
+    """
+    Return the writer of serialized patents to dest in output_format
+    :param dest: str
+    :param output_format: str, one of FORMATS
+    :param encoder: str, jsonl only, see get_encoder
+    :param batch_size: int, jsonl only, max number of patents per write
+    :param buffer_size: int, jsonl only, max number of bytes per write
+    :param prepare_names: bool, parquet only, True if names are prepared for BQ compatibility
+    :param compression: str, parquet only, see parseepo.parquet.COMPRESSIONS
+    :param row_group_size: int, parquet only, number of patents per row group
+    :param resumable: bool, jsonl only, see JsonlWriter
+    :param offset: int, jsonl only, see JsonlWriter
+    :param level: int, jsonl only, see JsonlWriter
+    :param compress_threads: int, jsonl only, see JsonlWriter
+    :param shard_patents: int, if not None, dest is sharded, see ShardedWriter
+    :param shard_bytes: int, jsonl only, if not None, dest is sharded, see ShardedWriter
+    :param attrs: List[str], parquet only, attributes in the schema (default: all)
+    :param stream_size: int, jsonl only, see JsonlWriter
+    :return: JsonlWriter, parseepo.parquet.ParquetWriter or ShardedWriter
+    """
+    assert output_format in FORMATS, f"output_format should be one of {FORMATS}"
+    if shard_patents or shard_bytes:
+        assert not resumable, "sharded outputs are not resumable"
+        assert not shard_bytes or output_format == "jsonl", "shard_bytes is jsonl only"
+        get_shard_writer = partial(
+            get_writer,
+            output_format=output_format,
+            encoder=encoder,
+            batch_size=batch_size,
+            buffer_size=buffer_size,
+            prepare_names=prepare_names,
+            compression=compression,
+            row_group_size=row_group_size,
+            level=level,
+            compress_threads=compress_threads,
+            attrs=attrs,
+            stream_size=stream_size,
+        )
+        return ShardedWriter(dest, get_shard_writer, shard_patents, shard_bytes)
+    if output_format == "jsonl":
+        return JsonlWriter(
+            dest,
+            encoder,
+            batch_size,
+            buffer_size,
+            resumable,
+            offset,
+            level,
+            compress_threads,
+            stream_size,
+        )
+    else:
+        from parseepo.parquet import ParquetWriter  # pyarrow is optional
+
+        return ParquetWriter(dest, prepare_names, compression, row_group_size, attrs)
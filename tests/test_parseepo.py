@@ -1,5 +1,1097 @@
-from parseepo import __version__
+import gzip
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+
+import pytest
+from typer.testing import CliRunner
+
+from parseepo import __version__, iter_patents, iter_serialized
+from parseepo import process
+from parseepo.analytics import aggregate_files, iter_presence_tsv
+from parseepo.cli import app, create_sample_list
+from parseepo.diagnostics import RateLimitedWarnings
+from parseepo.delta import get_summary, ingest_delta
+from parseepo.exception import RowException
+from parseepo.index import Index, build_index
+from parseepo.lease import Leases
+from parseepo.manifest import read_json
+from parseepo.markup import handle_html, html2text_handle, html_to_text
+from parseepo.process import (
+    get_dest,
+    get_serializer,
+    process_epo_file,
+    process_epo_files,
+    serialize_patents,
+)
+from parseepo.reader import (
+    estimate_size,
+    get_chunks,
+    is_grouped,
+    open_bytes,
+    sort_epo_file,
+)
+from parseepo.schema import bq_schema
+from parseepo.serialize import serialize_patent, serialize_patent_python
+from parseepo.synthetic import generate_epo_file
+from parseepo.utils import get_publication_number
+from parseepo.validate import validate_file, validate_files
+from parseepo.writer import CODECS, BufferedWriter, JsonlWriter, get_encoder
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "io", "sampleEP0600000.txt")
+
+
+def read_sample(file=SAMPLE):
+    return list(iter_patents(file))
+
+
+def read_bytes(path):
+    if path.endswith(".zst"):
+        zstandard = pytest.importorskip("zstandard")
+        with open(path, "rb") as fin:
+            return zstandard.ZstdDecompressor().stream_reader(fin).readall()
+    with gzip.open(path) if path.endswith(".gz") else open(path, "rb") as fin:
+        return fin.read()
+
+
+def read_jsonl(path):
+    with open_bytes(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def write_sample(dest, nb_copies):
+    """
+    Write nb_copies of the sample, with distinct publication numbers, to dest
+    """
+    with open(SAMPLE, "r") as fin:
+        rows = [line.split("\t") for line in fin]
+    with open(dest, "w") as fout:
+        for i in range(nb_copies):
+            for row_ in rows:
+                fout.write("\t".join([row_[0], f"{i:02d}{row_[1][2:]}"] + row_[2:]))
 
 
 def test_version():
     assert __version__ == "0.1.0"
+
+
+@pytest.mark.parametrize("prepare_names", [False, True])
+@pytest.mark.parametrize("handle_html", [False, True])
+def test_serialize_patent_python_parity(prepare_names, handle_html):
+    for data in read_sample():
+        expected = serialize_patent(data, prepare_names, handle_html)
+        out = serialize_patent_python(data, prepare_names, handle_html)
+        assert json.dumps(out, ensure_ascii=False) == json.dumps(
+            expected, ensure_ascii=False
+        )
+
+
+def test_serialize_patent_python_parity_multi_value():
+    data = read_sample()[0]
+    data += [data[3]]  # duplicated ABSTR, only the first value is kept
+    expected = serialize_patent(data, prepare_names=True)
+    assert serialize_patent_python(data, prepare_names=True) == expected
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_process_epo_files(tmp_path, executor):
+    files = []
+    for i in range(2):
+        files += [str(tmp_path / f"EP0{i}.txt")]
+        shutil.copy(SAMPLE, files[-1])
+    (tmp_path / "EPbad.txt").write_text("EP\tbad\n")
+    files += [str(tmp_path / "EPbad.txt")]
+
+    results, errors = process_epo_files(files, max_workers=2, executor=executor)
+    assert results == {files[0]: 3, files[1]: 3}
+    assert list(errors) == [files[2]]
+    with open(tmp_path / "EP00.jsonl") as fin:
+        assert [json.loads(line)["publication_number"] for line in fin] == [
+            "EP-0600083-A1",
+            "EP-0600102-A1",
+            "EP-0600103-A1",
+        ]
+
+
+def test_get_chunks():
+    chunks = get_chunks(SAMPLE, 3)
+    assert len(chunks) == 3
+    assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize(SAMPLE)
+    publication_numbers = []
+    for start, end in chunks:
+        patents = list(iter_patents(SAMPLE, start, end))
+        publication_numbers += [
+            {
+                get_publication_number("\t".join(row_))
+                for data in patents
+                for row_ in data
+            }
+        ]
+    assert publication_numbers == [
+        {"EP-0600083-A1"},
+        {"EP-0600102-A1"},
+        {"EP-0600103-A1"},
+    ]
+
+
+@pytest.mark.parametrize("stitch_parts", [True, False])
+def test_process_epo_files_split(tmp_path, stitch_parts):
+    src = str(tmp_path / "EP0600000.txt")
+    shutil.copy(SAMPLE, src)
+    process_epo_files([src], executor="thread")
+    with open(tmp_path / "EP0600000.jsonl") as fin:
+        expected = fin.read()
+
+    results, _ = process_epo_files(
+        [src], executor="thread", split=3, stitch_parts=stitch_parts
+    )
+    assert results == {src: 3}
+    if stitch_parts:
+        with open(tmp_path / "EP0600000.jsonl") as fin:
+            assert fin.read() == expected
+    else:
+        out = ""
+        for i in range(3):
+            with open(tmp_path / f"EP0600000.part{i:05d}.jsonl") as fin:
+                out += fin.read()
+        assert out == expected
+
+
+def test_iter_patents(tmp_path):
+    with open(SAMPLE, "rb") as fin:
+        raw = fin.read()
+    with gzip.open(tmp_path / "sample.txt.gz", "wb") as fout:
+        fout.write(raw)
+    patents = iter_patents(str(tmp_path / "sample.txt.gz"))
+    data = next(patents)
+    assert len(data) == 7
+    assert {get_publication_number("\t".join(row_)) for row_ in data} == {
+        "EP-0600083-A1"
+    }
+    assert len(list(patents)) == 2
+
+    serialized = list(iter_serialized(SAMPLE, prepare_names=True))
+    assert [patent["publication_number"] for patent in serialized] == [
+        "EP-0600083-A1",
+        "EP-0600102-A1",
+        "EP-0600103-A1",
+    ]
+    assert serialized[0]["abstract"]["language"] == "en"
+
+
+def test_iter_patents_filters(tmp_path):
+    attrs, languages = ["TITLE", "CLAIM"], ["en"]
+    expected = [
+        [row_ for row_ in data if row_[5] in attrs and row_[4] in languages]
+        for data in read_sample()
+    ]
+    assert list(iter_patents(SAMPLE, attrs=attrs, languages=languages)) == expected
+    assert list(iter_patents(SAMPLE, date_to="1994-06-08")) == read_sample()
+    assert not list(iter_patents(SAMPLE, date_from="1994-06-09"))
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    src = str(tmp_path / "EP0600000.txt")
+    shutil.copy(SAMPLE, src)
+    results, _ = process_epo_files(
+        [src], executor="thread", output_format="parquet", attrs=["TITLE", "CLAIM"]
+    )
+    assert results == {src: 3}
+    table = pq.read_table(tmp_path / "EP0600000.parquet")
+    assert table.column_names == [
+        field_["name"] for field_ in bq_schema(attrs=["TITLE", "CLAIM"])
+    ]
+    assert table.column_names == [
+        "publication_number",
+        "publication_date",
+        "TITLE",
+        "CLAIM",
+    ]
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_mmap_reader(tmp_path, newline):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 3)
+    with open(src, "r") as fin:
+        lines = fin.readlines()
+    lines[9] = "\t".join(lines[9].split("\t")[:5]) + "\n"  # 2nd patent, fr TITLE
+    fields = lines[4].split("\t", 6)  # 1st patent, DESCR with a stray tab
+    lines[4] = "\t".join(fields[:6] + ["stray"] + fields[6:])
+    lines[-1] = lines[-1].rstrip("\n")  # no final line ending
+    with open(src, "w", newline=newline) as fout:
+        fout.writelines(lines)
+
+    def read(**kwargs):
+        errors = []
+        on_error = lambda e, *args: errors.append(args)  # noqa: E731
+        patents = list(
+            iter_patents(src, with_offsets=True, on_error=on_error, **kwargs)
+        )
+        return patents, errors
+
+    for kwargs in [
+        {},
+        {"attrs": ["TITLE", "CLAIM"], "languages": ["en"]},
+        {"max_patent_size": 16800},
+        *[{"start": start, "end": end} for start, end in get_chunks(src, 3)],
+    ]:
+        assert read(reader="mmap", **kwargs) == read(**kwargs)
+    patents, errors = read(reader="mmap")
+    assert len(patents) == 9 and [line for line, *_ in errors] == [5, 10]
+    # malformed rows are filtered (if they have the fields) before being validated
+    patents, errors = read(reader="mmap", attrs=["CLAIM"])
+    assert (patents, errors) == read(attrs=["CLAIM"])
+    assert len(patents) == 9 and [line for line, *_ in errors] == [10]
+
+
+def test_sort(tmp_path):
+    grouped, src = str(tmp_path / "grouped.txt"), str(tmp_path / "EP0600000.txt")
+    write_sample(grouped, 2)
+    patents = [["\t".join(row_) for row_ in data] for data in iter_patents(grouped)]
+    with open(src, "w") as fout:  # rows of the 6 patents interleaved
+        for i in range(max(len(lines) for lines in patents)):
+            fout.writelines(lines[i] for lines in patents if i < len(lines))
+    assert is_grouped(grouped) and not is_grouped(src)
+
+    for run_size in [100, 1000000]:  # spilled runs, in memory
+        sort_epo_file(src, str(tmp_path / "sorted.txt"), run_size)
+        assert read_bytes(str(tmp_path / "sorted.txt")) == read_bytes(grouped)
+    assert sorted(os.listdir(tmp_path)) == [
+        "EP0600000.txt",
+        "grouped.txt",
+        "sorted.txt",
+    ]
+
+    results, _ = process_epo_files([src], executor="thread", split=2, sort=True)
+    assert results == {src: 6}
+    process_epo_file(grouped, str(tmp_path / "expected.jsonl"), progress=queue.Queue())
+    assert read_bytes(str(tmp_path / "EP0600000.jsonl")) == read_bytes(
+        str(tmp_path / "expected.jsonl")
+    )
+
+
+def test_create_sample_list():
+    with open(SAMPLE.replace(".txt", ".p"), "rb") as fin:
+        expected = pickle.load(fin)
+    assert read_sample() == expected
+    assert create_sample_list(SAMPLE) == expected
+
+
+def test_create_sample_list_malformed(tmp_path):
+    src = str(tmp_path / "sample.txt")
+    with open(SAMPLE, "r") as fin:
+        lines = fin.readlines()
+    lines[1] = "\t".join(lines[1].split("\t")[:5]) + "\n"  # sampled as is
+    with open(src, "w") as fout:
+        fout.writelines(lines)
+    sample = create_sample_list(src)
+    assert len(sample) == 3 and sample[0][1] == lines[1].split("\t")
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd", "none"])
+@pytest.mark.parametrize("compress_threads", [1, 3])
+def test_codec(tmp_path, codec, compress_threads):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    src = str(tmp_path / "EP0600000.txt.gz")
+    write_sample(str(tmp_path / "EP0600000.txt"), 5)
+    with open(tmp_path / "EP0600000.txt", "rb") as fin, gzip.open(src, "wb") as fout:
+        fout.write(fin.read())
+    expected = [
+        json.dumps(patent, ensure_ascii=False) for patent in iter_serialized(src)
+    ]
+    results, _ = process_epo_files(
+        [src],
+        executor="thread",
+        codec=codec,
+        level=1,
+        compress_threads=compress_threads,
+        batch_size=2,
+    )
+    dest = get_dest(src, codec=codec)
+    assert dest == str(tmp_path / "EP0600000.jsonl") + CODECS[codec]
+    assert read_bytes(dest).decode("utf-8").splitlines() == expected
+    assert read_jsonl(dest) == [json.loads(patent) for patent in expected]
+
+
+def test_buffered_writer():
+    class Fout(list):
+        def write(self, b):
+            self.append(b)
+
+    fout = Fout()
+    with BufferedWriter(fout, batch_size=2, buffer_size=10) as writer:
+        for record in [b"a", b"b", b"c", b"0123456789", b"d"]:
+            writer.write(record)
+    assert fout == [b"a\nb\n", b"c\n0123456789\n", b"d\n"]
+
+
+@pytest.mark.parametrize("encoder", ["json", "orjson", "ujson"])
+def test_get_encoder(encoder):
+    pytest.importorskip(encoder)
+    encode = get_encoder(encoder)
+    for patent in iter_serialized(SAMPLE):
+        assert json.loads(encode(patent)) == patent
+    patent = {"title": {"text": ["DISPOSITIF D'ACHEMINEMENT À"]}}
+    assert get_encoder()(patent) == json.dumps(patent, ensure_ascii=False).encode()
+
+
+@pytest.mark.parametrize("prepare_names", [False, True])
+def test_process_epo_file_parquet(tmp_path, prepare_names):
+    pq = pytest.importorskip("pyarrow.parquet")
+    src = str(tmp_path / "EP0600000.txt")
+    shutil.copy(SAMPLE, src)
+    results, _ = process_epo_files(
+        [src],
+        executor="thread",
+        output_format="parquet",
+        prepare_names=prepare_names,
+        row_group_size=2,
+    )
+    assert results == {src: 3}
+    parquet_file = pq.ParquetFile(tmp_path / "EP0600000.parquet")
+    assert parquet_file.metadata.num_row_groups == 2
+    title = "title" if prepare_names else "TITLE"
+    table = pq.read_table(tmp_path / "EP0600000.parquet", columns=[title])
+    expected = list(iter_serialized(SAMPLE, prepare_names=prepare_names))
+    assert table.column(title).to_pylist() == [patent[title] for patent in expected]
+
+
+@pytest.mark.parametrize("ext", [".jsonl", ".jsonl.gz", ".jsonl.zst"])
+def test_process_epo_file_resume(tmp_path, monkeypatch, ext):
+    src, dest = str(tmp_path / "EP.txt"), str(tmp_path / f"EP{ext}")
+    checkpoint, stats = dest + ".ckpt", dest + ".stats.json"
+    write_sample(src, 4)
+    process_epo_file(src, str(tmp_path / f"expected{ext}"), progress=queue.Queue())
+
+    serialize, calls = process.ENGINES["python"], []
+
+    def serialize_and_die(*args, **kwargs):
+        if len(calls) == 7:
+            raise RuntimeError("worker died")
+        calls.append(serialize(*args, **kwargs))
+        return calls[-1]
+
+    monkeypatch.setitem(process.ENGINES, "python", serialize_and_die)
+    with pytest.raises(RuntimeError):
+        process_epo_file(
+            src,
+            dest,
+            progress=queue.Queue(),
+            checkpoint=checkpoint,
+            checkpoint_every=3,
+            stats=stats,
+        )
+    assert read_json(checkpoint)["nb_patents"] == 6
+    assert read_json(checkpoint)["stats"]["nb_patents"] == 6
+    assert not os.path.exists(stats)
+    with open(stats, "w") as fout:  # e.g. stats sidecar of a later batch, not trusted
+        json.dump({"nb_patents": 9}, fout)
+
+    monkeypatch.undo()
+    nb_patents = process_epo_file(
+        src,
+        dest,
+        progress=queue.Queue(),
+        checkpoint=checkpoint,
+        checkpoint_every=3,
+        stats=stats,
+    )
+    assert nb_patents == 12
+    assert read_json(stats)["rows"]["TITLE"] == 36
+    assert not os.path.exists(checkpoint)
+    assert read_bytes(dest) == read_bytes(str(tmp_path / f"expected{ext}"))
+
+
+def test_process_epo_file_resume_quarantine(tmp_path, monkeypatch):
+    src, dest = str(tmp_path / "EP.txt"), str(tmp_path / "EP.jsonl")
+    checkpoint, quarantine = dest + ".ckpt", dest + ".quarantine.jsonl"
+    write_sample(src, 4)
+    with open(src, "r") as fin:
+        lines = fin.readlines()
+    for i in range(0, len(lines), 7):  # first row (read ahead) and fr TITLE, 12 patents
+        for j in [i, i + 2]:
+            lines[j] = "\t".join(lines[j].split("\t")[:5]) + "\n"
+    with open(src, "w") as fout:
+        fout.writelines(lines)
+    kwargs = {
+        "progress": queue.Queue(),
+        "checkpoint": checkpoint,
+        "checkpoint_every": 3,
+        "stats": dest + ".stats.json",
+        "error_policy": "skip",
+    }
+    process_epo_file(src, str(tmp_path / "expected.jsonl"), **kwargs)
+
+    serialize, calls = process.ENGINES["python"], []
+
+    def serialize_and_die(*args, **kwargs):
+        if len(calls) == 7:
+            raise RuntimeError("worker died")
+        calls.append(serialize(*args, **kwargs))
+        return calls[-1]
+
+    monkeypatch.setitem(process.ENGINES, "python", serialize_and_die)
+    kwargs.update({"error_policy": "quarantine", "quarantine": quarantine})
+    with pytest.raises(RuntimeError):
+        process_epo_file(src, dest, **kwargs)
+    state = read_json(checkpoint)
+    assert len(read_jsonl(quarantine)) > 12  # rows of the 7th and 8th patents
+    assert state["stats"]["errors"] == {"RowException": 12}
+    with open(quarantine, "rb") as fin:
+        assert len(fin.read()[: state["quarantine_size"]].splitlines()) == 12
+
+    monkeypatch.undo()
+    assert process_epo_file(src, dest, **kwargs) == 12
+    records = read_jsonl(quarantine)
+    assert [record["offset"] for record in records] == [
+        len("".join(lines[: i + 1]).encode("utf-8"))
+        for i in range(len(lines))
+        if i % 7 in [0, 2]
+    ]
+    assert read_json(dest + ".stats.json")["errors"] == {"RowException": 24}
+    assert read_bytes(dest) == read_bytes(str(tmp_path / "expected.jsonl"))
+
+
+def test_process_epo_file_resume_remote(tmp_path):
+    src, dest = str(tmp_path / "EP.txt"), str(tmp_path / "EP.jsonl")
+    write_sample(src, 2)
+    process_epo_file(src, str(tmp_path / "expected.jsonl"), progress=queue.Queue())
+    with open(dest, "w") as fout:
+        fout.write("partial")
+    # remote dest (scheme), not resumable: written from scratch, without checkpoint
+    nb_patents = process_epo_file(
+        src, f"file://{dest}", progress=queue.Queue(), checkpoint=dest + ".ckpt"
+    )
+    assert nb_patents == 6 and not os.path.exists(dest + ".ckpt")
+    assert read_bytes(dest) == read_bytes(str(tmp_path / "expected.jsonl"))
+    with JsonlWriter(f"file://{dest}", resumable=True, offset=7) as writer:
+        writer.write({"publication_number": "EP-0600083-A1"})
+    assert read_jsonl(dest) == [{"publication_number": "EP-0600083-A1"}]
+
+
+@pytest.mark.parametrize("encoder", ["json", "orjson"])
+@pytest.mark.parametrize("ext", [".jsonl", ".jsonl.gz"])
+def test_stream_size(tmp_path, encoder, ext):
+    if encoder == "orjson":
+        pytest.importorskip("orjson")
+    src = str(tmp_path / "EP.txt")
+    write_sample(src, 2)
+    expected, dest = str(tmp_path / f"expected{ext}"), str(tmp_path / f"EP{ext}")
+    process_epo_file(src, expected, progress=queue.Queue(), encoder=encoder)
+    process_epo_file(
+        src,
+        dest,
+        progress=queue.Queue(),
+        encoder=encoder,
+        stream_size=1000,
+        buffer_size=100,
+    )
+    assert read_bytes(dest) == read_bytes(expected)
+
+
+def test_max_patent_size():
+    sizes = [sum(len("\t".join(row_)) for row_ in data) for data in read_sample()]
+    patents = list(iter_patents(SAMPLE, max_patent_size=sorted(sizes)[1]))
+    assert patents == [
+        data for data, size in zip(read_sample(), sizes) if size <= sorted(sizes)[1]
+    ]
+    assert len(patents) == 2
+
+
+def normalize_text(text):
+    """
+    Drop whitespace (html2text wraps lines) and markdown escapes/emphasis
+    """
+    return re.sub(r"[\s*_]", "", re.sub(r"\\(.)", r"\1", text))
+
+
+def test_html_to_text():
+    for data in read_sample():
+        for *_, attr, text in data:
+            if attr in ["ABSTR", "DESCR", "CLAIM"]:
+                expected = normalize_text(html2text_handle(text))
+                assert normalize_text(html_to_text(text)) == expected
+    assert html_to_text('<p num="1">a &amp; b<br/>c</p><!-- EPO <DP n="2"> -->') == (
+        "a & b\nc\n"
+    )
+
+
+def test_handle_html_attrs():
+    data = read_sample()[0]
+    serializer = get_serializer(
+        handle_html=True, html_engine="fast", html_attrs=["CLAIM"]
+    )
+    out = serializer(data)
+    expected = serialize_patent_python(data)
+    for attr in expected:
+        if attr == "CLAIM":
+            assert out[attr]["text"] == [
+                handle_html(attr, text, "fast") for text in expected[attr]["text"]
+            ]
+        else:
+            assert out[attr] == expected[attr]
+
+
+def test_serialize_patents_workers(tmp_path):
+    src = str(tmp_path / "EP.txt")
+    write_sample(src, 5)
+    serializer = get_serializer(handle_html=True, html_engine="fast")
+    patents = list(iter_patents(src, with_offsets=True))
+    expected = [patent for _, _, patent in serialize_patents(patents, serializer)]
+    out = [patent for _, _, patent in serialize_patents(patents, serializer, 2, 3)]
+    assert out == expected
+
+
+def test_process_epo_files_metrics(tmp_path):
+    src, metrics = str(tmp_path / "EP0600000.txt"), str(tmp_path / "metrics.json")
+    write_sample(src, 4)
+    process_epo_files(
+        [src], executor="thread", split=2, metrics=metrics, handle_html=True
+    )
+    report = read_json(metrics)
+    assert report["total"]["nb_patents"] == 12
+    assert report["total"]["bytes_in"] == os.path.getsize(src)
+    assert report["total"]["peak_rss_mb"] > 0
+    assert report["total"]["bytes_out"] == os.path.getsize(tmp_path / "EP0600000.jsonl")
+    assert report["files"][src]["largest_patent"]["publication_number"].endswith(
+        "00102-A1"
+    )
+    assert set(report["total"]["stages"]) == {
+        "read",
+        "serialize",
+        "html",
+        "encode",
+        "write",
+    }
+    assert sorted(os.listdir(tmp_path)) == [
+        "EP0600000.jsonl",
+        "EP0600000.txt",
+        "metrics.json",
+    ]
+
+
+def test_process_epo_files_stats(tmp_path):
+    src, src_, stats = (
+        str(tmp_path / "EP0600000.txt"),
+        str(tmp_path / "EP0700000.txt"),
+        str(tmp_path / "stats.json"),
+    )
+    write_sample(src, 4)
+    shutil.copy(SAMPLE, src_)
+    with open(SAMPLE, "r") as fin:
+        pdfep = fin.readlines()[-1]
+    with open(src_, "a") as fout:
+        fout.write(pdfep)  # PDFEP twice
+    process_epo_files([src, src_], executor="thread", split=2, stats=stats)
+    report = read_json(stats)
+    assert report["files"][src]["nb_patents"] == 12
+    assert report["files"][src_]["multi_value"] == {"PDFEP": 1}
+    total = report["total"]
+    assert total["nb_patents"] == 15
+    assert total["nb_rows"] == 4 * 21 + 22
+    assert total["rows"]["TITLE"] == 45
+    assert total["languages"]["DESCR"] == {"de": 10, "en": 5}
+    assert total["publication_date"] == {"min": "1994-06-08", "max": "1994-06-08"}
+    assert total["years"] == {"1994": 15}
+    assert sorted(os.listdir(tmp_path)) == [
+        "EP0600000.jsonl",
+        "EP0600000.jsonl.stats.json",
+        "EP0600000.txt",
+        "EP0700000.jsonl",
+        "EP0700000.jsonl.stats.json",
+        "EP0700000.txt",
+        "stats.json",
+    ]
+
+
+@pytest.mark.parametrize("split,leased", [(3, False), (3, True), (1, True)])
+def test_validation_split(tmp_path, monkeypatch, split, leased):
+    src, validation = str(tmp_path / "EP0600000.txt"), str(tmp_path / "validation.json")
+    write_sample(src, 4)
+    serialize = process.ENGINES["python"]
+
+    def serialize_invalid(data, **kwargs):  # 1 patent out of 3 is invalid
+        patent = serialize(data, **kwargs)
+        if patent["publication_number"].endswith("103-A1"):
+            patent["publication_date"] = 1
+        return patent
+
+    monkeypatch.setitem(process.ENGINES, "python", serialize_invalid)
+    lease_dir = str(tmp_path / "leases") if leased else None
+    process_epo_files(
+        [src],
+        executor="thread",
+        split=split,
+        validation=validation,
+        lease_dir=lease_dir,
+    )
+    dest = str(tmp_path / "EP0600000.jsonl")
+    expected = validate_file(dest)
+    assert [example["line"] for example in expected["examples"]] == [3, 6, 9, 12]
+    assert read_json(validation)["files"][src] == expected
+
+
+def test_validate_files(tmp_path):
+    src, validation = str(tmp_path / "EP0600000.txt"), str(tmp_path / "validation.json")
+    write_sample(src, 2)
+    process_epo_files([src], executor="thread", validation=validation)
+    dest = str(tmp_path / "EP0600000.jsonl")
+    assert read_json(validation)["total"] == validate_file(dest)
+    assert validate_file(dest)["nb_errors"] == 0
+
+    bad = str(tmp_path / "bad.jsonl")
+    with open(bad, "w") as fout:
+        fout.write('{"publication_number": 1, "publication_date": 2}\n{"publica')
+    summary, reports = validate_files([dest, bad], max_examples=2, max_workers=2)
+    assert summary["nb_patents"] == 8
+    assert summary["errors"] == {
+        "type:publication_number": 1,
+        "type:publication_date": 1,
+        "json": 1,
+    }
+    assert [(e["file"], e["line"]) for e in summary["examples"]] == [(bad, 1)] * 2
+    assert reports[dest]["nb_errors"] == 0
+
+
+@pytest.mark.parametrize("split", [1, 3])
+def test_shards(tmp_path, split):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 5)
+    expected = list(iter_serialized(src))
+    process_epo_files(
+        [src], executor="thread", split=split, shard_patents=4, shard_bytes=1000000
+    )
+    shards = read_json(str(tmp_path / "EP0600000.jsonl.shards.json"))
+    assert shards["nb_patents"] == 15
+    out = []
+    for shard in shards["shards"]:
+        patents = read_jsonl(shard["path"])
+        assert len(patents) == shard["nb_patents"] <= 4
+        assert os.path.getsize(shard["path"]) == shard["size"] == shard["nb_bytes"]
+        out += patents
+    assert out == expected
+    assert sorted(shard["path"] for shard in shards["shards"]) == [
+        shard["path"] for shard in shards["shards"]
+    ]
+
+    process_epo_files([src], executor="thread", shard_bytes=25000)
+    shards = read_json(str(tmp_path / "EP0600000.jsonl.shards.json"))
+    assert all(shard["nb_bytes"] < 25000 + 20000 for shard in shards["shards"])
+    assert sum(shard["nb_patents"] for shard in shards["shards"]) == 15
+
+
+def test_process_epo_files_manifest(tmp_path):
+    src, manifest = str(tmp_path / "EP0600000.txt"), str(tmp_path / "manifest.json")
+    shutil.copy(SAMPLE, src)
+    results, _ = process_epo_files([src], executor="thread", manifest=manifest)
+    assert results == {src: 3}
+    assert read_json(manifest)["files"][src]["nb_patents"] == 3
+
+    results, _ = process_epo_files([src], executor="thread", manifest=manifest)
+    assert results == {}
+
+    write_sample(src, 2)
+    results, _ = process_epo_files([src], executor="thread", manifest=manifest)
+    assert results == {src: 6}
+
+
+def test_index(tmp_path):
+    srcs = [str(tmp_path / "EP00.txt"), str(tmp_path / "EP01.txt.gz")]
+    write_sample(srcs[0], 3)
+    write_sample(str(tmp_path / "EP01.txt"), 2)
+    with open(tmp_path / "EP01.txt", "rb") as fin, gzip.open(srcs[1], "wb") as fout:
+        fout.write(fin.read())
+    process_epo_files(srcs, executor="thread")
+
+    assert build_index(srcs, str(tmp_path / "tsv.idx"), max_workers=2) == 15
+    with Index(str(tmp_path / "tsv.idx")) as index:
+        assert len(index) == 15
+        assert [loc[0] for loc in index.locate("EP-0100083-A1")] == srcs
+        rows = index.lookup("EP-0200102-A1")
+        assert rows == [read_sample(srcs[0])[7]]
+        assert index.lookup("EP-0600083-A1") == []
+
+    dests = [str(tmp_path / "EP00.jsonl"), str(tmp_path / "EP01.jsonl.gz")]
+    assert build_index(dests, str(tmp_path / "jsonl.idx"), max_workers=2) == 15
+    with Index(str(tmp_path / "jsonl.idx")) as index:
+        assert index.kind == "jsonl"
+        records = index.lookup("EP-0100083-A1")
+        assert len(records) == 2
+        assert records[1] == list(iter_serialized(srcs[1]))[3]
+
+
+def test_generate_epo_file(tmp_path):
+    dest = str(tmp_path / "EP.txt.gz")
+    nb_lines = generate_epo_file(dest, 20, amend_rate=0.5, descr_length=1000)
+    patents = read_sample(dest)
+    assert len(patents) == 20
+    assert sum(len(data) for data in patents) == nb_lines
+    attrs = {row_[5] for data in patents for row_ in data}
+    assert attrs == {"TITLE", "ABSTR", "DESCR", "CLAIM", "AMEND", "PDFEP"}
+    assert len(list(iter_serialized(dest, handle_html=True))) == 20
+
+    generate_epo_file(
+        str(tmp_path / "EP2.txt.gz"), 20, amend_rate=0.5, descr_length=1000
+    )
+    assert read_sample(str(tmp_path / "EP2.txt.gz")) == patents
+
+
+def test_ingest_delta(tmp_path):
+    corpus = [str(tmp_path / "EP00.jsonl"), str(tmp_path / "EP01.jsonl")]
+    for i, dest in enumerate(corpus):  # EP-00..., EP-01... (and EP-02... in EP01)
+        write_sample(str(tmp_path / f"EP0{i}.txt"), 2 + i)
+        process_epo_file(str(tmp_path / f"EP0{i}.txt"), dest, progress=queue.Queue())
+    index = str(tmp_path / "jsonl.idx")
+    build_index(corpus, index, max_workers=1)
+    with Index(index) as index_:
+        untouched = index_.lookup("EP-0200103-A1")
+
+    os.mkdir(tmp_path / "delta")
+    batch = [str(tmp_path / "delta" / "EPa.txt"), str(tmp_path / "delta" / "EPb.txt")]
+    rows = [
+        [["EP", "01" + row_[1][2:]] + row_[2:] for row_ in data]
+        for data in read_sample()
+    ]
+    with open(batch[0], "w") as fout:  # 2 updates and a new kind code
+        for row_ in rows[0] + rows[1]:
+            fout.write("\t".join(row_[:6] + ["old " + row_[6]]))
+        for row_ in rows[2]:
+            fout.write("\t".join(row_[:2] + ["B1"] + row_[3:]))
+    with open(batch[1], "w") as fout:  # last write wins
+        for row_ in rows[1]:
+            fout.write("\t".join(row_[:6] + ["new " + row_[6]]))
+
+    partition, changes = str(tmp_path / "EP02.jsonl"), str(tmp_path / "changes.jsonl")
+    summary = ingest_delta(batch, index, partition, changes, executor="thread")
+    assert (summary["nb_inserted"], summary["nb_updated"]) == (1, 2)
+    assert summary == read_json(get_summary(changes))
+    assert len(read_jsonl(changes)) == 3
+    with Index(index) as index_:
+        assert len(index_) == 6 + 9 - 2 + 1  # EP-01... were in both partitions
+        assert index_.lookup("EP-0200103-A1") == untouched
+        updated = index_.lookup("EP-0100102-A1")
+        assert [patent["TITLE"]["text"][0][:4] for patent in updated] == ["new "]
+        assert index_.lookup("EP-0100083-A1")[0]["TITLE"]["text"][0][:4] == "old "
+        assert index_.locate("EP-0100103-B1")[0][0] == partition
+    assert len(read_jsonl(corpus[0])) == 6
+    assert len(read_jsonl(corpus[1])) == 9 - 2
+
+
+def test_aggregate_files(tmp_path):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 2)
+    process_epo_files([src], executor="thread", prepare_names=True)
+    tsv = aggregate_files([src], max_workers=1, min_publications=1)
+    jsonl = aggregate_files(
+        [str(tmp_path / "EP0600000.jsonl")], max_workers=1, min_publications=1
+    )
+    for name in ["nb_pubnum_df", "nb_family_df", "nb_full_text_df", "languages_df"]:
+        assert getattr(tsv, name)().equals(getattr(jsonl, name)())
+    assert tsv.nb_pubnum_df().values.tolist() == [[1994, 6]]
+    assert tsv.nb_full_text_df(english=True).values.tolist() == [
+        [1994] + [2] * 4 + [0, 2]
+    ]
+    # as in eda.queries (SUM(...) > 1), single publication families have no attribute
+    coverage = aggregate_files([src], max_workers=1)
+    assert coverage.nb_full_text_df().values.tolist() == [[1994] + [0] * 6]
+
+    families = tmp_path / "families.csv"
+    with open(families, "w") as fout:
+        fout.write("publication_number,family_id\n")
+        for i in range(2):
+            for num in ["0600083", "0600102", "0600103"]:
+                fout.write(f"EP-{i:02d}{num[2:]}-A1,{num}\n")
+    coverage = aggregate_files([src], str(families), max_workers=1)
+    assert coverage.nb_family_df().values.tolist() == [[1994, 3]]
+    assert coverage.nb_full_text_df().values.tolist() == [[1994] + [3] * 4 + [0, 3]]
+    # only the copies of 0600083 have an english description
+    assert coverage.nb_full_text_df(english=True).values.tolist() == [
+        [1994] + [1] * 4 + [0, 1]
+    ]
+
+    with open(src, "a") as fout:
+        fout.write("EP\t0600104\tA1\t1994-06-08\ten\n")  # malformed
+    coverage = aggregate_files([src, src], str(families), max_workers=1)
+    assert coverage.nb_malformed == 2
+    assert coverage.nb_pubnum_df().values.tolist() == [[1994, 12]]
+    with pytest.raises(RowException):
+        list(iter_presence_tsv(src))
+
+
+@pytest.mark.parametrize("error_policy", ["fail", "skip", "quarantine"])
+def test_error_policy(tmp_path, error_policy):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 2)
+    with open(src, "r") as fin:
+        lines = fin.readlines()
+    lines[9] = "\t".join(lines[9].split("\t")[:5]) + "\n"  # 2nd patent, fr TITLE
+    with open(src, "w") as fout:
+        fout.writelines(lines)
+    results, errors = process_epo_files(
+        [src], executor="thread", split=2, error_policy=error_policy
+    )
+    if error_policy == "fail":
+        assert not results and type(errors[src]).__name__ == "RowException"
+        return
+    assert results == {src: 6}
+    patents = read_jsonl(str(tmp_path / "EP0600000.jsonl"))
+    assert patents[1]["TITLE"]["language"] == ["de", "en"]
+    quarantine = tmp_path / "EP0600000.jsonl.quarantine.jsonl"
+    if error_policy == "skip":
+        assert not quarantine.exists()
+        return
+    (record,) = read_jsonl(str(quarantine))
+    assert record["file"] == src
+    assert record["line"] == 10
+    assert record["offset"] == len("".join(lines[:10]).encode("utf-8"))
+    assert record["row"] == lines[9]
+
+
+@pytest.mark.parametrize("error_policy", ["fail", "quarantine"])
+def test_max_patent_size_policy(tmp_path, error_policy):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 2)
+    sizes = [sum(len("\t".join(row_)) for row_ in data) for data in iter_patents(src)]
+    results, errors = process_epo_files(
+        [src],
+        executor="thread",
+        max_patent_size=sorted(sizes)[-3],
+        error_policy=error_policy,
+        stats=str(tmp_path / "stats.json"),
+        metrics=str(tmp_path / "metrics.json"),
+    )
+    if error_policy == "fail":
+        assert not results and type(errors[src]).__name__ == "PatentSizeException"
+        return
+    assert results == {src: 4}
+    records = read_jsonl(str(tmp_path / "EP0600000.jsonl.quarantine.jsonl"))
+    assert len(records) == 2 and records[0]["row"].startswith("EP-")
+    assert records[0]["error"].startswith("PatentSizeException")
+    expected = {"PatentSizeException": 2}
+    assert read_json(str(tmp_path / "stats.json"))["total"]["errors"] == expected
+    assert read_json(str(tmp_path / "metrics.json"))["total"]["errors"] == expected
+
+
+def test_rate_limited_warnings(capsys):
+    warnings = RateLimitedWarnings(limit=2)
+    for i in range(5):
+        warnings.warn("multi_value", f"warning {i}")
+    assert warnings.counts == {"multi_value": 5}
+    out = capsys.readouterr().out
+    assert "warning 1" in out and "warning 2" not in out
+
+
+def test_cli_import_time():
+    heavy = ["pandas", "jsonschema", "html2text", "pyarrow", "google.cloud"]
+    code = (
+        "import sys; import parseepo.cli; "
+        f"print([m for m in {heavy} if m in sys.modules])"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+    assert out == ["[]"]
+
+
+def test_cli_schema(tmp_path):
+    dest = str(tmp_path / "schema.json")
+    result = CliRunner().invoke(app, ["schema", dest, "--attrs", "TITLE,CLAIM"])
+    assert result.exit_code == 0
+    with open(dest, "r") as fin:
+        schema = json.load(fin)
+    assert [field_["name"] for field_ in schema] == [
+        field_["name"] for field_ in bq_schema(attrs=["TITLE", "CLAIM"])
+    ]
+
+
+def test_cli_serialize_bad_option(tmp_path):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 1)
+    result = CliRunner().invoke(app, ["serialize", src, "--executor", "fork"])
+    assert result.exit_code == 2 and not isinstance(result.exception, AssertionError)
+    assert "--executor" in result.output and "should be one of" in result.output
+    assert not os.path.exists(tmp_path / "EP0600000.jsonl")
+
+
+def test_leases(tmp_path, monkeypatch):
+    lease_dir = str(tmp_path / "leases")
+    a, b = Leases(lease_dir, ttl=60, owner="a"), Leases(lease_dir, ttl=60, owner="b")
+    assert a.acquire("EP0600000.txt") and not b.acquire("EP0600000.txt")
+    assert a.renew() == []
+    os.utime(a.get_lease("EP0600000.txt"), (0, 0))  # a is dead
+    assert b.acquire("EP0600000.txt")
+    assert a.renew() == ["EP0600000.txt"]
+    b.done("EP0600000.txt", nb_patents=3)
+    assert b.get_marker("EP0600000.txt") == {"owner": "b", "nb_patents": 3}
+    assert os.listdir(lease_dir) == ["EP0600000.txt.done"]
+    assert not a.acquire("EP0600000.txt")
+    with pytest.raises(AssertionError):
+        a.done("EP0600000.txt")  # lost
+
+    # a renews between the expiry check and the reclaim of b: the lease is put back
+    assert a.acquire("EP0600001.txt")
+    lease = a.get_lease("EP0600001.txt")
+    os.utime(lease, (0, 0))
+    content, _ = b._read(lease)
+    os.utime(lease)
+    b._reclaim(lease, content)
+    assert a.is_held("EP0600001.txt") and not b.acquire("EP0600001.txt")
+
+    # c claims the task while b puts the lease back: the lease of c is not overwritten
+    c = Leases(lease_dir, ttl=60, owner="c")
+    os.utime(lease, (0, 0))
+    content, _ = b._read(lease)
+    os.utime(lease)
+    read = b._read
+
+    def read_and_claim(path):
+        if path.endswith(".stale"):
+            assert c.acquire("EP0600001.txt")
+        return read(path)
+
+    monkeypatch.setattr(b, "_read", read_and_claim)
+    b._reclaim(lease, content)
+    assert json.loads(read(lease)[0])["owner"] == "c"
+    assert not [file for file in os.listdir(lease_dir) if file.endswith(".stale")]
+    assert c.is_held("EP0600001.txt") and a.renew() == ["EP0600001.txt"]
+
+
+def test_process_epo_files_lost_lease(tmp_path, monkeypatch):
+    src = str(tmp_path / "EP0600000.txt")
+    write_sample(src, 2)
+    lease_dir = str(tmp_path / "leases")
+    other = Leases(lease_dir, owner="other")
+
+    def process_epo_file(src, dest, **kwargs):  # stalls, its lease is reclaimed
+        os.utime(other.get_lease("EP0600000.txt"), (0, 0))
+        other.acquire("EP0600000.txt")
+        return 3
+
+    monkeypatch.setattr(process, "process_epo_file", process_epo_file)
+    results, errors = process_epo_files(
+        [src], executor="thread", split=2, lease_dir=lease_dir
+    )
+    assert results == {} and errors == {}
+    assert not os.path.exists(str(tmp_path / "EP0600000.jsonl"))  # not stitched
+    assert os.listdir(lease_dir) == ["EP0600000.txt.lease"]  # held by other
+
+
+def test_process_epo_files_stalled_lease(tmp_path, monkeypatch):
+    src, dest = str(tmp_path / "EP0600000.txt"), str(tmp_path / "EP0600000.jsonl")
+    write_sample(src, 4)
+    process_epo_file(src, str(tmp_path / "expected.jsonl"), progress=queue.Queue())
+    lease_dir = str(tmp_path / "leases")
+    process_epo_file_, serialize = process.process_epo_file, process.ENGINES["python"]
+    stitch, current = process.stitch, {}
+    stalled, resumed, writing, stitched = [threading.Event() for _ in range(4)]
+
+    def process_and_stall(src, dest, start=None, **kwargs):
+        if not stalled.is_set():  # the first run stalls, its lease is reclaimed
+            stalled.set()
+            assert resumed.wait(10)
+        current["start"] = start
+        return process_epo_file_(src, dest, start=start, **kwargs)
+
+    def serialize_and_wait(*args, **kwargs):
+        if resumed.is_set() and current["start"] and not writing.is_set():
+            writing.set()  # 2nd part of the first run, being written
+            stitched.wait(10)
+        return serialize(*args, **kwargs)
+
+    def stitch_and_resume(parts, dest):  # the second run stitches its parts
+        resumed.set()
+        assert writing.wait(10)
+        stitch(parts, dest)
+        stitched.set()
+
+    monkeypatch.setattr(process, "process_epo_file", process_and_stall)
+    monkeypatch.setitem(process.ENGINES, "python", serialize_and_wait)
+    monkeypatch.setattr(process, "stitch", stitch_and_resume)
+    kwargs = {"executor": "thread", "split": 2, "lease_dir": lease_dir, "lease_ttl": 60}
+    runs = []
+    first = threading.Thread(
+        target=lambda: runs.append(process_epo_files([src], max_workers=1, **kwargs))
+    )
+    first.start()
+    assert stalled.wait(10)
+    os.utime(os.path.join(lease_dir, "EP0600000.txt.lease"), (0, 0))
+    assert process_epo_files([src], **kwargs) == ({src: 12}, {})
+    first.join()
+    assert runs == [({}, {})]
+    assert read_bytes(dest) == read_bytes(str(tmp_path / "expected.jsonl"))
+    assert sorted(os.listdir(tmp_path)) == [
+        "EP0600000.jsonl",
+        "EP0600000.txt",
+        "expected.jsonl",
+        "leases",
+    ]
+    assert os.listdir(lease_dir) == ["EP0600000.txt.done"]
+
+
+def serialize_leased(files, lease_dir):
+    return process_epo_files(
+        files, executor="thread", max_workers=1, lease_dir=lease_dir, lease_ttl=1.5
+    )
+
+
+def test_process_epo_files_leases(tmp_path):
+    files = [str(tmp_path / f"EP060000{i}.txt") for i in range(6)]
+    for file in files:
+        write_sample(file, 1)
+    lease_dir = str(tmp_path / "leases")
+    dead = Leases(lease_dir, owner="dead")
+    dead.acquire("EP0600000.txt")
+    os.utime(dead.get_lease("EP0600000.txt"), (0, 0))
+    with multiprocessing.get_context("fork").Pool(3) as pool:
+        runs = pool.starmap(serialize_leased, [(files, lease_dir)] * 3)
+    serialized = [src for results, errors in runs for src in results]
+    assert sorted(serialized) == files  # each file once
+    assert all(not errors for _, errors in runs)
+    for file in files:
+        assert len(read_jsonl(file.replace("txt", "jsonl"))) == 3
+    assert sorted(os.listdir(lease_dir)) == [
+        f"{os.path.basename(file)}.done" for file in files
+    ]
+
+
+def test_schedule_largest_first(tmp_path, monkeypatch, capsys):
+    files = [str(tmp_path / f"EP060000{i}.txt") for i in range(3)]
+    for file, nb_copies in zip(files, [1, 3, 2]):
+        write_sample(file, nb_copies)
+    with open(files[1], "rb") as fin, gzip.open(files[1] + ".gz", "wb") as fout:
+        fout.write(fin.read() * 2)
+    files += [files.pop(1) + ".gz"]
+    assert estimate_size(files[-1]) == 2 * os.path.getsize(files[-1][:-3])
+    order = []
+    monkeypatch.setattr(
+        process, "process_epo_file", lambda src, dest, **kwargs: order.append(src) or 3
+    )
+    results, _ = process_epo_files(files, executor="thread", max_workers=1)
+    assert order == [files[2], files[1], files[0]]  # 6, 2 and 1 copies
+    assert results == {file: 3 for file in files}
+    assert "Slowest 3 of 3 file(s)" in capsys.readouterr().out
+
+    # chunks are scheduled largest first across files: 6 copies > 2 x 4 copies
+    write_sample(files[0], 8)
+    order.clear()
+    monkeypatch.setattr(
+        process,
+        "process_epo_file",
+        lambda src, dest, start=None, **kwargs: order.append((src, start)) or 3,
+    )
+    process_epo_files(
+        files[::2], executor="thread", max_workers=1, split=2, stitch_parts=False
+    )
+    assert [src for src, _ in order] == [files[2], files[0], files[0]]